@@ -2,31 +2,38 @@
 import asyncio
 from playwright.async_api import async_playwright
 import json
-import urllib.parse
 import os
+import time
 
-async def scrape_product_details(page, url):
+import asset_cache
+import canary
+import catalog_store
+import metrics
+import sfcc_url
+import storage_state
+import variation_fetch
+import variation_matrix
+
+async def scrape_product_fields(page, url, size_matrix=None):
     """
-    采集单个产品的详细信息并返回一个字典
+    采集单个产品的详细信息，返回 (product_data, missing_fields)；缺少关键字段时 product_data 为 None，
+    missing_fields 列出缺少的字段，供 canary 计算各字段的 N/A 率。
+    size_matrix 为已知的宽度×尺码矩阵（variation_matrix.py 按款式采集的结果），给出时不再 fetch 各宽度片段
     """
-    await page.goto(url)
-    await page.wait_for_load_state('domcontentloaded')
+    with metrics.timer('detail', 'navigation'):
+        await page.goto(url)
+        await page.wait_for_load_state('domcontentloaded')
 
-    # 如果是 SFCC 的 Product-Variation 片段地址，自动跳到完整的 Product-Show 页面
-    if 'Product-Variation' in url:
-        try:
-            parsed = urllib.parse.urlparse(url)
-            query = urllib.parse.parse_qs(parsed.query)
-            pid_values = query.get('pid')
-            if pid_values and len(pid_values) > 0:
-                pid = pid_values[0]
-                base = url.split('Product-Variation')[0]
-                product_show_url = urllib.parse.urljoin(base, f'Product-Show?pid={pid}')
+        # 如果是 SFCC 的 Product-Variation 片段地址，自动跳到完整的 Product-Show 页面
+        product_show_url = sfcc_url.product_show_url(url)
+        if product_show_url != url:
+            try:
                 await page.goto(product_show_url)
                 await page.wait_for_load_state('domcontentloaded')
-        except Exception:
-            pass
+            except Exception:
+                pass
 
+    extraction_started = time.perf_counter()
     # 提取产品标题
     title_element = await page.query_selector('span.heading-1')
     title = await title_element.inner_text() if title_element else 'N/A'
@@ -209,6 +216,7 @@ async def scrape_product_details(page, url):
         'description': description.strip(),
         'image_urls': list(set(image_urls)) # 使用 set 去重，然后转回 list
     }
+    metrics.observe('detail', 'extraction_seconds', time.perf_counter() - extraction_started)
 
     # 检查是否有N/A字段或空的图片URL
     missing_fields = []
@@ -224,11 +232,52 @@ async def scrape_product_details(page, url):
         missing_fields.append('image_urls')
 
     if missing_fields:
-        print(f"警告: URL {url} 缺少关键数据: {', '.join(missing_fields)}。请检查规则。")
-        return None
+        return None, missing_fields
+
+    if size_matrix:
+        product_data['size_matrix'] = size_matrix
+    elif variation_fetch.WIDTH_MATRIX_ENABLED:
+        # 在当前页面内 fetch 其他宽度的片段，一次得到完整的宽度×尺码矩阵，不再为每个宽度单独打开详情页
+        try:
+            with metrics.timer('detail', 'fetch'):
+                swatches = await page.evaluate(variation_fetch.WIDTH_SWATCHES_JS)
+                matrices = await variation_fetch.fetch_size_matrices(page, variation_fetch.width_variation_items(url, swatches))
+            if url in matrices:
+                product_data['size_matrix'] = matrices[url]
+        except Exception as e:
+            print(f"警告: URL {url} 读取宽度×尺码矩阵失败: {e}")
     
+    return product_data, []
+
+async def scrape_product_details(page, url, size_matrix=None):
+    """
+    采集单个产品的详细信息并返回一个字典，缺少关键数据时返回 None
+    """
+    product_data, missing_fields = await scrape_product_fields(page, url, size_matrix)
+    if missing_fields:
+        print(f"警告: URL {url} 缺少关键数据: {', '.join(missing_fields)}。请检查规则。")
     return product_data
 
+async def scrape_items(page, items, fetch_mode, fetch_concurrency=6):
+    """
+    按当前采集模式采集一组待处理项（预检样本），返回 [(url, product_data 或 None, 错误说明, 缺失字段列表)]。
+    batch 模式要求 page 已打开店铺页面。
+    """
+    if fetch_mode == 'batch':
+        known_matrices = {item['url']: item['size_matrix'] for item in items if item.get('size_matrix')}
+        with metrics.timer('detail', 'fetch'):
+            return await variation_fetch.fetch_product_batch(
+                page, [item['url'] for item in items], fetch_concurrency, known_matrices)
+    results = []
+    for item in items:
+        try:
+            product_data, missing_fields = await scrape_product_fields(page, item['url'], item.get('size_matrix'))
+            error = f"缺少关键数据: {', '.join(missing_fields)}" if missing_fields else ''
+            results.append((item['url'], product_data, error, missing_fields))
+        except Exception as e:
+            results.append((item['url'], None, str(e), []))
+    return results
+
 async def main():
     """
     主函数：从 initial_urls.json 获取初始 URL 列表，然后采集详细信息
@@ -236,7 +285,11 @@ async def main():
     async with async_playwright() as p:
         # 调试：使用无头模式，避免本地打开浏览器窗口
         browser = await p.chromium.launch(headless=True)
-        page = await browser.new_page()
+        # 从预热好的 storage_state 启动，首次导航不再经历同意弹窗和地区跳转
+        context = await storage_state.new_context(browser)
+        await asset_cache.attach_if_enabled(context)
+        page = await context.new_page()
+        metrics.attach_page(page, 'detail')
         
         initial_urls_file = '所有颜色变体URL_Cursor_dedup.json'
         output_json_file = 'birkenstock_all_products_details.json'
@@ -262,39 +315,78 @@ async def main():
             await browser.close()
             return
 
-        # 尝试加载已有的产品数据，如果文件不存在则初始化为空列表
-        try:
-            with open(output_json_file, 'r', encoding='utf-8') as f:
-                all_products_data = json.load(f)
-            print(f"从 {output_json_file} 读取到 {len(all_products_data)} 条已采集数据。")
-        except FileNotFoundError:
-            all_products_data = []
-            print(f"文件 '{output_json_file}' 不存在，将创建新文件。")
-        except json.JSONDecodeError:
-            print(f"警告：无法解码 '{output_json_file}' 中的 JSON。将覆盖现有文件。")
-            all_products_data = []
-        except Exception as e:
-            print(f"读取已采集数据文件时发生错误: {e}。将覆盖现有文件。")
-            all_products_data = []
+        # CATALOG_DB：已采集数据和 N/A 记录写入 SQLite 目录库，按 url 点查，不再每条产品重写整个 JSON 文件
+        store = catalog_store.CatalogStore() if os.getenv('CATALOG_DB') else None
+        if store is not None:
+            # 首次使用数据库时先导入已有的 JSON 结果
+            if store.detail_count() == 0 and os.path.exists(output_json_file):
+                print(f"从 {output_json_file} 导入 {store.import_details(output_json_file)} 条已采集数据到 {store.path}。")
+            if store.failure_count() == 0 and os.path.exists(na_log_file):
+                print(f"从 {na_log_file} 导入 {store.import_failures(na_log_file)} 条N/A记录到 {store.path}。")
+            na_urls = store.failed_urls()
+            print(f"目录库 {store.path} 中已有 {store.detail_count()} 条已采集数据，{len(na_urls)} 条N/A记录。")
+        else:
+            # 尝试加载已有的产品数据，如果文件不存在则初始化为空列表
+            try:
+                with open(output_json_file, 'r', encoding='utf-8') as f:
+                    all_products_data = json.load(f)
+                print(f"从 {output_json_file} 读取到 {len(all_products_data)} 条已采集数据。")
+            except FileNotFoundError:
+                all_products_data = []
+                print(f"文件 '{output_json_file}' 不存在，将创建新文件。")
+            except json.JSONDecodeError:
+                print(f"警告：无法解码 '{output_json_file}' 中的 JSON。将覆盖现有文件。")
+                all_products_data = []
+            except Exception as e:
+                print(f"读取已采集数据文件时发生错误: {e}。将覆盖现有文件。")
+                all_products_data = []
         
-        # 尝试加载已有的N/A记录，如果文件不存在则初始化为空列表
-        try:
-            with open(na_log_file, 'r', encoding='utf-8') as f:
-                na_urls = [line.strip() for line in f.readlines() if line.strip()]
-            print(f"从 {na_log_file} 读取到 {len(na_urls)} 条N/A记录。")
-        except FileNotFoundError:
-            na_urls = []
-            print(f"文件 '{na_log_file}' 不存在，将创建新文件。")
-        except Exception as e:
-            print(f"读取N/A记录文件时发生错误: {e}。将创建新文件。")
-            na_urls = []
+            # 尝试加载已有的N/A记录，如果文件不存在则初始化为空列表
+            try:
+                with open(na_log_file, 'r', encoding='utf-8') as f:
+                    na_urls = [line.strip() for line in f.readlines() if line.strip()]
+                print(f"从 {na_log_file} 读取到 {len(na_urls)} 条N/A记录。")
+            except FileNotFoundError:
+                na_urls = []
+                print(f"文件 '{na_log_file}' 不存在，将创建新文件。")
+            except Exception as e:
+                print(f"读取N/A记录文件时发生错误: {e}。将创建新文件。")
+                na_urls = []
         
-        # 创建一个集合来存储已处理的URL，避免重复采集
-        processed_urls_set = {p['url'] for p in all_products_data}
+        # 创建一个集合来存储已处理的颜色，避免重复采集（按 variation_fetch.detail_key：采集宽度矩阵时同一颜色的不同宽度只采集一次，
+        # WIDTH_MATRIX=0 时按变体；不同URL写法都视为同一条）
+        processed_urls_set = {variation_fetch.detail_key(p['url']) for p in all_products_data}
         # 可配置：是否排除已记录为N/A的URL（默认排除）
         exclude_na = os.getenv('EXCLUDE_NA', '1') == '1'
         if exclude_na:
-            processed_urls_set.update(set(na_urls))
+            processed_urls_set.update(variation_fetch.detail_key(url) for url in na_urls)
+
+        def is_processed(url):
+            if store is not None:
+                return store.has_detail(url) or (exclude_na and store.has_failure(url))
+            return variation_fetch.detail_key(url) in processed_urls_set
+
+        def record_na(url, reason=None):
+            if store is not None:
+                store.record_failure(url, 'details', reason)
+                store.commit()
+            if url not in na_urls:
+                na_urls.append(url)
+                with open(na_log_file, 'a', encoding='utf-8') as f:
+                    f.write(url + '\n')
+                return True
+            return False
+
+        def save_products(products):
+            with metrics.timer('detail', 'write'):
+                if store is not None:
+                    for product_data in products:
+                        store.upsert_detail(product_data)
+                    store.commit()
+                    return
+                all_products_data.extend(products)
+                with open(output_json_file, 'w', encoding='utf-8') as f:
+                    json.dump(all_products_data, f, ensure_ascii=False, indent=4)
         
         # 存储所有待处理的URL和对应的分类
         urls_to_process_with_category = []
@@ -306,14 +398,15 @@ async def main():
             # 结构一：每项直接是单个URL（本文件 dedup.json 的结构）
             if 'url' in category_data:
                 url = category_data.get('url')
-                if url and url not in processed_urls_set:
+                if url and not is_processed(url):
                     urls_to_process_with_category.append({
                         'url': url,
                         'category': {
                             'level1_category': level1,
                             'level2_category': level2,
                             'level3_category': level3
-                        }
+                        },
+                        'size_matrix': variation_matrix.exact_size_matrix(category_data)
                     })
                 continue
 
@@ -321,7 +414,7 @@ async def main():
             product_urls = category_data.get('product_urls')
             if isinstance(product_urls, list):
                 for url in product_urls:
-                    if url not in processed_urls_set:
+                    if not is_processed(url):
                         urls_to_process_with_category.append({
                             'url': url,
                             'category': {
@@ -342,6 +435,97 @@ async def main():
         if not exclude_na:
             print("提示：当前未排除 N/A 记录，可能会重试之前失败的 URL。")
 
+        # FETCH_MODE=batch：只打开一个店铺页面，在页面内批量 fetch 产品片段，不再逐个导航
+        fetch_mode = os.getenv('FETCH_MODE', 'navigate')
+        batch_size = int(os.getenv('BATCH_SIZE', '20'))
+        fetch_concurrency = int(os.getenv('FETCH_CONCURRENCY', '6'))
+        if fetch_mode == 'batch' and urls_to_process_with_category:
+            storefront_url = storage_state.locale_root(urls_to_process_with_category[0]['url'])
+            await page.goto(storefront_url, timeout=60000)
+            await page.wait_for_load_state('domcontentloaded')
+            print(f"批量模式：已打开 {storefront_url}，每批 {batch_size} 条，页面内并发 {fetch_concurrency}。")
+
+        # 金丝雀预检：先按一级分类分层抽样试采集，选择器失效时不开始正式采集（CANARY=0 关闭）
+        aborted = False
+        monitor = canary.NaMonitor()
+        if canary.ENABLED and urls_to_process_with_category:
+            sample = canary.stratified_sample(urls_to_process_with_category)
+            print(f"预检：分层抽取 {len(sample)} 个URL试采集。")
+            sample_results = await scrape_items(page, sample, fetch_mode, fetch_concurrency)
+            preflight = canary.NaMonitor(window=None)
+            for url, product_data, error, missing_fields in sample_results:
+                preflight.observe(missing_fields, error)
+            breaches = preflight.breaches(min_samples=1)
+            print(f"预检各字段N/A率: {canary.format_rates(preflight.rates())}")
+            if breaches:
+                # 样本失败大概率是页面结构变化，不记入N/A，避免下次运行被当作已处理排除
+                print(f"预检未通过: {canary.format_breaches(breaches)}。请检查选择器后重试，本次不开始正式采集。")
+                aborted = True
+                urls_to_process_with_category = []
+            else:
+                category_by_url = {item['url']: item['category'] for item in sample}
+                sample_products = []
+                for url, product_data, error, missing_fields in sample_results:
+                    monitor.observe(missing_fields, error)
+                    if product_data:
+                        product_data['category'] = category_by_url[url]
+                        sample_products.append(product_data)
+                        processed_urls_set.add(variation_fetch.detail_key(url))
+                    else:
+                        print(f"警告: URL {url} 采集失败: {error}")
+                        record_na(url, error)
+                save_products(sample_products)
+                sampled_urls = set(category_by_url)
+                urls_to_process_with_category = [item for item in urls_to_process_with_category
+                                                 if item['url'] not in sampled_urls]
+                print(f"预检通过，样本中 {len(sample_products)} 条已保存，继续采集其余 {len(urls_to_process_with_category)} 条。")
+        total_urls_to_process = len(urls_to_process_with_category)
+
+        def check_monitor():
+            """
+            滚动窗口内某个字段的N/A率超过阈值时返回 True（停止采集）。
+            """
+            breaches = monitor.breaches() if canary.ENABLED else []
+            if breaches:
+                print(f"最近 {len(monitor.results)} 条结果的N/A率超过阈值: {canary.format_breaches(breaches)}。"
+                      f"停止采集，请检查选择器；修复后可用 EXCLUDE_NA=0 重试最近记入N/A的URL。")
+            return bool(breaches)
+
+        if fetch_mode == 'batch' and urls_to_process_with_category:
+
+            for start in range(0, total_urls_to_process, batch_size):
+                batch_items = urls_to_process_with_category[start:start + batch_size]
+                category_by_url = {item['url']: item['category'] for item in batch_items}
+                known_matrices = {item['url']: item['size_matrix'] for item in batch_items if item.get('size_matrix')}
+                print(f"正在处理第 {start + 1}-{start + len(batch_items)}/{total_urls_to_process} 条URL")
+                try:
+                    with metrics.timer('detail', 'fetch'):
+                        batch_results = await variation_fetch.fetch_product_batch(
+                            page, list(category_by_url), fetch_concurrency, known_matrices)
+                except Exception as e:
+                    print(f"批量采集时发生错误: {e}")
+                    batch_results = [(url, None, str(e), []) for url in category_by_url]
+
+                batch_products = []
+                for url, product_data, error, missing_fields in batch_results:
+                    monitor.observe(missing_fields, error if not product_data else None)
+                    if product_data:
+                        product_data['category'] = category_by_url[url]
+                        batch_products.append(product_data)
+                        processed_urls_set.add(variation_fetch.detail_key(url))
+                    else:
+                        print(f"警告: URL {url} 采集失败: {error}")
+                        record_na(url, error)
+
+                # 每批保存一次
+                save_products(batch_products)
+                print(f"已保存本批数据到 {store.path if store is not None else output_json_file}。")
+                print("---")
+                if check_monitor():
+                    aborted = True
+                    break
+            urls_to_process_with_category = []
+
         for i, item in enumerate(urls_to_process_with_category):
             url = item['url']
             category = item['category']
@@ -349,41 +533,47 @@ async def main():
             
             try:
                 print(f"开始采集产品信息: {url}")
-                product_data = await scrape_product_details(page, url)
+                product_data, missing_fields = await scrape_product_fields(page, url, item.get('size_matrix'))
+                monitor.observe(missing_fields)
                 
                 if product_data:
                     product_data['category'] = category
-                    all_products_data.append(product_data)
-                    processed_urls_set.add(url)
+                    processed_urls_set.add(variation_fetch.detail_key(url))
                     
-                    # 每采集一次就写入一次 JSON 文件
-                    with open(output_json_file, 'w', encoding='utf-8') as f:
-                        json.dump(all_products_data, f, ensure_ascii=False, indent=4)
-                    print(f"已采集产品数据并保存到 {output_json_file}。")
+                    # 每采集一次就保存一次
+                    save_products([product_data])
+                    print(f"已采集产品数据并保存到 {store.path if store is not None else output_json_file}。")
                 else:
+                    print(f"警告: URL {url} 缺少关键数据: {', '.join(missing_fields)}。请检查规则。")
                     print(f"因数据缺失中断采集。请检查URL: {url}")
                     # 记录N/A的URL到文件
-                    if url not in na_urls:
-                        na_urls.append(url)
-                        with open(na_log_file, 'a', encoding='utf-8') as f:
-                            f.write(url + '\n')
+                    if record_na(url, 'missing fields'):
                         print(f"已将N/A URL记录到 {na_log_file}。")
-                    continue 
                 print("---")
                 
             except Exception as e:
                 print(f"处理URL {url} 时发生错误: {e}")
+                monitor.observe(error=str(e))
                 # 记录出错的URL到N/A文件
-                if url not in na_urls:
-                    na_urls.append(url)
-                    with open(na_log_file, 'a', encoding='utf-8') as f:
-                        f.write(url + '\n')
+                if record_na(url, str(e)):
                     print(f"已将出错URL记录到 {na_log_file}。")
+
+            if check_monitor():
+                aborted = True
+                break
             
-        print(f"所有待处理产品数据已成功保存到 {output_json_file} 文件。")
+        if store is not None:
+            # 导出 JSON，供尚未迁移到目录库的后续步骤使用
+            print(f"从 {store.path} 导出 {store.export_details(output_json_file)} 条产品数据。")
+            store.close()
+        if aborted:
+            print("采集已因N/A率超过阈值提前停止。")
+        else:
+            print(f"所有待处理产品数据已成功保存到 {output_json_file} 文件。")
         print(f"N/A记录已保存到 {na_log_file} 文件，共 {len(na_urls)} 条记录。")
 
         await browser.close()
+        metrics.finish('detail')
 
 if __name__ == "__main__":
     asyncio.run(main())
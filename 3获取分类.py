@@ -2,22 +2,57 @@
 import asyncio
 from playwright.async_api import async_playwright
 import json
+import os
+import time
+
+import asset_cache
+import metrics
+import nav_tree
+import storage_state
+
+# 与 第一步_JS获取导航栏链接.js 写同一个文件：第二步读取它，版本记录也只来自它
+OUTPUT_FILE = '第一步_导航目录.json'
+
+def _file_tree_hash(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return nav_tree.tree_hash(json.load(f))
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
 
 async def scrape_categories(initial_url):
     """
     采集给定页面上所有分类的URL和标题，包括一级、二级和三级分类。
+    结果按版本保存并与上一版本做结构比较（见 nav_tree.py）；导航菜单 HTML 未变化时不启动浏览器。
     """
+    # 快速路径：用普通 HTTP 请求取导航菜单并计算哈希，与上一版本相同时直接沿用
+    with metrics.timer('nav', 'fetch'):
+        html_hash = nav_tree.fetch_nav_hash(initial_url)
+    latest = nav_tree.check_fast_path(html_hash)
+    if latest is not None:
+        if _file_tree_hash(OUTPUT_FILE) != latest['tree_hash']:
+            # 文件缺失或与最新版本不一致（例如被其他来源覆盖）：写回最新版本，保证第二步读到的就是已记录的版本
+            with metrics.timer('nav', 'write'), open(OUTPUT_FILE, 'w', encoding='utf-8') as f:
+                json.dump(nav_tree.load_tree(latest), f, ensure_ascii=False, indent=4)
+        print(f"导航菜单 HTML 未变化，沿用第 {latest['version']} 版分类树（{OUTPUT_FILE}），未启动浏览器。")
+        metrics.finish('nav')
+        return
+
     async with async_playwright() as p:
         browser = await p.chromium.launch(headless=False)
-        page = await browser.new_page()
+        context = await storage_state.new_context(browser, storage_state.locale_root(initial_url))
+        await asset_cache.attach_if_enabled(context)
+        page = await context.new_page()
+        metrics.attach_page(page, 'nav')
         
         all_categories_data = []
 
         try:
             print(f"导航到初始URL: {initial_url}")
-            await page.goto(initial_url)
-            await page.wait_for_load_state('domcontentloaded')
-            await page.wait_for_timeout(2000) # 等待页面加载完成，特别是动态内容
+            with metrics.timer('nav', 'navigation'):
+                await page.goto(initial_url)
+                await page.wait_for_load_state('domcontentloaded')
+            await metrics.wait(page, 'nav', 2000) # 等待页面加载完成，特别是动态内容
 
             # 提取所有一级分类
             first_level_category_elements = await page.query_selector_all('a.xlt-firstLevelCategory.a-level-1')
@@ -44,7 +79,8 @@ async def scrape_categories(initial_url):
 
                     # 模拟鼠标悬停以展开子菜单
                     await first_level_element.hover()
-                    await page.wait_for_timeout(1000) # 等待子菜单显示
+                    await metrics.wait(page, 'nav', 1000) # 等待子菜单显示
+                    extraction_started = time.perf_counter()
 
                     # 提取二级分类
                     # 假设二级分类在展开的菜单中，并且可以通过 'a.a-level-2' 选择器找到
@@ -93,23 +129,29 @@ async def scrape_categories(initial_url):
                             first_level_data["sub_categories"].append(second_level_data)
                     
                     all_categories_data.append(first_level_data)
+                    metrics.observe('nav', 'extraction_seconds', time.perf_counter() - extraction_started)
                     # 鼠标移开，关闭当前一级菜单，为下一个一级菜单做准备
                     await page.mouse.move(0, 0) # 移动鼠标到页面左上角
-                    await page.wait_for_timeout(500) # 等待菜单收起
+                    await metrics.wait(page, 'nav', 500) # 等待菜单收起
 
             print(f"总共找到 {len(all_categories_data)} 个一级分类。")
             print("---")
 
             # 将分类数据写入JSON文件
-            with open('birkenstock_categories_full.json', 'w', encoding='utf-8') as f:
+            with metrics.timer('nav', 'write'), open(OUTPUT_FILE, 'w', encoding='utf-8') as f:
                 json.dump(all_categories_data, f, ensure_ascii=False, indent=4)
             
-            print("所有分类的URL和标题已成功保存到 birkenstock_categories_full.json 文件。")
+            print(f"所有分类的URL和标题已成功保存到 {OUTPUT_FILE} 文件。")
+
+            # 记录版本并输出与上一版本的结构差异
+            if all_categories_data:
+                nav_tree.record_tree(all_categories_data, html_hash, source=OUTPUT_FILE)
 
         except Exception as e:
             print(f"发生错误: {e}")
         finally:
             await browser.close()
+            metrics.finish('nav')
 
 if __name__ == "__main__":
     categories_page_url = 'https://www.birkenstock.com/us/' 
@@ -1,6 +1,105 @@
-import json
 import csv
+import functools
+import hashlib
+import io
+import itertools
+import json
+import os
 import re
+import shutil
+import sys
+import tempfile
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+import json_stream
+import metrics
+import sfcc_url
+
+# 预编译的清洗规则，导出时每个变体都会用到
+_HANDLE_STRIP = re.compile(r'[^a-z0-9\s-]')
+_HANDLE_DASHES = re.compile(r'[\s-]+')
+_SKU_STRIP = re.compile(r'[^a-zA-Z0-9]')
+# 尺码中的分隔符不能直接去掉（5-5.5 与 55 会得到相同的 SKU），小数点保留，其余分隔符统一为 '-'
+_SIZE_SEPARATORS = re.compile(r'[^a-zA-Z0-9.]+')
+
+# 变体模型：compact（合并为单个 Size 选项）或 cartesian（原来的女码×男码笛卡尔积）
+VARIANT_MODEL = os.getenv('VARIANT_MODEL', 'compact')
+
+Type = 'Customize' # 定义产品类型
+Vendor = 'Birkenstock' # 品牌名称
+
+# 使用官方模板的完整表头
+HEADERS = [
+    'Handle', 'Title', 'Body (HTML)', 'Vendor', 'Product Category', 'Type', 'Tags', 'Published',
+    'Option1 Name', 'Option1 Value', 'Option2 Name', 'Option2 Value', 'Option3 Name', 'Option3 Value',
+    'Variant SKU', 'Variant Grams', 'Variant Inventory Tracker', 'Variant Inventory Qty',
+    'Variant Inventory Policy', 'Variant Fulfillment Service', 'Variant Price', 'Variant Compare At Price',
+    'Variant Requires Shipping', 'Variant Taxable', 'Variant Barcode', 'Image Src', 'Image Position', 
+    'Image Alt Text', 'Gift Card', 'SEO Title', 'SEO Description', 'Google Shopping / Google Product Category',
+    'Google Shopping / Gender', 'Google Shopping / Age Group', 'Google Shopping / MPN', 
+    'Google Shopping / Condition', 'Google Shopping / Custom Product', 'Variant Image', 'Variant Weight Unit',
+    'Variant Tax Code', 'Cost per item', 'Included / United States', 'Price / United States',
+    'Compare At Price / United States', 'Included / International', 'Price / International',
+    'Compare At Price / International', 'Status'
+]
+_COL = {header: i for i, header in enumerate(HEADERS)}
+
+# 变体行中所有产品都相同的字段
+_VARIANT_CONSTANTS = {
+    'Variant Grams': '500',
+    'Variant Inventory Tracker': 'shopify',
+    'Variant Inventory Qty': '100',
+    'Variant Inventory Policy': 'deny',
+    'Variant Fulfillment Service': 'manual',
+    'Variant Requires Shipping': 'TRUE',
+    'Variant Taxable': 'TRUE',
+}
+# 主产品行中所有产品都相同的字段（变体字段之外）
+_MAIN_CONSTANTS = dict(_VARIANT_CONSTANTS, **{
+    'Vendor': Vendor,
+    'Product Category': '',
+    'Type': Type,
+    'Published': 'TRUE',
+    'Variant Barcode': '',
+    'Image Position': '1',
+    'Gift Card': 'FALSE',
+    'Google Shopping / Google Product Category': '212',  # 鞋类
+    'Google Shopping / Gender': 'unisex',
+    'Google Shopping / Age Group': 'adult',
+    'Google Shopping / Condition': 'new',
+    'Google Shopping / Custom Product': 'TRUE',
+    'Variant Weight Unit': 'g',
+    'Included / United States': 'TRUE',
+    'Included / International': 'TRUE',
+    'Status': 'active',
+})
+
+
+def _template(values):
+    row = [''] * len(HEADERS)
+    for header, value in values.items():
+        row[_COL[header]] = value
+    return row
+
+
+_MAIN_TEMPLATE = _template(_MAIN_CONSTANTS)
+_VARIANT_TEMPLATE = _template(_VARIANT_CONSTANTS)
+_EMPTY_TEMPLATE = [''] * len(HEADERS)
+
+# 常用列下标
+_C_HANDLE = _COL['Handle']
+_C_OPT1_NAME, _C_OPT1_VALUE = _COL['Option1 Name'], _COL['Option1 Value']
+_C_OPT2_NAME, _C_OPT2_VALUE = _COL['Option2 Name'], _COL['Option2 Value']
+_C_OPT3_NAME, _C_OPT3_VALUE = _COL['Option3 Name'], _COL['Option3 Value']
+_C_SKU = _COL['Variant SKU']
+_C_PRICE = _COL['Variant Price']
+_C_COMPARE = _COL['Variant Compare At Price']
+_C_IMAGE_SRC = _COL['Image Src']
+_C_IMAGE_POSITION = _COL['Image Position']
+_C_IMAGE_ALT = _COL['Image Alt Text']
+
 
 def generate_handle(title, color):
     """
@@ -17,8 +116,8 @@ def generate_handle(title, color):
 
     def _sanitize(text):
         # 移除特殊字符，转为小写，用连字符替换空格
-        s = re.sub(r'[^a-z0-9\s-]', '', str(text).lower())
-        s = re.sub(r'[\s-]+', '-', s).strip('-')
+        s = _HANDLE_STRIP.sub('', str(text).lower())
+        s = _HANDLE_DASHES.sub('-', s).strip('-')
         return s
 
     handle_base = _sanitize(title_part)
@@ -29,12 +128,22 @@ def generate_handle(title, color):
         return f"{handle_base}-{color_part}-Customize"
     return handle_base
 
+@functools.lru_cache(maxsize=4096)
+def _sku_part(value):
+    # 尺码和颜色的取值很少，清洗结果缓存复用
+    return sys.intern(_SKU_STRIP.sub('', value))
+
+@functools.lru_cache(maxsize=4096)
+def _size_sku_part(value):
+    # 紧凑模型的尺码 SKU 片段：保留分隔符的位置，不同尺码不会得到相同的片段
+    return sys.intern(_SIZE_SEPARATORS.sub('-', value.strip()))
+
 def generate_sku(handle, size, color, index):
     """
     生成唯一的SKU
     """
-    size_clean = re.sub(r'[^a-zA-Z0-9]', '', str(size))
-    color_clean = re.sub(r'[^a-zA-Z0-9]', '', str(color))
+    size_clean = _sku_part(str(size))
+    color_clean = _sku_part(str(color))
     return f"{handle[:3].upper()}_{color_clean}_{size_clean}_{index:03d}"
 
 def build_product_category(category_data):
@@ -51,220 +160,277 @@ def build_product_category(category_data):
     
     return ' > '.join(filter(None, categories))
 
-def convert_json_to_shopify_csv():
+def _product_widths(product):
     """
-    读取 all_scraped_products.json 文件，并将其转换为 Shopify 兼容的 CSV 导入文件。
-    遵循官方模板格式：主产品行包含完整信息，变体行只包含变体信息，图片行只包含图片信息。
+    宽度可能是 'Narrow, Regular' 这样的字符串，也可能是 update_product_widths.py 合并后的列表；
+    有宽度×尺码矩阵时以矩阵中的宽度为准。
     """
-    Type = 'Customize' # 定义产品类型
-    Vendor = 'Birkenstock' # 品牌名称
+    if isinstance(product.get('size_matrix'), dict) and product['size_matrix']:
+        return list(product['size_matrix'])
+    width = product.get('width')
+    if isinstance(width, list):
+        candidates = width
+    elif isinstance(width, str):
+        candidates = width.split(',')
+    else:
+        candidates = []
+    widths = []
+    for value in candidates:
+        value = str(value).strip()
+        if value and value != 'N/A' and value not in widths:
+            widths.append(value)
+    return widths
 
-    json_input_file = 'all_scraped_products.json'
-    csv_output_file = 'shopify_import.csv'
-    
-    # 使用官方模板的完整表头
-    headers = [
-        'Handle', 'Title', 'Body (HTML)', 'Vendor', 'Product Category', 'Type', 'Tags', 'Published',
-        'Option1 Name', 'Option1 Value', 'Option2 Name', 'Option2 Value', 'Option3 Name', 'Option3 Value',
-        'Variant SKU', 'Variant Grams', 'Variant Inventory Tracker', 'Variant Inventory Qty',
-        'Variant Inventory Policy', 'Variant Fulfillment Service', 'Variant Price', 'Variant Compare At Price',
-        'Variant Requires Shipping', 'Variant Taxable', 'Variant Barcode', 'Image Src', 'Image Position', 
-        'Image Alt Text', 'Gift Card', 'SEO Title', 'SEO Description', 'Google Shopping / Google Product Category',
-        'Google Shopping / Gender', 'Google Shopping / Age Group', 'Google Shopping / MPN', 
-        'Google Shopping / Condition', 'Google Shopping / Custom Product', 'Variant Image', 'Variant Weight Unit',
-        'Variant Tax Code', 'Cost per item', 'Included / United States', 'Price / United States',
-        'Compare At Price / United States', 'Included / International', 'Price / International',
-        'Compare At Price / International', 'Status'
-    ]
+def _cartesian_options(sizes_data, color):
+    """
+    原来的选项结构：同时有女码和男码时 Option1=Women、Option2=Men，两者做笛卡尔积。
+    """
+    men_sizes = sizes_data.get('men', [])
+    women_sizes = sizes_data.get('women', [])
+    if women_sizes and men_sizes:
+        return ('Women', 'Men', 'Color'), (women_sizes, men_sizes, [color])
+    elif women_sizes:
+        return ('Women', 'Color', ''), (women_sizes, [color], [])
+    elif men_sizes:
+        return ('Men', 'Color', ''), (men_sizes, [color], [])
+    return ('Size', 'Color', ''), (['Default Size'], [color], [])
+
+def _cartesian_variants(option_values, sku_prefix):
+    """
+    按 option1 × option2 × option3 展开所有变体组合，SKU 末尾是变体序号。
+    """
+    option1_values, option2_values, option3_values = option_values
+    if not option1_values:
+        return []
+    first = (option1_values[0], option2_values[0] if option2_values else None,
+             option3_values[0] if option3_values else None)
+    variants = [(option1_values[0], option2_values[0] if option2_values else '',
+                 option3_values[0] if option3_values else '',
+                 f"{sku_prefix}{_sku_part(str(option1_values[0]))}_001")]
+    variant_index = 2
+    for val1, val2, val3 in itertools.product(option1_values, option2_values, option3_values or ['']):
+        # 跳过主产品行已经包含的组合
+        if (val1 == first[0] and val2 == first[1] and
+                (not option3_values or val3 == first[2])):
+            continue
+        variants.append((val1, val2, val3 if option3_values else '',
+                         f"{sku_prefix}{_sku_part(str(val1))}_{variant_index:03d}"))
+        variant_index += 1
+    return variants
+
+def _compact_variants(sizes_data, widths, color, handle, sku_prefix, size_matrix=None):
+    """
+    紧凑模型：女码、男码合并为一个 Size 选项（取值如 'Women 5-5.5'、'Men 8-8.5'），
+    多个宽度时增加 Width 选项，变体数为 尺码数 × 宽度数，而不是 女码数 × 男码数。
+    有宽度×尺码矩阵（size_matrix）时只生成各宽度实际提供的尺码。
+    SKU 只由 handle、颜色、尺码和宽度决定，与变体顺序无关。
+    """
+    size_values = []
+    size_tokens = {}
+    sizes_by_width = {}
+
+    def add_size(label, size):
+        value = f"{label} {size}"
+        if value not in size_tokens:
+            size_values.append(value)
+            size_tokens[value] = label[0] + _size_sku_part(str(size))
+        return value
+
+    for gender, label in (('women', 'Women'), ('men', 'Men')):
+        for size in sizes_data.get(gender) or []:
+            add_size(label, size)
+    for width, groups in (size_matrix or {}).items():
+        sizes_by_width[width] = {add_size(label, size)
+                                 for gender, label in (('women', 'Women'), ('men', 'Men'))
+                                 for size in (groups.get(gender) or {})}
+    if not size_values:
+        size_values = ['Default Size']
+        size_tokens['Default Size'] = 'DEF'
 
+    handle_digest = f"{zlib.crc32(handle.encode('utf-8')):08X}"
+    if len(widths) > 1:
+        option_names = ('Size', 'Width', 'Color')
+        combos = [(size, width, color) for size in size_values for width in widths
+                  if not sizes_by_width.get(width) or size in sizes_by_width[width]]
+    else:
+        option_names = ('Size', 'Color', '')
+        combos = [(size, color, '') for size in size_values]
+
+    variants = []
+    for val1, val2, val3 in combos:
+        width_token = f"_{_sku_part(val2)}" if option_names[1] == 'Width' else ''
+        variants.append((val1, val2, val3, f"{sku_prefix}{size_tokens[val1]}{width_token}_{handle_digest}"))
+    return option_names, variants
+
+def plan_product(product, variant_model=None):
+    """
+    把一条采集到的产品记录映射为导出计划：handle、价格、标签、选项名、变体（选项值和 SKU）、图片。
+    CSV 导出和其他发布方式都基于这个结构。
+    variant_model 为 'compact'（默认，见 VARIANT_MODEL）或 'cartesian'（原来的女码×男码结构）。
+    """
+    variant_model = variant_model or VARIANT_MODEL
+
+    # 提取颜色
+    color = sfcc_url.color_code(product.get('url', ''))
+
+    title = product.get('title', '')
+    handle = generate_handle(title, color)
+
+    # 处理价格
+    price_str = product.get('price', '0').replace('$', '')
     try:
-        # 读取 JSON 输入文件
-        with open(json_input_file, 'r', encoding='utf-8') as f:
-            products = json.load(f)
-    except FileNotFoundError:
+        original_price = float(price_str)
+        compare_at_price = f"{original_price:.2f}"
+        discounted_price = f"{(original_price * 0.5):.2f}"
+    except (ValueError, TypeError):
+        compare_at_price = "0.00"
+        discounted_price = "0.00"
+
+    # 构建标签
+    categories = []
+    category_data = product.get('category', {})
+    if not isinstance(category_data, dict):
+        category_data = {}
+    if category_data.get('level1_category'):
+        categories.extend(category_data['level1_category'])
+    if category_data.get('level2_category'):
+        categories.extend(category_data['level2_category'])
+    if category_data.get('level3_category'):
+        categories.append(category_data['level3_category'])
+
+    all_tags = [Type] + categories
+    tags_str = ','.join(filter(None, all_tags))
+
+    # 提取尺寸（未采集到尺码时为 'N/A'）
+    sizes_data = product.get('sizes', {})
+    if not isinstance(sizes_data, dict):
+        sizes_data = {}
+
+    sku_prefix = f"{handle[:3].upper()}_{_sku_part(str(color))}_"
+    cartesian_names, cartesian_values = _cartesian_options(sizes_data, color)
+    if variant_model == 'cartesian':
+        option_names = cartesian_names
+        variants = _cartesian_variants(cartesian_values, sku_prefix)
+    else:
+        size_matrix = product.get('size_matrix') if isinstance(product.get('size_matrix'), dict) else None
+        option_names, variants = _compact_variants(sizes_data, _product_widths(product), color, handle, sku_prefix,
+                                                   size_matrix)
+
+    description = product.get('description', '')
+    return {
+        'handle': handle,
+        'title': title,
+        'description': description,
+        'color': color,
+        'tags': tags_str,
+        'price': discounted_price,
+        'compare_at_price': compare_at_price,
+        'option_names': option_names,
+        # 第一个变体属于主产品行
+        'variants': variants,
+        # 原笛卡尔积模型下的变体数，用于统计行数缩减
+        'cartesian_variant_count': len(cartesian_values[0]) * len(cartesian_values[1]) * max(len(cartesian_values[2]), 1),
+        'image_urls': product.get('image_urls', []),
+    }
+
+def render_product_rows(plan):
+    """
+    用预先构建的行模板批量生成一个产品的全部 CSV 行（列表形式，顺序与 HEADERS 一致）。
+    """
+    handle = plan['handle']
+    title = plan['title']
+    description = plan['description']
+    option1_name, option2_name, option3_name = plan['option_names']
+    variants = plan['variants']
+    discounted_price = plan['price']
+    compare_at_price = plan['compare_at_price']
+    image_urls = plan['image_urls']
+
+    # 主产品行 - 包含完整信息
+    main_row = _MAIN_TEMPLATE.copy()
+    main_row[_C_HANDLE] = handle
+    main_row[_COL['Title']] = title
+    main_row[_COL['Body (HTML)']] = f"<p>{description}</p>"
+    main_row[_COL['Tags']] = plan['tags']
+    main_row[_C_OPT1_NAME] = option1_name
+    main_row[_C_OPT2_NAME] = option2_name
+    main_row[_C_OPT3_NAME] = option3_name
+    if variants:
+        (main_row[_C_OPT1_VALUE], main_row[_C_OPT2_VALUE],
+         main_row[_C_OPT3_VALUE], main_row[_C_SKU]) = variants[0]
+    main_row[_C_PRICE] = discounted_price
+    main_row[_C_COMPARE] = compare_at_price
+    main_row[_C_IMAGE_SRC] = image_urls[0] if image_urls else ''
+    main_row[_COL['Image Alt Text']] = title
+    main_row[_COL['SEO Title']] = title
+    main_row[_COL['SEO Description']] = description[:255] if description else ''
+    main_row[_COL['Price / United States']] = discounted_price
+    main_row[_COL['Compare At Price / United States']] = compare_at_price
+    main_row[_COL['Price / International']] = discounted_price
+    main_row[_COL['Compare At Price / International']] = compare_at_price
+    rows = [main_row]
+
+    # 本产品所有变体共用的模板，循环中只填选项值和 SKU
+    product_variant_template = _VARIANT_TEMPLATE.copy()
+    product_variant_template[_C_HANDLE] = handle
+    product_variant_template[_C_OPT1_NAME] = option1_name
+    product_variant_template[_C_OPT2_NAME] = option2_name
+    product_variant_template[_C_OPT3_NAME] = option3_name
+    product_variant_template[_C_PRICE] = discounted_price
+    product_variant_template[_C_COMPARE] = compare_at_price
+
+    for val1, val2, val3, sku in variants[1:]:
+        variant_row = product_variant_template.copy()
+        variant_row[_C_OPT1_VALUE] = val1
+        variant_row[_C_OPT2_VALUE] = val2
+        variant_row[_C_OPT3_VALUE] = val3
+        variant_row[_C_SKU] = sku
+        rows.append(variant_row)
+
+    # 为其余图片创建额外的行
+    for i, image_url in enumerate(image_urls[1:], start=2):
+        image_row = _EMPTY_TEMPLATE.copy()
+        image_row[_C_HANDLE] = handle
+        image_row[_C_IMAGE_SRC] = image_url
+        image_row[_C_IMAGE_POSITION] = str(i)
+        image_row[_C_IMAGE_ALT] = f"{title} - Image {i}"
+        rows.append(image_row)
+
+    return rows
+
+def convert_json_to_shopify_csv(json_input_file='all_scraped_products.json', csv_output_file='shopify_import.csv'):
+    """
+    读取 all_scraped_products.json 文件，并将其转换为 Shopify 兼容的 CSV 导入文件。
+    遵循官方模板格式：主产品行包含完整信息，变体行只包含变体信息，图片行只包含图片信息。
+    输入按产品逐条流式读取（JSON 数组或 .jsonl），边读边写，内存占用不随产品数量增长。
+    """
+    if not os.path.exists(json_input_file):
         print(f"错误: 输入文件 '{json_input_file}' 未找到。请先运行 '4.多个链接2json'。")
         return
+    # 逐条读取产品，不再一次性 json.load 整个文件
+    products = json_stream.iter_records(json_input_file)
 
     try:
         # 打开 CSV 输出文件
         with open(csv_output_file, 'w', newline='', encoding='utf-8') as f:
-            writer = csv.DictWriter(f, fieldnames=headers)
-            writer.writeheader()
+            writer = csv.writer(f)
+            writer.writerow(HEADERS)
 
+            variant_count = 0
+            cartesian_variant_count = 0
             for product in products:
-                # 提取颜色
-                color = ''
-                url = product.get('url', '')
-                color_match = re.search(r'dwvar_.*?_color=([a-zA-Z0-9]+)', url)
-                if color_match:
-                    color = color_match.group(1)
-                
-                handle = generate_handle(product.get('title', ''), color)
-                
-                # 处理价格
-                price_str = product.get('price', '0').replace('$', '')
-                try:
-                    original_price = float(price_str)
-                    compare_at_price = f"{original_price:.2f}"
-                    discounted_price = f"{(original_price * 0.5):.2f}"
-                except (ValueError, TypeError):
-                    compare_at_price = "0.00"
-                    discounted_price = "0.00"
-
-                # 构建分类和标签
-                product_category = build_product_category(product.get('category', {}))
-                categories = []
-                category_data = product.get('category', {})
-                if category_data.get('level1_category'):
-                    categories.extend(category_data['level1_category'])
-                if category_data.get('level2_category'):
-                    categories.extend(category_data['level2_category'])
-                if category_data.get('level3_category'):
-                    categories.append(category_data['level3_category'])
-                
-                all_tags = [Type] + categories
-                tags_str = ','.join(filter(None, all_tags))
-
-                # 提取尺寸
-                sizes_data = product.get('sizes', {})
-                men_sizes = sizes_data.get('men', [])
-                women_sizes = sizes_data.get('women', [])
-                
-                # 确定选项结构
-                if women_sizes and men_sizes:
-                    option1_name = 'Women'
-                    option2_name = 'Men'
-                    option3_name = 'Color'
-                    option1_values = women_sizes
-                    option2_values = men_sizes
-                    option3_values = [color]
-                elif women_sizes:
-                    option1_name = 'Women'
-                    option2_name = 'Color'
-                    option3_name = ''
-                    option1_values = women_sizes
-                    option2_values = [color]
-                    option3_values = []
-                elif men_sizes:
-                    option1_name = 'Men'
-                    option2_name = 'Color'
-                    option3_name = ''
-                    option1_values = men_sizes
-                    option2_values = [color]
-                    option3_values = []
-                else:
-                    option1_name = 'Size'
-                    option2_name = 'Color'
-                    option3_name = ''
-                    option1_values = ['Default Size']
-                    option2_values = [color]
-                    option3_values = []
-
-                # 主产品行 - 包含完整信息
-                main_row = {
-                    'Handle': handle,
-                    'Title': product.get('title', ''),
-                    'Body (HTML)': f"<p>{product.get('description', '')}</p>",
-                    'Vendor': Vendor,
-                    'Product Category':"",
-                    'Type': Type,
-                    'Tags': tags_str,
-                    'Published': 'TRUE',
-                    'Option1 Name': option1_name,
-                    'Option1 Value': option1_values[0] if option1_values else '',
-                    'Option2 Name': option2_name,
-                    'Option2 Value': option2_values[0] if option2_values else '',
-                    'Option3 Name': option3_name,
-                    'Option3 Value': option3_values[0] if option3_values else '',
-                    'Variant SKU': generate_sku(handle, option1_values[0] if option1_values else 'DEF', color, 1),
-                    'Variant Grams': '500',  # 默认重量
-                    'Variant Inventory Tracker': 'shopify',
-                    'Variant Inventory Qty': '100',  # 默认库存
-                    'Variant Inventory Policy': 'deny',
-                    'Variant Fulfillment Service': 'manual',
-                    'Variant Price': discounted_price,
-                    'Variant Compare At Price': compare_at_price,
-                    'Variant Requires Shipping': 'TRUE',
-                    'Variant Taxable': 'TRUE',
-                    'Variant Barcode': '',
-                    'Image Src': product.get('image_urls', [])[0] if product.get('image_urls') else '',
-                    'Image Position': '1',
-                    'Image Alt Text': product.get('title', ''),
-                    'Gift Card': 'FALSE',
-                    'SEO Title': product.get('title', ''),
-                    'SEO Description': product.get('description', '')[:255] if product.get('description') else '',
-                    'Google Shopping / Google Product Category': '212',  # 鞋类
-                    'Google Shopping / Gender': 'unisex',
-                    'Google Shopping / Age Group': 'adult',
-                    'Google Shopping / MPN': '',
-                    'Google Shopping / Condition': 'new',
-                    'Google Shopping / Custom Product': 'TRUE',
-                    'Variant Image': '',
-                    'Variant Weight Unit': 'g',
-                    'Variant Tax Code': '',
-                    'Cost per item': '',
-                    'Included / United States': 'TRUE',
-                    'Price / United States': discounted_price,
-                    'Compare At Price / United States': compare_at_price,
-                    'Included / International': 'TRUE',
-                    'Price / International': discounted_price,
-                    'Compare At Price / International': compare_at_price,
-                    'Status': 'active'
-                }
-                writer.writerow(main_row)
-
-                # 生成所有变体组合
-                variant_index = 2
-                for val1 in option1_values:
-                    for val2 in option2_values:
-                        for val3 in option3_values if option3_values else ['']:
-                            # 跳过主产品行已经包含的组合
-                            if (val1 == option1_values[0] and val2 == option2_values[0] and 
-                                (not option3_values or val3 == option3_values[0])):
-                                continue
-                            
-                            # 创建完整的变体行，包含所有必要的字段
-                            variant_row = {}
-                            # 先设置所有字段为空值
-                            for header in headers:
-                                variant_row[header] = ''
-                            
-                            # 然后设置变体相关的字段
-                            variant_row.update({
-                                'Handle': handle,
-                                'Option1 Name': option1_name,
-                                'Option1 Value': val1,
-                                'Option2 Name': option2_name,
-                                'Option2 Value': val2,
-                                'Option3 Name': option3_name,
-                                'Option3 Value': val3 if option3_values else '',
-                                'Variant SKU': generate_sku(handle, val1, color, variant_index),
-                                'Variant Grams': '500',
-                                'Variant Inventory Tracker': 'shopify',
-                                'Variant Inventory Qty': '100',
-                                'Variant Inventory Policy': 'deny',
-                                'Variant Fulfillment Service': 'manual',
-                                'Variant Price': discounted_price,
-                                'Variant Compare At Price': compare_at_price,
-                                'Variant Requires Shipping': 'TRUE',
-                                'Variant Taxable': 'TRUE'
-                            })
-                            
-                            writer.writerow(variant_row)
-                            variant_index += 1
-
-                # 为其余图片创建额外的行
-                image_urls = product.get('image_urls', [])
-                for i, image_url in enumerate(image_urls[1:], start=2):
-                    image_row = {
-                        'Handle': handle,
-                        'Image Src': image_url,
-                        'Image Position': str(i),
-                        'Image Alt Text': f"{product.get('title', '')} - Image {i}"
-                    }
-                    writer.writerow(image_row)
+                with metrics.timer('export', 'extraction'):
+                    plan = plan_product(product)
+                    rows = render_product_rows(plan)
+                with metrics.timer('export', 'write'):
+                    writer.writerows(rows)
+                variant_count += len(plan['variants'])
+                cartesian_variant_count += plan['cartesian_variant_count']
 
         print(f"成功！数据已转换为 Shopify 格式并保存到 '{csv_output_file}'。")
+        if VARIANT_MODEL != 'cartesian' and cartesian_variant_count:
+            reduction = 1 - variant_count / cartesian_variant_count
+            print(f"紧凑变体模型：共 {variant_count} 个变体行，原女码×男码模型为 {cartesian_variant_count} 行，减少 {reduction:.1%}。")
         print("遵循官方模板格式：主产品行包含完整信息，变体行只包含变体信息，图片行只包含图片信息。")
     except PermissionError:
         print(f"\n错误：写入 '{csv_output_file}' 时权限被拒绝。")
@@ -272,5 +438,235 @@ def convert_json_to_shopify_csv():
     except Exception as e:
         print(f"发生意外错误: {e}")
 
+# Shopify 单个 CSV 导入文件的大小上限为 15 MB
+SHARD_MAX_BYTES = 15 * 1024 * 1024
+
+def _render_csv_text(rows):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    return buffer.getvalue()
+
+def _render_bucket(bucket_path, part_path):
+    """
+    进程池任务：把一个分桶内的产品渲染成 CSV 文本，按 handle 依次写入 part_path，
+    返回 [(handle, 字节数, 行数)]，顺序与写入顺序一致。分片的打包由主进程跨桶进行。
+    """
+    # 同一 handle 可能对应多条产品记录（例如不同宽度），先在桶内按 handle 聚合
+    handle_texts = {}
+    for product in json_stream.iter_jsonl(bucket_path):
+        plan = plan_product(product)
+        rows = render_product_rows(plan)
+        handle_texts.setdefault(plan['handle'], []).append((_render_csv_text(rows), len(rows)))
+
+    blocks = []
+    with open(part_path, 'wb') as f:
+        for handle, texts in handle_texts.items():
+            data = ''.join(text for text, _ in texts).encode('utf-8')
+            f.write(data)
+            blocks.append((handle, len(data), sum(count for _, count in texts)))
+    return blocks
+
+def _pack_shards(parts, output_dir, max_shard_bytes):
+    """
+    按桶的顺序依次取出各 handle 的 CSV 块，装进尽量少的分片文件，每个分片不超过 max_shard_bytes。
+    parts 为 [(part_path, blocks)]；同一个 handle 的所有行总是写在同一个分片中。
+    """
+    header_text = _render_csv_text([HEADERS]).encode('utf-8')
+    shards = []
+    current = None
+
+    def close_current():
+        if current is None:
+            return
+        current['file'].close()
+        shards.append({
+            'file': os.path.basename(current['path']),
+            'handles': current['handles'],
+            'rows': current['rows'],
+            'bytes': current['bytes'],
+            'sha256': current['sha256'].hexdigest(),
+        })
+
+    for part_path, blocks in parts:
+        with open(part_path, 'rb') as part:
+            for handle, length, row_count in blocks:
+                data = part.read(length)
+                if current is None or current['bytes'] + length > max_shard_bytes:
+                    close_current()
+                    if len(header_text) + length > max_shard_bytes:
+                        print(f"警告: handle '{handle}' 单独就超过分片大小上限，将单独写入一个分片。")
+                    path = os.path.join(output_dir, f"shopify_import_{len(shards) + 1:03d}.csv")
+                    current = {'path': path, 'file': open(path, 'wb'), 'handles': 0, 'rows': 0,
+                               'bytes': len(header_text), 'sha256': hashlib.sha256()}
+                    current['file'].write(header_text)
+                    current['sha256'].update(header_text)
+                current['file'].write(data)
+                current['sha256'].update(data)
+                current['bytes'] += length
+                current['rows'] += row_count
+                current['handles'] += 1
+    close_current()
+    return shards
+
+def export_shopify_csv_shards(json_input_file='all_scraped_products.json', output_dir='shopify_shards',
+                              max_shard_bytes=SHARD_MAX_BYTES, workers=None):
+    """
+    按 handle 把产品装进尽量少的、不超过 Shopify 导入大小上限的 CSV 分片中，并写出 manifest.json
+    （每个分片的行数、handle 数、字节数和 sha256），导入失败时可按分片重试。
+    产品按 handle 哈希分桶，只为了让进程池并行渲染；分片由主进程跨桶依次打包，分片数与桶数无关。
+    """
+    if not os.path.exists(json_input_file):
+        print(f"错误: 输入文件 '{json_input_file}' 未找到。请先运行 '4.多个链接2json'。")
+        return None
+
+    start_time = time.time()
+    workers = workers or os.cpu_count() or 1
+    bucket_count = workers * 4
+    os.makedirs(output_dir, exist_ok=True)
+    for name in os.listdir(output_dir):
+        if name.startswith('shopify_import_') and name.endswith('.csv'):
+            os.remove(os.path.join(output_dir, name))
+
+    # 第一遍：流式读取产品，按 handle 的哈希写入分桶临时文件，保证同一 handle 只会落在一个桶里
+    bucket_dir = tempfile.mkdtemp(prefix='shopify_buckets_')
+    try:
+        bucket_files = {}
+        product_count = 0
+        for product in json_stream.iter_records(json_input_file):
+            handle = plan_product(product)['handle']
+            bucket_id = zlib.crc32(handle.encode('utf-8')) % bucket_count
+            if bucket_id not in bucket_files:
+                bucket_files[bucket_id] = open(os.path.join(bucket_dir, f'{bucket_id:03d}.jsonl'), 'w', encoding='utf-8')
+            bucket_files[bucket_id].write(json.dumps(product, ensure_ascii=False) + '\n')
+            product_count += 1
+        for f in bucket_files.values():
+            f.close()
+
+        # 第二遍：每个桶由一个进程渲染成 CSV 块
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = []
+            for bucket_id in sorted(bucket_files):
+                part_path = os.path.join(bucket_dir, f'{bucket_id:03d}.csv')
+                futures.append((part_path, executor.submit(
+                    _render_bucket, os.path.join(bucket_dir, f'{bucket_id:03d}.jsonl'), part_path)))
+            parts = [(part_path, future.result()) for part_path, future in futures]
+
+        # 第三遍：跨桶打包成分片
+        shards = _pack_shards(parts, output_dir, max_shard_bytes)
+    finally:
+        shutil.rmtree(bucket_dir, ignore_errors=True)
+
+    manifest = {
+        'source': os.path.abspath(json_input_file),
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'max_shard_bytes': max_shard_bytes,
+        'products': product_count,
+        'rows': sum(shard['rows'] for shard in shards),
+        'shards': shards,
+    }
+    with open(os.path.join(output_dir, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=4)
+
+    print(f"成功！{product_count} 个产品已导出为 {len(shards)} 个分片，共 {manifest['rows']} 行，"
+          f"耗时 {time.time() - start_time:.2f} 秒，分片清单见 '{os.path.join(output_dir, 'manifest.json')}'。")
+    return manifest
+
+def export_shopify_csv_delta(json_input_file='all_scraped_products.json', csv_output_file='shopify_import_delta.csv',
+                             state_file='shopify_export_state.json', removed_file='shopify_removed_handles.json'):
+    """
+    只导出相对上次成功导出有变化的产品。
+    每个 handle 的内容哈希基于渲染出的 CSV 行计算，新增或变化的 handle 写入增量 CSV，
+    上次存在而本次消失的 handle 写入 removed_file，便于在 Shopify 中归档。
+    新的哈希先保存为 state_file + '.pending'，确认导入成功后用 commit_delta_state() 生效。
+    """
+    if not os.path.exists(json_input_file):
+        print(f"错误: 输入文件 '{json_input_file}' 未找到。请先运行 '4.多个链接2json'。")
+        return None
+
+    try:
+        with open(state_file, 'r', encoding='utf-8') as f:
+            previous_hashes = json.load(f).get('handles', {})
+    except FileNotFoundError:
+        previous_hashes = {}
+        print(f"未找到上次导出状态 '{state_file}'，本次将导出全部产品。")
+
+    # 第一遍：流式计算每个 handle 的内容哈希
+    hashers = {}
+    for product in json_stream.iter_records(json_input_file):
+        plan = plan_product(product)
+        hasher = hashers.get(plan['handle'])
+        if hasher is None:
+            hasher = hashers[plan['handle']] = hashlib.sha256()
+        hasher.update(_render_csv_text(render_product_rows(plan)).encode('utf-8'))
+    current_hashes = {handle: hasher.hexdigest() for handle, hasher in hashers.items()}
+
+    changed_handles = {handle for handle, digest in current_hashes.items() if previous_hashes.get(handle) != digest}
+    removed_handles = sorted(set(previous_hashes) - set(current_hashes))
+
+    # 第二遍：只写出新增或变化的 handle
+    rows_written = 0
+    with open(csv_output_file, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(HEADERS)
+        if changed_handles:
+            for product in json_stream.iter_records(json_input_file):
+                plan = plan_product(product)
+                if plan['handle'] in changed_handles:
+                    rows = render_product_rows(plan)
+                    writer.writerows(rows)
+                    rows_written += len(rows)
+
+    if removed_handles:
+        with open(removed_file, 'w', encoding='utf-8') as f:
+            json.dump(removed_handles, f, ensure_ascii=False, indent=4)
+    elif os.path.exists(removed_file):
+        # 避免留下上一次的删除列表被误用
+        os.remove(removed_file)
+
+    with open(state_file + '.pending', 'w', encoding='utf-8') as f:
+        json.dump({'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'), 'handles': current_hashes}, f, ensure_ascii=False)
+
+    print(f"共 {len(current_hashes)} 个 handle，其中新增/变化 {len(changed_handles)} 个，已删除 {len(removed_handles)} 个。")
+    print(f"增量 CSV 已保存到 '{csv_output_file}'（{rows_written} 行）。")
+    if removed_handles:
+        print(f"已删除的 handle 列表已保存到 '{removed_file}'。")
+    print(f"导入成功后请运行 EXPORT_DELTA=commit 使本次状态生效（'{state_file}.pending'）。")
+    return {'changed': sorted(changed_handles), 'removed': removed_handles, 'rows': rows_written}
+
+def commit_delta_state(state_file='shopify_export_state.json'):
+    """
+    增量 CSV 导入 Shopify 成功后调用，把待确认的哈希状态设为“上次成功导出”。
+    """
+    pending_file = state_file + '.pending'
+    if not os.path.exists(pending_file):
+        print(f"错误: 没有待确认的导出状态 '{pending_file}'。")
+        return False
+    os.replace(pending_file, state_file)
+    print(f"导出状态已更新到 '{state_file}'。")
+    return True
+
 if __name__ == '__main__':
-    convert_json_to_shopify_csv()
+    # EXPORT_SHARDS=1：按 handle 分片并行导出，避免单个导入文件超过 Shopify 的大小上限
+    # EXPORT_DELTA=1：只导出变化的产品；导入成功后用 EXPORT_DELTA=commit 确认状态
+    export_delta = os.getenv('EXPORT_DELTA', '0')
+    if export_delta == 'commit':
+        commit_delta_state(os.getenv('EXPORT_STATE', 'shopify_export_state.json'))
+    elif export_delta == '1':
+        export_shopify_csv_delta(
+            os.getenv('EXPORT_INPUT', 'all_scraped_products.json'),
+            os.getenv('EXPORT_OUTPUT', 'shopify_import_delta.csv'),
+            os.getenv('EXPORT_STATE', 'shopify_export_state.json'),
+        )
+    elif os.getenv('EXPORT_SHARDS', '0') == '1':
+        export_shopify_csv_shards(
+            os.getenv('EXPORT_INPUT', 'all_scraped_products.json'),
+            os.getenv('EXPORT_SHARD_DIR', 'shopify_shards'),
+            int(float(os.getenv('SHARD_MAX_MB', '15')) * 1024 * 1024),
+            int(os.getenv('EXPORT_WORKERS', '0')) or None,
+        )
+    else:
+        convert_json_to_shopify_csv(
+            os.getenv('EXPORT_INPUT', 'all_scraped_products.json'),
+            os.getenv('EXPORT_OUTPUT', 'shopify_import.csv'),
+        )
+    metrics.finish('export')
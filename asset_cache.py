@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""
+跨运行共享的静态资源磁盘缓存。
+
+每个采集脚本都使用一次性的 Chromium 配置，JS、CSS、字体每次运行、每个 context 都要重新下载。
+这里通过 context.route 拦截脚本/样式/字体请求：第一次从网络获取并写入磁盘，之后直接用本地文件响应。
+缓存目录有总大小上限，写入一定次数后按最近使用时间清理最旧的文件。
+
+环境变量：
+    ASSET_CACHE_DIR          缓存目录，设置后才启用（例如 .asset_cache）
+    ASSET_CACHE_MAX_MB       缓存总大小上限，单位 MB（默认 500）
+    ASSET_CACHE_MAX_AGE      单个文件最长保留天数（默认 7）
+"""
+import hashlib
+import json
+import os
+import time
+
+CACHEABLE_RESOURCE_TYPES = {'script', 'stylesheet', 'font'}
+# 本地响应时不能沿用的头：body 已经是解码后的内容
+DROPPED_HEADERS = {'content-encoding', 'content-length', 'transfer-encoding', 'set-cookie'}
+PRUNE_EVERY_WRITES = 100
+
+
+class AssetCache:
+    """
+    以 URL 哈希为文件名的静态资源缓存，每个资源保存 body 和一个 .meta.json（状态码与响应头）。
+    """
+
+    def __init__(self, cache_dir, max_bytes=500 * 1024 * 1024, max_age=7 * 86400):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self._writes_since_prune = 0
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.prune()
+
+    @classmethod
+    def from_env(cls):
+        cache_dir = os.getenv('ASSET_CACHE_DIR')
+        if not cache_dir:
+            return None
+        max_mb = int(os.getenv('ASSET_CACHE_MAX_MB', '500'))
+        max_age_days = float(os.getenv('ASSET_CACHE_MAX_AGE', '7'))
+        return cls(cache_dir, max_bytes=max_mb * 1024 * 1024, max_age=int(max_age_days * 86400))
+
+    def _paths(self, url):
+        digest = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        sub_dir = os.path.join(self.cache_dir, digest[:2])
+        return os.path.join(sub_dir, digest), os.path.join(sub_dir, digest + '.meta.json')
+
+    def _load(self, url):
+        body_path, meta_path = self._paths(url)
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            with open(body_path, 'rb') as f:
+                body = f.read()
+        except (OSError, json.JSONDecodeError):
+            return None
+        if time.time() - meta.get('stored_at', 0) > self.max_age:
+            return None
+        # 更新访问时间，清理时按最近使用排序
+        try:
+            os.utime(body_path, None)
+        except OSError:
+            pass
+        return meta, body
+
+    def _store(self, url, status, headers, body):
+        body_path, meta_path = self._paths(url)
+        os.makedirs(os.path.dirname(body_path), exist_ok=True)
+        tmp_path = body_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(body)
+        os.replace(tmp_path, body_path)
+        with open(meta_path, 'w', encoding='utf-8') as f:
+            json.dump({'url': url, 'status': status, 'headers': headers, 'stored_at': time.time()}, f)
+
+        self._writes_since_prune += 1
+        if self._writes_since_prune >= PRUNE_EVERY_WRITES:
+            self.prune()
+
+    def prune(self):
+        """
+        删除过期文件；总大小超过上限时，按最近使用时间从旧到新删除，直到降到上限的 90%。
+        """
+        self._writes_since_prune = 0
+        now = time.time()
+        entries = []
+        total_bytes = 0
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if name.endswith('.meta.json') or name.endswith('.tmp'):
+                    continue
+                body_path = os.path.join(root, name)
+                try:
+                    stat = os.stat(body_path)
+                except OSError:
+                    continue
+                if now - stat.st_mtime > self.max_age:
+                    self._remove(body_path)
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, body_path))
+                total_bytes += stat.st_size
+
+        if total_bytes <= self.max_bytes:
+            return
+        target = int(self.max_bytes * 0.9)
+        entries.sort()
+        removed = 0
+        for _, size, body_path in entries:
+            if total_bytes <= target:
+                break
+            self._remove(body_path)
+            total_bytes -= size
+            removed += 1
+        print(f"静态资源缓存已清理 {removed} 个文件，当前占用 {total_bytes / 1024 / 1024:.1f} MB。")
+
+    @staticmethod
+    def _remove(body_path):
+        for path in (body_path, body_path + '.meta.json'):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    async def _handle_route(self, route):
+        request = route.request
+        if request.method != 'GET' or request.resource_type not in CACHEABLE_RESOURCE_TYPES:
+            await route.fallback()
+            return
+
+        cached = self._load(request.url)
+        if cached:
+            meta, body = cached
+            self.hits += 1
+            await route.fulfill(status=meta['status'], headers=meta['headers'], body=body)
+            return
+
+        self.misses += 1
+        try:
+            response = await route.fetch()
+        except Exception:
+            await route.fallback()
+            return
+        body = await response.body()
+        cache_control = response.headers.get('cache-control', '')
+        if response.status == 200 and 'no-store' not in cache_control:
+            headers = {k: v for k, v in response.headers.items() if k.lower() not in DROPPED_HEADERS}
+            try:
+                self._store(request.url, response.status, headers, body)
+            except OSError as e:
+                print(f"警告: 写入静态资源缓存失败: {e}")
+        await route.fulfill(response=response, body=body)
+
+    async def attach(self, context):
+        """
+        为 context 注册路由拦截。不缓存的请求用 route.fallback() 交给其他路由处理（例如 xhr_capture），
+        而不是 continue_() 直接发出。
+        """
+        await context.route('**/*', self._handle_route)
+
+
+_shared_cache = None
+
+
+async def attach_if_enabled(context):
+    """
+    设置了 ASSET_CACHE_DIR 时为 context 挂上共享缓存，同一进程内的所有 context 共用一个实例。
+    """
+    global _shared_cache
+    if _shared_cache is None:
+        _shared_cache = AssetCache.from_env()
+        if _shared_cache is None:
+            return None
+    await _shared_cache.attach(context)
+    return _shared_cache
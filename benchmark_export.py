@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+Shopify CSV 导出基准测试。
+
+用 all_scraped_products.json 中的产品复制出不同规模的合成目录，
+在独立子进程中运行 convert_json_to_shopify_csv，记录耗时、输出行数和峰值内存（RSS）。
+作为对照，同时记录对同一输入文件执行 json.load 的峰值内存（即旧实现的最低开销）。
+
+用法：python benchmark_export.py [--baseline <git 版本>] [产品数 ...]
+例如 python benchmark_export.py --baseline HEAD~1 2000 20000 100000
+指定 --baseline 时，同时用该版本的 4ALLjson2csv.py（连同该版本根目录下的所有模块）导出同一输入，
+对比行/秒并检查两份 CSV 是否逐字节一致。早期版本的 convert_json_to_shopify_csv 不带参数、固定读写
+all_scraped_products.json / shopify_import.csv，此时在临时工作目录中运行。对比时两边都固定 VARIANT_MODEL=cartesian：旧版本只有笛卡尔积变体模型，
+否则默认的紧凑模型必然与旧版本的输出不同。
+"""
+import filecmp
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+SOURCE_FILE = 'all_scraped_products.json'
+DEFAULT_SIZES = [2000, 20000, 100000]
+
+# 早期版本的 convert_json_to_shopify_csv 不带参数，固定读写当前目录下的这两个文件
+LEGACY_INPUT = 'all_scraped_products.json'
+LEGACY_OUTPUT = 'shopify_import.csv'
+
+EXPORT_CHILD = """
+import importlib, inspect, os, resource, shutil, sys, tempfile
+input_path, output_path = os.path.abspath(sys.argv[1]), os.path.abspath(sys.argv[2])
+sys.path.insert(0, os.path.abspath(sys.argv[3]))
+exporter = importlib.import_module('4ALLjson2csv')
+if inspect.signature(exporter.convert_json_to_shopify_csv).parameters:
+    exporter.convert_json_to_shopify_csv(input_path, output_path)
+else:
+    with tempfile.TemporaryDirectory() as work_dir:
+        os.symlink(input_path, os.path.join(work_dir, sys.argv[4]))
+        os.chdir(work_dir)
+        exporter.convert_json_to_shopify_csv()
+        shutil.move(sys.argv[5], output_path)
+print('RSS_KB', resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+"""
+
+LOAD_CHILD = """
+import json, resource, sys
+with open(sys.argv[1], 'r', encoding='utf-8') as f:
+    products = json.load(f)
+print('RSS_KB', resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+"""
+
+
+def build_catalog(path, size, templates):
+    """
+    按产品逐条写出合成目录，标题加序号保证每个 handle 唯一。
+    """
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('[\n')
+        for i in range(size):
+            product = dict(templates[i % len(templates)])
+            product['title'] = f"{product.get('title', '')} {i}"
+            if i:
+                f.write(',\n')
+            f.write(json.dumps(product, ensure_ascii=False, indent=4))
+        f.write('\n]\n')
+
+
+def run_child(code, *args, env=None):
+    output = subprocess.run([sys.executable, '-c', code, *args], capture_output=True, text=True, check=True,
+                            env=env).stdout
+    for line in output.splitlines():
+        if line.startswith('RSS_KB'):
+            return int(line.split()[1])
+    return 0
+
+
+def checkout_baseline(ref, repo_dir, target_dir):
+    """
+    把指定 git 版本根目录下的所有 .py 模块取到临时目录（导出脚本在不同版本中依赖的模块不同，例如 sfcc_url、metrics）。
+    """
+    names = subprocess.run(['git', 'ls-tree', '--name-only', ref], cwd=repo_dir, capture_output=True, text=True,
+                           check=True).stdout.splitlines()
+    for name in names:
+        if not name.endswith('.py'):
+            continue
+        content = subprocess.run(['git', 'show', f'{ref}:{name}'], cwd=repo_dir, capture_output=True, check=True).stdout
+        with open(os.path.join(target_dir, name), 'wb') as f:
+            f.write(content)
+
+
+def timed_export(input_path, output_path, code_dir, env=None):
+    start = time.perf_counter()
+    rss = run_child(EXPORT_CHILD, input_path, output_path, code_dir, LEGACY_INPUT, LEGACY_OUTPUT, env=env)
+    elapsed = time.perf_counter() - start
+    with open(output_path, 'rb') as f:
+        rows = sum(1 for _ in f) - 1
+    return rows, elapsed, rss
+
+
+def main():
+    try:
+        import resource  # noqa: F401
+    except ImportError:
+        print("错误: 当前平台没有 resource 模块，无法测量峰值内存。")
+        return
+
+    args = sys.argv[1:]
+    baseline_ref = None
+    if args[:1] == ['--baseline']:
+        baseline_ref = args[1]
+        args = args[2:]
+    sizes = [int(arg) for arg in args] or DEFAULT_SIZES
+    repo_dir = os.path.dirname(os.path.abspath(__file__))
+    with open(os.path.join(repo_dir, SOURCE_FILE), 'r', encoding='utf-8') as f:
+        templates = json.load(f)
+
+    header = f"{'产品数':>10} {'输入MB':>8} {'CSV行数':>10} {'耗时s':>8} {'行/秒':>10} {'导出RSS MB':>11} {'json.load RSS MB':>17}"
+    if baseline_ref:
+        header += f" {'基线行/秒':>10} {'加速':>6} {'逐字节一致':>10}"
+    print(header)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        baseline_dir = None
+        export_env = None
+        if baseline_ref:
+            export_env = dict(os.environ, VARIANT_MODEL='cartesian')
+            baseline_dir = os.path.join(tmp_dir, 'baseline')
+            os.makedirs(baseline_dir)
+            checkout_baseline(baseline_ref, repo_dir, baseline_dir)
+
+        for size in sizes:
+            input_path = os.path.join(tmp_dir, f'catalog_{size}.json')
+            output_path = os.path.join(tmp_dir, f'export_{size}.csv')
+            build_catalog(input_path, size, templates)
+
+            rows, elapsed, export_rss = timed_export(input_path, output_path, repo_dir, export_env)
+            load_rss = run_child(LOAD_CHILD, input_path)
+            input_mb = os.path.getsize(input_path) / 1024 / 1024
+            line = (f"{size:>10} {input_mb:>8.1f} {rows:>10} {elapsed:>8.2f} {rows / elapsed:>10.0f} "
+                    f"{export_rss / 1024:>11.1f} {load_rss / 1024:>17.1f}")
+
+            if baseline_dir:
+                baseline_output = os.path.join(tmp_dir, f'baseline_{size}.csv')
+                base_rows, base_elapsed, _ = timed_export(input_path, baseline_output, baseline_dir, export_env)
+                identical = filecmp.cmp(output_path, baseline_output, shallow=False)
+                line += f" {base_rows / base_elapsed:>10.0f} {base_elapsed / elapsed:>5.2f}x {'是' if identical else '否':>10}"
+            print(line)
+
+
+if __name__ == '__main__':
+    main()
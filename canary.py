@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+详情采集的金丝雀预检和滚动 N/A 监控。
+
+网站改版后选择器失效时，每个 URL 都会缺少同一个字段，N/A 记录在几个小时里堆到几百条才会被发现。
+- 预检：正式采集前按一级分类分层抽样（每个一级分类 CANARY_SAMPLE_PER_CATEGORY 个，均匀分布在该分类的列表中），
+  先采集样本并计算每个字段的 N/A 率，任一字段超过阈值时不开始正式采集
+- 滚动监控：正式采集过程中对最近 CANARY_WINDOW 条结果持续计算同样的 N/A 率，超过阈值时停止采集
+
+字段为 title / width / price / description / image_urls（与 scrape_product_details 判定缺失的字段一致），
+以及 error（页面打开或 fetch 失败，不是字段缺失）。
+
+环境变量：
+    CANARY=0                        关闭预检和滚动监控
+    CANARY_SAMPLE_PER_CATEGORY      预检时每个一级分类抽取的 URL 数（默认 3）
+    CANARY_MAX_NA_RATE              单个字段 N/A 率的阈值（默认 0.5）
+    CANARY_THRESHOLDS               按字段覆盖阈值，例如 "price=0.2,error=0.8"
+    CANARY_WINDOW                   滚动监控的窗口大小（默认 50 条）
+    CANARY_MIN_SAMPLES              窗口中至少有多少条结果才开始判断（默认 20）
+"""
+import os
+from collections import Counter, OrderedDict, deque
+
+ENABLED = os.getenv('CANARY', '1') == '1'
+SAMPLE_PER_CATEGORY = int(os.getenv('CANARY_SAMPLE_PER_CATEGORY', '3'))
+MAX_NA_RATE = float(os.getenv('CANARY_MAX_NA_RATE', '0.5'))
+WINDOW = int(os.getenv('CANARY_WINDOW', '50'))
+MIN_SAMPLES = int(os.getenv('CANARY_MIN_SAMPLES', '20'))
+
+FIELDS = ('title', 'width', 'price', 'description', 'image_urls', 'error')
+
+
+def parse_thresholds(text):
+    """
+    "price=0.2,error=0.8" -> {'price': 0.2, 'error': 0.8}；未列出的字段使用 CANARY_MAX_NA_RATE。
+    """
+    thresholds = {field: MAX_NA_RATE for field in FIELDS}
+    for part in (text or '').split(','):
+        field, _, value = part.partition('=')
+        if field.strip() and value.strip():
+            thresholds[field.strip()] = float(value)
+    return thresholds
+
+
+THRESHOLDS = parse_thresholds(os.getenv('CANARY_THRESHOLDS'))
+
+
+def _level1(item):
+    level1 = (item.get('category') or {}).get('level1_category')
+    if isinstance(level1, list):
+        level1 = level1[0] if level1 else None
+    return level1 or 'N/A'
+
+
+def stratified_sample(items, per_category=SAMPLE_PER_CATEGORY):
+    """
+    按一级分类分层抽样：每个分类在自己的列表中等间隔取 per_category 个（分类内不足时全部取），保持原有顺序。
+    """
+    groups = OrderedDict()
+    for index, item in enumerate(items):
+        groups.setdefault(_level1(item), []).append(index)
+    picked = set()
+    for indexes in groups.values():
+        count = min(per_category, len(indexes))
+        for i in range(count):
+            picked.add(indexes[i * len(indexes) // count])
+    return [items[index] for index in sorted(picked)]
+
+
+class NaMonitor:
+    """
+    记录最近 window 条结果中每个字段的缺失情况（window 为 None 时记录全部），计算 N/A 率并与阈值比较。
+    """
+
+    def __init__(self, window=WINDOW, thresholds=None):
+        self.results = deque(maxlen=window)
+        self.thresholds = thresholds or THRESHOLDS
+
+    def observe(self, missing_fields=(), error=None):
+        """
+        missing_fields 为该 URL 缺少的字段；error 为打开页面或 fetch 失败的原因（此时字段无从判断）。
+        """
+        self.results.append(('error',) if error and not missing_fields else tuple(missing_fields))
+
+    def rates(self):
+        if not self.results:
+            return {}
+        counts = Counter(field for fields in self.results for field in fields)
+        return {field: counts[field] / len(self.results) for field in FIELDS}
+
+    def breaches(self, min_samples=MIN_SAMPLES):
+        """
+        超过阈值的字段 [(字段, N/A 率, 阈值)]；结果数不足 min_samples 时不判断。
+        """
+        if len(self.results) < min_samples:
+            return []
+        return [(field, rate, self.thresholds.get(field, MAX_NA_RATE))
+                for field, rate in self.rates().items() if rate > self.thresholds.get(field, MAX_NA_RATE)]
+
+
+def format_rates(rates):
+    return '，'.join(f"{field} {rate:.0%}" for field, rate in rates.items())
+
+
+def format_breaches(breaches):
+    return '，'.join(f"{field} {rate:.0%}（阈值 {threshold:.0%}）" for field, rate, threshold in breaches)
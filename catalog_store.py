@@ -0,0 +1,677 @@
+# -*- coding: utf-8 -*-
+"""
+SQLite 产品目录库，替代各步骤之间整体读写的大 JSON 数组。
+
+表结构：
+    categories       导航分类（第一步_导航目录.json），按 url 唯一
+    category_paths   分类路径 (level1, level2, level3)，每种路径只存一次
+    masters          款式（第二步_产品链接.json 中的产品链接），按款式 pid（sfcc_url.master_pid）唯一
+    variants         颜色变体（所有颜色变体URL_Cursor_dedup.json），按 url 唯一，pid、变体键有索引；
+                     price、size_matrix 等其余字段原样存进 extra
+    descriptions     产品描述文本，按内容哈希只存一次
+    details          详情页采集结果（birkenstock_all_products_details.json），按 url 唯一，pid、变体键有索引
+    failures         采集失败记录（NA.txt 等），按 (url, stage) 唯一
+    stock            库存监控的最新快照（价格、宽度×尺码可售矩阵），按颜色键唯一
+    stock_events     库存监控发现的变化事件（价格、尺码可售状态），按时间追加
+    crawl_schedule   重新采集调度（recrawl_scheduler.py）：每个分类/颜色的下次到期时间、间隔和变化统计，按 (kind, url) 唯一
+    crawl_attempts   每次执行调度任务（包括失败重试）的请求数，按时间追加，用于时间窗口内的请求预算
+
+变体键为 sfcc_url.variant_key，颜色键为 sfcc_url.color_key；查询“是否已采集”按 variation_fetch.detail_key：
+采集宽度矩阵时按颜色键，同一颜色的不同宽度和 URL 写法视为同一条，WIDTH_MATRIX=0 时按变体键。
+数据库使用 WAL 模式，采集过程中可以同时用其他进程只读查询。
+各步骤可以按 url/pid 做单条 upsert 和点查，不必每次重写整个文件；
+import_* / export_* 在旧 JSON 文件和数据库之间互相转换，未迁移的脚本照常使用 JSON。
+
+命令行用法：
+    python catalog_store.py import    把现有 JSON 文件导入数据库
+    python catalog_store.py export    从数据库导出 JSON 文件（与原文件格式一致）
+
+环境变量：
+    CATALOG_DB               数据库文件（默认 catalog.db）
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import time
+
+import json_stream
+import nav_tree
+import sfcc_url
+import variation_fetch
+
+DEFAULT_DB_PATH = 'catalog.db'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS categories (
+    url TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    level INTEGER NOT NULL,
+    parent_url TEXT,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_categories_parent ON categories(parent_url);
+
+CREATE TABLE IF NOT EXISTS category_paths (
+    id INTEGER PRIMARY KEY,
+    path_key TEXT NOT NULL UNIQUE,
+    level1 TEXT,
+    level2 TEXT,
+    level3 TEXT
+);
+
+CREATE TABLE IF NOT EXISTS masters (
+    pid TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    first_seen REAL NOT NULL,
+    last_seen REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS master_categories (
+    pid TEXT NOT NULL REFERENCES masters(pid),
+    category_url TEXT NOT NULL,
+    PRIMARY KEY (pid, category_url)
+);
+
+CREATE TABLE IF NOT EXISTS variants (
+    url TEXT PRIMARY KEY,
+    variant_key TEXT,
+    pid TEXT,
+    color TEXT,
+    category_path_id INTEGER REFERENCES category_paths(id),
+    extra TEXT,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_variants_pid ON variants(pid);
+CREATE INDEX IF NOT EXISTS idx_variants_key ON variants(variant_key);
+
+CREATE TABLE IF NOT EXISTS descriptions (
+    id INTEGER PRIMARY KEY,
+    sha1 TEXT NOT NULL UNIQUE,
+    text TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS details (
+    url TEXT PRIMARY KEY,
+    variant_key TEXT,
+    color_key TEXT,
+    pid TEXT,
+    title TEXT,
+    color TEXT,
+    width TEXT,
+    price TEXT,
+    sizes TEXT,
+    image_urls TEXT,
+    extra TEXT,
+    description_id INTEGER REFERENCES descriptions(id),
+    category_path_id INTEGER REFERENCES category_paths(id),
+    scraped_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_details_pid ON details(pid);
+CREATE INDEX IF NOT EXISTS idx_details_key ON details(variant_key);
+CREATE INDEX IF NOT EXISTS idx_details_color_key ON details(color_key);
+
+CREATE TABLE IF NOT EXISTS failures (
+    url TEXT NOT NULL,
+    variant_key TEXT,
+    color_key TEXT,
+    stage TEXT NOT NULL,
+    reason TEXT,
+    attempts INTEGER NOT NULL DEFAULT 1,
+    last_seen REAL NOT NULL,
+    PRIMARY KEY (url, stage)
+);
+CREATE INDEX IF NOT EXISTS idx_failures_key ON failures(variant_key, stage);
+CREATE INDEX IF NOT EXISTS idx_failures_color_key ON failures(color_key, stage);
+
+CREATE TABLE IF NOT EXISTS stock (
+    color_key TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    price TEXT,
+    size_matrix TEXT,
+    width_values TEXT,
+    checked_at REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS stock_events (
+    id INTEGER PRIMARY KEY,
+    color_key TEXT NOT NULL,
+    url TEXT NOT NULL,
+    type TEXT NOT NULL,
+    width TEXT,
+    size_group TEXT,
+    size TEXT,
+    old TEXT,
+    new TEXT,
+    observed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_stock_events_key ON stock_events(color_key);
+
+CREATE TABLE IF NOT EXISTS crawl_schedule (
+    kind TEXT NOT NULL,
+    url TEXT NOT NULL,
+    name TEXT,
+    boost REAL NOT NULL DEFAULT 1,
+    interval REAL NOT NULL,
+    next_due REAL NOT NULL,
+    checks INTEGER NOT NULL DEFAULT 0,
+    changes INTEGER NOT NULL DEFAULT 0,
+    content_hash TEXT,
+    last_checked REAL,
+    last_changed REAL,
+    last_cost INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (kind, url)
+);
+
+CREATE TABLE IF NOT EXISTS crawl_attempts (
+    id INTEGER PRIMARY KEY,
+    kind TEXT NOT NULL,
+    url TEXT NOT NULL,
+    cost INTEGER NOT NULL,
+    checked_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_crawl_attempts_time ON crawl_attempts(checked_at);
+"""
+
+# 各表中由 url 计算出的键列（列名即 sfcc_url 中的函数名）
+_KEY_COLUMNS = {
+    'variants': ('variant_key', 'pid'),
+    'details': ('variant_key', 'color_key', 'pid'),
+    'failures': ('variant_key', 'color_key'),
+    'stock_events': ('color_key',),
+}
+
+# 详情记录中单独成列的字段，其余字段原样存进 extra
+_DETAIL_COLUMNS = ('url', 'title', 'color', 'width', 'price', 'sizes', 'image_urls', 'description', 'category')
+
+# 颜色变体记录中单独成列（或存为分类路径）的字段，其余字段原样存进 extra
+_VARIANT_COLUMNS = ('url', 'color', 'level1_category', 'level2_category', 'level3_category')
+
+# crawl_schedule 表的列
+_SCHEDULE_COLUMNS = ('kind', 'url', 'name', 'boost', 'interval', 'next_due', 'checks', 'changes',
+                     'content_hash', 'last_checked', 'last_changed', 'last_cost')
+
+
+def _dumps(value):
+    return json.dumps(value, ensure_ascii=False)
+
+
+def _loads(text):
+    return json.loads(text) if text is not None else None
+
+
+class CatalogStore:
+
+    def __init__(self, path=None):
+        self.path = path or os.getenv('CATALOG_DB', DEFAULT_DB_PATH)
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self._migrate()
+        self.conn.executescript(SCHEMA)
+        self._path_ids = {}
+        self._description_ids = {}
+
+    def _migrate(self):
+        """
+        旧版数据库缺少 variant_key / color_key 列：补上并回填。
+        键的计算规则变化（PRAGMA user_version 小于 sfcc_url.KEY_VERSION）时重新计算所有键列，
+        stock 以颜色键为主键，新键相同的几行只保留最后更新的一行；masters 改为按款式 pid 合并。
+        """
+        stale = self.conn.execute('PRAGMA user_version').fetchone()[0] < sfcc_url.KEY_VERSION
+        columns = [row[1] for row in self.conn.execute('PRAGMA table_info(variants)')]
+        if columns and 'extra' not in columns:
+            self.conn.execute('ALTER TABLE variants ADD COLUMN extra TEXT')
+        for table, key_columns in _KEY_COLUMNS.items():
+            columns = [row[1] for row in self.conn.execute(f'PRAGMA table_info({table})')]
+            for column in key_columns:
+                if columns and (stale or column not in columns):
+                    key_func = getattr(sfcc_url, column)
+                    if column not in columns:
+                        self.conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} TEXT')
+                    rows = self.conn.execute(f'SELECT url FROM {table} GROUP BY url').fetchall()
+                    self.conn.executemany(f'UPDATE {table} SET {column} = ? WHERE url = ?',
+                                          [(key_func(url), url) for (url,) in rows])
+        if stale and self.conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'stock'").fetchone():
+            latest = {}
+            for row in self.conn.execute('SELECT url, price, size_matrix, width_values, checked_at FROM stock '
+                                         'ORDER BY checked_at').fetchall():
+                latest[sfcc_url.color_key(row[0])] = row
+            self.conn.execute('DELETE FROM stock')
+            self.conn.executemany('INSERT INTO stock (color_key, url, price, size_matrix, width_values, checked_at) '
+                                  'VALUES (?, ?, ?, ?, ?, ?)', [(key,) + row for key, row in latest.items()])
+        if stale and self.conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'masters'").fetchone():
+            self._merge_masters()
+        self.conn.execute(f'PRAGMA user_version = {sfcc_url.KEY_VERSION}')
+        self.conn.commit()
+
+    def _merge_masters(self):
+        """
+        旧版数据库按颜色 pid 存 masters：合并为款式 pid，first_seen 取最早、url 和 last_seen 取最近的一条。
+        """
+        merged = {}
+        for pid, url, first_seen, last_seen in self.conn.execute(
+                'SELECT pid, url, first_seen, last_seen FROM masters ORDER BY last_seen').fetchall():
+            previous = merged.get(sfcc_url.master_pid(pid))
+            merged[sfcc_url.master_pid(pid)] = (url, min(first_seen, previous[1]) if previous else first_seen, last_seen)
+        categories = {(sfcc_url.master_pid(pid), category_url) for pid, category_url in
+                      self.conn.execute('SELECT pid, category_url FROM master_categories').fetchall()}
+        self.conn.execute('DELETE FROM master_categories')
+        self.conn.execute('DELETE FROM masters')
+        self.conn.executemany('INSERT INTO masters (pid, url, first_seen, last_seen) VALUES (?, ?, ?, ?)',
+                              [(pid,) + row for pid, row in merged.items()])
+        self.conn.executemany('INSERT INTO master_categories (pid, category_url) VALUES (?, ?)', sorted(categories))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+    def commit(self):
+        self.conn.commit()
+
+    # ---- 规范化的共享值 ----
+
+    def category_path_id(self, category):
+        """
+        分类路径只存一次，返回其 id。level1/level2 可能是字符串或列表（去重后的合并结果），原样保留。
+        """
+        if not category:
+            return None
+        levels = (category.get('level1_category'), category.get('level2_category'), category.get('level3_category'))
+        path_key = _dumps(levels)
+        path_id = self._path_ids.get(path_key)
+        if path_id is not None:
+            return path_id
+        self.conn.execute(
+            'INSERT OR IGNORE INTO category_paths (path_key, level1, level2, level3) VALUES (?, ?, ?, ?)',
+            (path_key, *(_dumps(level) for level in levels)),
+        )
+        path_id = self.conn.execute('SELECT id FROM category_paths WHERE path_key = ?', (path_key,)).fetchone()[0]
+        self._path_ids[path_key] = path_id
+        return path_id
+
+    def category_path(self, path_id):
+        if path_id is None:
+            return None
+        row = self.conn.execute('SELECT level1, level2, level3 FROM category_paths WHERE id = ?', (path_id,)).fetchone()
+        return {
+            'level1_category': _loads(row[0]),
+            'level2_category': _loads(row[1]),
+            'level3_category': _loads(row[2]),
+        }
+
+    def description_id(self, text):
+        if text is None:
+            return None
+        sha1 = hashlib.sha1(text.encode('utf-8')).hexdigest()
+        description_id = self._description_ids.get(sha1)
+        if description_id is not None:
+            return description_id
+        self.conn.execute('INSERT OR IGNORE INTO descriptions (sha1, text) VALUES (?, ?)', (sha1, text))
+        description_id = self.conn.execute('SELECT id FROM descriptions WHERE sha1 = ?', (sha1,)).fetchone()[0]
+        self._description_ids[sha1] = description_id
+        return description_id
+
+    # ---- 写入 ----
+
+    def upsert_category(self, url, name, level, parent_url=None):
+        self.conn.execute(
+            'INSERT INTO categories (url, name, level, parent_url, updated_at) VALUES (?, ?, ?, ?, ?) '
+            'ON CONFLICT(url) DO UPDATE SET name = excluded.name, level = excluded.level, '
+            'parent_url = excluded.parent_url, updated_at = excluded.updated_at',
+            (url, name, level, parent_url, time.time()),
+        )
+
+    def upsert_master(self, url, category_url=None):
+        # 同一款式的不同颜色链接是同一个产品
+        pid = sfcc_url.master_pid(sfcc_url.pid(url) or url)
+        now = time.time()
+        self.conn.execute(
+            'INSERT INTO masters (pid, url, first_seen, last_seen) VALUES (?, ?, ?, ?) '
+            'ON CONFLICT(pid) DO UPDATE SET url = excluded.url, last_seen = excluded.last_seen',
+            (pid, url, now, now),
+        )
+        if category_url:
+            self.conn.execute('INSERT OR IGNORE INTO master_categories (pid, category_url) VALUES (?, ?)',
+                              (pid, category_url))
+        return pid
+
+    def upsert_variant(self, url, color=None, category=None, extra=None):
+        """
+        写入一条颜色变体；extra 为 price、size_matrix、matrix_color 等附加字段，iter_variants 时原样合并回记录。
+        """
+        self.conn.execute(
+            'INSERT INTO variants (url, variant_key, pid, color, category_path_id, extra, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?) '
+            'ON CONFLICT(url) DO UPDATE SET variant_key = excluded.variant_key, pid = excluded.pid, color = excluded.color, '
+            'category_path_id = excluded.category_path_id, extra = excluded.extra, updated_at = excluded.updated_at',
+            (url, sfcc_url.variant_key(url), sfcc_url.pid(url), color, self.category_path_id(category),
+             _dumps(extra) if extra else None, time.time()),
+        )
+
+    def upsert_detail(self, product):
+        """
+        写入一条详情记录（与 birkenstock_all_products_details.json 中的元素结构相同），
+        成功后清除该 url 的详情失败记录。
+        """
+        url = product['url']
+        category = product.get('category')
+        extra = {k: v for k, v in product.items() if k not in _DETAIL_COLUMNS}
+        if category is not None and not isinstance(category, dict):
+            # 旧数据中有字符串形式的分类，不做规范化，原样保留
+            extra['category'] = category
+            category = None
+        self.conn.execute(
+            'INSERT INTO details (url, variant_key, color_key, pid, title, color, width, price, sizes, image_urls, extra, '
+            'description_id, category_path_id, scraped_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) '
+            'ON CONFLICT(url) DO UPDATE SET variant_key = excluded.variant_key, color_key = excluded.color_key, pid = excluded.pid, title = excluded.title, color = excluded.color, '
+            'width = excluded.width, price = excluded.price, sizes = excluded.sizes, '
+            'image_urls = excluded.image_urls, extra = excluded.extra, description_id = excluded.description_id, '
+            'category_path_id = excluded.category_path_id, scraped_at = excluded.scraped_at',
+            (
+                url, sfcc_url.variant_key(url), sfcc_url.color_key(url), sfcc_url.pid(url), product.get('title'), product.get('color'),
+                _dumps(product['width']) if 'width' in product else None,
+                product.get('price'),
+                _dumps(product['sizes']) if 'sizes' in product else None,
+                _dumps(product['image_urls']) if 'image_urls' in product else None,
+                _dumps(extra) if extra else None,
+                self.description_id(product.get('description')),
+                self.category_path_id(category),
+                time.time(),
+            ),
+        )
+        self.conn.execute(f"DELETE FROM failures WHERE {variation_fetch.DETAIL_KEY_NAME} = ? AND stage = 'details'",
+                          (variation_fetch.detail_key(url),))
+
+    def update_prices(self, prices):
+        """
+        只更新详情记录的 price 字段。prices 为 {pid: 价格}（每个颜色有自己的 pid），返回实际发生变化的记录数。
+        """
+        changed = 0
+        for pid, price in prices.items():
+            changed += self.conn.execute('UPDATE details SET price = ? WHERE pid = ? AND price IS NOT ?',
+                                         (price, pid, price)).rowcount
+        return changed
+
+    def record_failure(self, url, stage='details', reason=None):
+        self.conn.execute(
+            'INSERT INTO failures (url, variant_key, color_key, stage, reason, attempts, last_seen) VALUES (?, ?, ?, ?, ?, 1, ?) '
+            'ON CONFLICT(url, stage) DO UPDATE SET reason = excluded.reason, '
+            'attempts = failures.attempts + 1, last_seen = excluded.last_seen',
+            (url, sfcc_url.variant_key(url), sfcc_url.color_key(url), stage, reason, time.time()),
+        )
+
+    def upsert_stock(self, url, price, size_matrix, width_values=None):
+        """
+        写入库存快照：width_values 为 {宽度名称: 宽度代码}，下次监控时直接按宽度代码请求片段。成功后清除该颜色的监控失败记录。
+        """
+        color_key = sfcc_url.color_key(url)
+        self.conn.execute(
+            'INSERT INTO stock (color_key, url, price, size_matrix, width_values, checked_at) VALUES (?, ?, ?, ?, ?, ?) '
+            'ON CONFLICT(color_key) DO UPDATE SET url = excluded.url, price = excluded.price, '
+            'size_matrix = excluded.size_matrix, width_values = excluded.width_values, checked_at = excluded.checked_at',
+            (color_key, url, price, _dumps(size_matrix), _dumps(width_values or {}), time.time()),
+        )
+        self.conn.execute("DELETE FROM failures WHERE color_key = ? AND stage = 'watch'", (color_key,))
+
+    def record_stock_event(self, event):
+        """
+        写入一条库存变化事件（stock_watcher.diff_snapshots 的输出）。
+        """
+        self.conn.execute(
+            'INSERT INTO stock_events (color_key, url, type, width, size_group, size, old, new, observed_at) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (sfcc_url.color_key(event['url']), event['url'], event['type'], event.get('width'), event.get('group'),
+             event.get('size'), _dumps(event.get('old')), _dumps(event.get('new')), event['observed_at']),
+        )
+
+    def upsert_schedule(self, entry):
+        """
+        写入一条调度记录（字段与 crawl_schedule 表的列相同）。
+        """
+        columns = [column for column in _SCHEDULE_COLUMNS if column in entry]
+        self.conn.execute(
+            f"INSERT INTO crawl_schedule ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))}) "
+            f"ON CONFLICT(kind, url) DO UPDATE SET "
+            + ', '.join(f'{column} = excluded.{column}' for column in columns if column not in ('kind', 'url')),
+            [entry[column] for column in columns],
+        )
+
+    def record_attempt(self, kind, url, cost, checked_at):
+        """
+        记录一次调度任务的执行（成功或失败）及其请求数。
+        """
+        self.conn.execute('INSERT INTO crawl_attempts (kind, url, cost, checked_at) VALUES (?, ?, ?, ?)',
+                          (kind, url, cost, checked_at))
+
+    def prune_attempts(self, before):
+        self.conn.execute('DELETE FROM crawl_attempts WHERE checked_at < ?', (before,))
+
+    # ---- 查询 ----
+
+    def has_detail(self, url):
+        return self.conn.execute(f'SELECT 1 FROM details WHERE {variation_fetch.DETAIL_KEY_NAME} = ?',
+                                 (variation_fetch.detail_key(url),)).fetchone() is not None
+
+    def has_failure(self, url, stage='details'):
+        return self.conn.execute(f'SELECT 1 FROM failures WHERE {variation_fetch.DETAIL_KEY_NAME} = ? AND stage = ?',
+                                 (variation_fetch.detail_key(url), stage)).fetchone() is not None
+
+    def detail_count(self):
+        return self.conn.execute('SELECT COUNT(*) FROM details').fetchone()[0]
+
+    def failure_count(self, stage='details'):
+        return self.conn.execute('SELECT COUNT(*) FROM failures WHERE stage = ?', (stage,)).fetchone()[0]
+
+    def get_stock(self, url):
+        row = self.conn.execute('SELECT price, size_matrix, width_values FROM stock WHERE color_key = ?',
+                                (sfcc_url.color_key(url),)).fetchone()
+        if row is None:
+            return None
+        return {'price': row[0], 'size_matrix': _loads(row[1]), 'width_values': _loads(row[2])}
+
+    def iter_stock_events(self, after_id=0):
+        """
+        按写入顺序读取 id 大于 after_id 的库存事件，供下游（例如 Shopify 库存同步）增量消费。
+        """
+        for row in self.conn.execute(
+                'SELECT id, url, type, width, size_group, size, old, new, observed_at FROM stock_events '
+                'WHERE id > ? ORDER BY id', (after_id,)):
+            yield {'id': row[0], 'url': row[1], 'type': row[2], 'width': row[3], 'group': row[4], 'size': row[5],
+                   'old': _loads(row[6]), 'new': _loads(row[7]), 'observed_at': row[8]}
+
+    def detail_color_urls(self):
+        """
+        每个已采集颜色一个 url（按写入顺序），即库存监控的 SKU 列表。
+        """
+        seen = set()
+        urls = []
+        for url, color_key in self.conn.execute('SELECT url, color_key FROM details ORDER BY rowid'):
+            if color_key not in seen:
+                seen.add(color_key)
+                urls.append(url)
+        return urls
+
+    def iter_schedule(self, kind=None):
+        query = f"SELECT {', '.join(_SCHEDULE_COLUMNS)} FROM crawl_schedule"
+        params = ()
+        if kind is not None:
+            query += ' WHERE kind = ?'
+            params = (kind,)
+        for row in self.conn.execute(query + ' ORDER BY rowid', params):
+            yield dict(zip(_SCHEDULE_COLUMNS, row))
+
+    def schedule_spent(self, since):
+        """
+        since 之后已执行的调度任务消耗的请求数（同一任务在窗口内的每次执行和重试都计入），用于按时间窗口控制请求预算。
+        """
+        return self.conn.execute('SELECT COALESCE(SUM(cost), 0) FROM crawl_attempts WHERE checked_at > ?',
+                                 (since,)).fetchone()[0]
+
+    def _detail_from_row(self, row):
+        (url, title, color, width, price, sizes, image_urls, extra, description, category_path_id) = row
+        product = {'url': url, 'title': title}
+        if width is not None:
+            product['width'] = _loads(width)
+        if color is not None:
+            product['color'] = color
+        if sizes is not None:
+            product['sizes'] = _loads(sizes)
+        if price is not None:
+            product['price'] = price
+        if description is not None:
+            product['description'] = description
+        if image_urls is not None:
+            product['image_urls'] = _loads(image_urls)
+        if extra is not None:
+            product.update(_loads(extra))
+        if category_path_id is not None:
+            product['category'] = self.category_path(category_path_id)
+        return product
+
+    _DETAIL_SELECT = (
+        'SELECT d.url, d.title, d.color, d.width, d.price, d.sizes, d.image_urls, d.extra, t.text, d.category_path_id '
+        'FROM details d LEFT JOIN descriptions t ON t.id = d.description_id'
+    )
+
+    def get_detail(self, url):
+        row = self.conn.execute(self._DETAIL_SELECT + ' WHERE d.url = ?', (url,)).fetchone()
+        return self._detail_from_row(row) if row else None
+
+    def details_for_pid(self, pid):
+        return [self._detail_from_row(row) for row in
+                self.conn.execute(self._DETAIL_SELECT + ' WHERE d.pid = ? ORDER BY d.rowid', (pid,))]
+
+    def iter_details(self):
+        for row in self.conn.execute(self._DETAIL_SELECT + ' ORDER BY d.rowid'):
+            yield self._detail_from_row(row)
+
+    def iter_variants(self):
+        for url, color, category_path_id, extra in self.conn.execute(
+                'SELECT url, color, category_path_id, extra FROM variants ORDER BY rowid'):
+            record = {'url': url, 'color': color}
+            category = self.category_path(category_path_id) or {}
+            record['level3_category'] = category.get('level3_category')
+            record['level1_category'] = category.get('level1_category')
+            record['level2_category'] = category.get('level2_category')
+            if extra is not None:
+                record.update(_loads(extra))
+            yield record
+
+    def failed_urls(self, stage='details'):
+        return [row[0] for row in
+                self.conn.execute('SELECT url FROM failures WHERE stage = ? ORDER BY rowid', (stage,))]
+
+    # ---- 与旧 JSON 文件互相转换 ----
+
+    def import_navigation(self, path='第一步_导航目录.json'):
+        count = 0
+        for level1 in json_stream.iter_records(path):
+            self.upsert_category(level1['level1_url'], level1['level1_category'], 1)
+            count += 1
+            for level2 in nav_tree.children(level1):
+                self.upsert_category(level2['level2_url'], level2['level2_category'], 2, level1['level1_url'])
+                count += 1
+                for level3 in nav_tree.children(level2):
+                    self.upsert_category(level3['level3_url'], level3['level3_category'], 3, level2['level2_url'])
+                    count += 1
+        self.commit()
+        return count
+
+    def import_product_links(self, path='第二步_产品链接.json'):
+        count = 0
+        for category in json_stream.iter_records(path):
+            category_url = category.get('level3_url') or category.get('level2_url') or category.get('level1_url')
+            for url in category.get('product_urls', []):
+                self.upsert_master(url, category_url)
+                count += 1
+        self.commit()
+        return count
+
+    def import_variants(self, path='所有颜色变体URL_Cursor_dedup.json'):
+        count = 0
+        for record in json_stream.iter_records(path):
+            extra = {k: v for k, v in record.items() if k not in _VARIANT_COLUMNS}
+            self.upsert_variant(record['url'], record.get('color'), record, extra)
+            count += 1
+        self.commit()
+        return count
+
+    def import_details(self, path='birkenstock_all_products_details.json'):
+        count = 0
+        for product in json_stream.iter_records(path):
+            self.upsert_detail(product)
+            count += 1
+        self.commit()
+        return count
+
+    def import_failures(self, path='NA.txt', stage='details'):
+        count = 0
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                url = line.strip()
+                if url and not self.has_detail(url):
+                    self.record_failure(url, stage)
+                    count += 1
+        self.commit()
+        return count
+
+    def export_details(self, path='birkenstock_all_products_details.json'):
+        """
+        按写入顺序逐条导出，格式与 1-1 脚本原来写出的 JSON 相同。
+        """
+        return json_stream.write_json_array(path, self.iter_details())
+
+    def export_variants(self, path='所有颜色变体URL_Cursor_dedup.json'):
+        return json_stream.write_json_array(path, self.iter_variants())
+
+    def export_failures(self, path='NA.txt', stage='details'):
+        urls = self.failed_urls(stage)
+        with open(path, 'w', encoding='utf-8') as f:
+            for url in urls:
+                f.write(url + '\n')
+        return len(urls)
+
+
+IMPORTS = [
+    ('第一步_导航目录.json', 'import_navigation', '个分类'),
+    ('第二步_产品链接.json', 'import_product_links', '个产品链接'),
+    ('所有颜色变体URL_Cursor_dedup.json', 'import_variants', '个颜色变体'),
+    ('birkenstock_all_products_details.json', 'import_details', '条详情'),
+    ('NA.txt', 'import_failures', '条失败记录'),
+]
+
+EXPORTS = [
+    ('所有颜色变体URL_Cursor_dedup.json', 'export_variants', '个颜色变体'),
+    ('birkenstock_all_products_details.json', 'export_details', '条详情'),
+    ('NA.txt', 'export_failures', '条失败记录'),
+]
+
+
+def main():
+    command = sys.argv[1] if len(sys.argv) > 1 else ''
+    if command not in ('import', 'export'):
+        print("用法: python catalog_store.py import|export")
+        return
+
+    with CatalogStore() as store:
+        if command == 'import':
+            for path, method, unit in IMPORTS:
+                if os.path.exists(path):
+                    print(f"从 {path} 导入 {getattr(store, method)(path)} {unit}。")
+                else:
+                    print(f"跳过: 文件 '{path}' 不存在。")
+        else:
+            for path, method, unit in EXPORTS:
+                print(f"导出 {getattr(store, method)(path)} {unit}到 {path}。")
+        print(f"数据库: {store.path}")
+
+
+if __name__ == '__main__':
+    main()
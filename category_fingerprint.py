@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+第二步的分类网格指纹：网格标题中的结果数 + 首屏 tile pid 列表的哈希。
+
+打开分类页后先计算指纹（不点击“加载更多”），与上次 第二步_产品链接.json 中该分类保存的指纹相同时，
+直接沿用上次的 product_urls，跳过完整翻页；指纹写回输出文件中的 fingerprint 字段，供下次运行比较。
+结果数不变、首屏不变但后面几页有替换的情况指纹发现不了，因此超过 CATEGORY_FINGERPRINT_MAX_AGE 天
+没有完整翻页的分类仍会重新翻页。
+指纹只在网格完整翻完（“加载更多”按钮消失）之后才写入或刷新；翻页中途失败时保留上次的指纹并标记 incomplete，
+这次不完整的产品链接在下次运行时不会被当作“未变化”沿用。
+
+环境变量：
+    CATEGORY_FINGERPRINT=0           关闭指纹比较，每个分类都完整翻页
+    CATEGORY_FINGERPRINT_MAX_AGE     距上次完整翻页超过多少天强制重新翻页（默认 7）
+"""
+import hashlib
+import json
+import os
+import re
+import time
+
+import sfcc_url
+import xhr_capture
+
+ENABLED = os.getenv('CATEGORY_FINGERPRINT', '1') == '1'
+MAX_AGE = float(os.getenv('CATEGORY_FINGERPRINT_MAX_AGE', '7')) * 86400
+
+# 网格标题中显示结果数的元素，按顺序取第一个存在的
+RESULT_COUNT_JS = """
+() => {
+    const selectors = ['.results-hits', '.search-result-count', '.result-count', '.pagination-results', '.search-results-count'];
+    for (const selector of selectors) {
+        const el = document.querySelector(selector);
+        if (el) return (el.innerText || el.textContent || '').trim();
+    }
+    return null;
+}
+"""
+
+_COUNT_RE = re.compile(r'\d[\d,.]*')
+
+
+def parse_result_count(text):
+    """
+    "1,234 Results" -> 1234，没有数字时返回 None。
+    """
+    match = _COUNT_RE.search(text or '')
+    if not match:
+        return None
+    digits = re.sub(r'\D', '', match.group(0))
+    return int(digits) if digits else None
+
+
+def compute(result_count, tiles):
+    """
+    由结果数和首屏 tile 计算指纹字符串。
+    """
+    pids = [sfcc_url.pid(tile['url']) or tile.get('pid') or tile['url'] for tile in tiles]
+    digest = hashlib.sha1(json.dumps(pids).encode('utf-8')).hexdigest()[:16]
+    return f"{result_count if result_count is not None else '?'}:{digest}"
+
+
+async def page_fingerprint(page):
+    """
+    在刚打开、尚未点击“加载更多”的分类页上计算指纹；首屏没有 tile 时返回 None（不参与比较）。
+    """
+    tiles = xhr_capture.parse_grid_html(await page.content())
+    if not tiles:
+        return None
+    return compute(parse_result_count(await page.evaluate(RESULT_COUNT_JS)), tiles)
+
+
+def load_previous(path='第二步_产品链接.json'):
+    """
+    读取上次的第二步输出，返回 {level3_url: 分类记录}；文件不存在或无法解析时返回空字典。
+    """
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            categories = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+    return {category['level3_url']: category for category in categories if category.get('level3_url')}
+
+
+def is_unchanged(previous, fingerprint, now=None):
+    """
+    指纹与上次相同、上次采集到了产品链接且完整翻页未过期时返回 True。
+    """
+    if not ENABLED or not previous or fingerprint is None or not previous.get('product_urls'):
+        return False
+    stored = previous.get('fingerprint') or {}
+    if stored.get('incomplete') or stored.get('value') != fingerprint:
+        return False
+    return (now or time.time()) - stored.get('traversed_at', 0) < MAX_AGE
+
+
+def record(category_data, fingerprint, previous=None, skipped=False):
+    """
+    把指纹写入分类记录：跳过翻页时沿用上次的完整翻页时间，否则记为现在。只在跳过翻页或完整翻页之后调用。
+    """
+    if fingerprint is None:
+        category_data.pop('fingerprint', None)
+        return
+    traversed_at = (previous or {}).get('fingerprint', {}).get('traversed_at') if skipped else None
+    category_data['fingerprint'] = {'value': fingerprint, 'traversed_at': traversed_at or time.time()}
+
+
+def keep_previous(category_data, previous=None):
+    """
+    翻页未完成（“加载更多”点击失败）时调用：保留上次的指纹并标记 incomplete，不刷新完整翻页时间。
+    """
+    stored = (previous or {}).get('fingerprint')
+    if stored:
+        category_data['fingerprint'] = dict(stored, incomplete=True)
+    else:
+        category_data.pop('fingerprint', None)
@@ -1,25 +1,314 @@
+# -*- coding: utf-8 -*-
+"""
+流水线 JSON 产物的校验和统计：流式读取，按块分给进程池校验，汇总成一份报告。
+
+校验的产物（名称 -> 默认文件）：
+    nav              第一步_导航目录.json（展开成一/二/三级节点）
+    links            第二步_产品链接.json
+    variants         所有颜色变体URL_Cursor.json（去重前，重复是正常的，只统计）
+    variants_dedup   所有颜色变体URL_Cursor_dedup.json
+    details          birkenstock_all_products_details.json
+    na               NA.txt（每行一个 url）
+
+报告内容：
+- 按规范键（分类为 (上级, url)，颜色记录为 sfcc_url.color_key，N/A 记录为 sfcc_url.variant_key）统计重复
+- 每个字段缺失、为 N/A、为空、类型不符的条数；详情字段附带对应的页面选择器，选择器失效时一眼能看出是哪一个
+- 分布：宽度、尺码组、每个颜色的尺码数、每个颜色的图片数、每个分类的产品数等
+
+某个字段的缺失率超过 CHECK_MAX_MISSING_RATE，或要求唯一的产物中出现重复时，报告中列为问题，并以退出码 1 结束，
+可以放在导出步骤之前拦住选择器失效导致的大面积 N/A。
+
+命令行用法：
+    python check_json.py                        校验所有存在的产物
+    python check_json.py details na             只校验指定产物
+    python check_json.py details=other.json     指定产物使用其他文件
+
+环境变量：
+    CHECK_WORKERS               进程数（默认 CPU 核数）
+    CHECK_CHUNK_SIZE            每块记录数（默认 1000）
+    CHECK_MAX_MISSING_RATE      字段缺失率超过多少视为问题（默认 0.05）
+    CHECK_REPORT                报告文件（默认 校验报告.json）
+"""
 import json
+import os
+import sys
+import time
+from collections import Counter, defaultdict
+from multiprocessing import Pool
+
+import json_stream
+import nav_tree
+import sfcc_url
+
+WORKERS = int(os.getenv('CHECK_WORKERS', '0')) or os.cpu_count() or 1
+CHUNK_SIZE = int(os.getenv('CHECK_CHUNK_SIZE', '1000'))
+MAX_MISSING_RATE = float(os.getenv('CHECK_MAX_MISSING_RATE', '0.05'))
+REPORT_FILE = os.getenv('CHECK_REPORT', '校验报告.json')
+
+# 每个字段: (允许的类型, 详情页上对应的选择器)
+_CATEGORY_NAME = (str, list)
+DETAIL_FIELDS = {
+    'url': (str, None),
+    'title': (str, 'span.heading-1'),
+    'price': (str, 'span.price-standard'),
+    'width': (str, 'ul.swatches.width li span.swatchanchor.width-type.width'),
+    'sizes': (dict, '.wsizegroup / .msizegroup / .ksizegroup .swatchanchor'),
+    'description': (str, 'span.product-description-text, ul.product-description-list li'),
+    'image_urls': (list, 'div.grid-tile.thumb img.productthumbnail'),
+}
+VARIANT_FIELDS = {
+    'url': (str, None),
+    'color': (str, None),
+    'level1_category': (_CATEGORY_NAME, None),
+    'level2_category': (_CATEGORY_NAME, None),
+    'level3_category': (_CATEGORY_NAME, None),
+}
+
+# 名称 -> 默认文件、读取方式、字段、规范键、是否要求唯一
+ARTIFACTS = {
+    'nav': {'path': '第一步_导航目录.json', 'reader': 'tree', 'unique': True,
+            'fields': {'level': (int, None), 'name': (str, 'a.a-level-1/2/3'), 'url': (str, 'a.a-level-1/2/3')}},
+    'links': {'path': '第二步_产品链接.json', 'reader': 'array', 'unique': True,
+              'fields': {'level1_category': (_CATEGORY_NAME, None), 'level2_category': (_CATEGORY_NAME, None),
+                         'level3_category': (_CATEGORY_NAME, None), 'level3_url': (str, None),
+                         'product_urls': (list, 'a.product-tile')}},
+    'variants': {'path': '所有颜色变体URL_Cursor.json', 'reader': 'array', 'unique': False, 'fields': VARIANT_FIELDS},
+    'variants_dedup': {'path': '所有颜色变体URL_Cursor_dedup.json', 'reader': 'array', 'unique': True,
+                       'fields': VARIANT_FIELDS},
+    'details': {'path': 'birkenstock_all_products_details.json', 'reader': 'array', 'unique': True,
+                'fields': DETAIL_FIELDS},
+    'na': {'path': 'NA.txt', 'reader': 'lines', 'unique': True, 'fields': {'url': (str, None)}},
+}
+
+
+# ---- 读取 ----
+
+def iter_artifact(name, path):
+    reader = ARTIFACTS[name]['reader']
+    if reader == 'lines':
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield {'url': line.strip()}
+    elif reader == 'tree':
+        for level1 in json_stream.iter_records(path):
+            for level, node_name, url, parent_url in nav_tree.iter_nodes([level1]):
+                yield {'level': level, 'name': node_name, 'url': url, 'parent_url': parent_url}
+    else:
+        yield from json_stream.iter_records(path)
+
+
+def iter_chunks(name, path):
+    chunk = []
+    for record in iter_artifact(name, path):
+        chunk.append(record)
+        if len(chunk) >= CHUNK_SIZE:
+            yield name, chunk
+            chunk = []
+    if chunk:
+        yield name, chunk
+
+
+# ---- 校验（在子进程中执行）----
+
+def canonical_key(name, record):
+    if name == 'nav':
+        # 同一分类可以挂在多个上级下，按 (上级, url) 判断重复
+        return f"{record.get('parent_url')}|{record.get('url')}"
+    if name == 'links':
+        return f"{record.get('level2_url')}|{record.get('level3_url')}"
+    url = record.get('url')
+    if not url:
+        return None
+    # N/A 记录按宽度区分，同一颜色的不同宽度不算重复
+    return sfcc_url.variant_key(url) if name == 'na' else sfcc_url.color_key(url)
+
+
+def _size_bucket(count):
+    for upper in (0, 5, 10, 20, 50, 100, 500):
+        if count <= upper:
+            return f"<={upper}"
+    return '>500'
+
+
+def _distributions(name, record, dist):
+    if name == 'nav':
+        dist['level'][record.get('level')] += 1
+    elif name == 'links':
+        dist['products_per_category'][_size_bucket(len(record.get('product_urls') or []))] += 1
+    elif name in ('variants', 'variants_dedup'):
+        level1 = record.get('level1_category')
+        for value in (level1 if isinstance(level1, list) else [level1]):
+            dist['level1_category'][value] += 1
+    elif name == 'details':
+        width = record.get('width')
+        if isinstance(width, str) and width != 'N/A':
+            for value in width.split(', '):
+                dist['width'][value] += 1
+        sizes = record.get('sizes')
+        if isinstance(sizes, dict):
+            for group in sizes:
+                dist['size_group'][group] += 1
+            dist['size_count'][sum(len(values) for values in sizes.values())] += 1
+        dist['image_count'][len(record.get('image_urls') or [])] += 1
+    elif name == 'na':
+        dist['url_type']['Product-Variation' if 'Product-Variation' in record['url'] else 'product page'] += 1
+
+
+def check_chunk(task):
+    """
+    校验一块记录，返回可合并的部分统计。
+    """
+    name, records = task
+    fields = ARTIFACTS[name]['fields']
+    stats = {'records': 0, 'missing': Counter(), 'na': Counter(), 'empty': Counter(), 'type_errors': Counter(),
+             'keys': Counter(), 'examples': {}, 'dist': {}}
+    dist = defaultdict(Counter)
+    for record in records:
+        stats['records'] += 1
+        if not isinstance(record, dict):
+            stats['type_errors']['<record>'] += 1
+            continue
+        label = record.get('url') or record.get('level3_url')
+        for field, (types, _) in fields.items():
+            if field not in record or record[field] is None:
+                problem = 'missing'
+            elif record[field] == 'N/A':
+                problem = 'na'
+            elif not isinstance(record[field], types):
+                problem = 'type_errors'
+            elif record[field] in ('', [], {}):
+                problem = 'empty'
+            else:
+                continue
+            stats[problem][field] += 1
+            stats['examples'].setdefault(f"{problem}:{field}", label)
+        key = canonical_key(name, record)
+        if key:
+            stats['keys'][key] += 1
+        _distributions(name, record, dist)
+    stats['dist'] = {key: dict(counter) for key, counter in dist.items()}
+    return name, stats
+
+
+# ---- 汇总 ----
+
+def _new_summary():
+    return {'records': 0, 'missing': Counter(), 'na': Counter(), 'empty': Counter(), 'type_errors': Counter(),
+            'keys': Counter(), 'examples': {}, 'dist': {}}
+
+
+def merge(summary, stats):
+    summary['records'] += stats['records']
+    for key in ('missing', 'na', 'empty', 'type_errors', 'keys'):
+        summary[key].update(stats[key])
+    for key, label in stats['examples'].items():
+        summary['examples'].setdefault(key, label)
+    for key, counts in stats['dist'].items():
+        summary['dist'].setdefault(key, Counter()).update(counts)
+
+
+def _sorted_counts(counter):
+    return {str(key): count for key, count in sorted(counter.items(), key=lambda item: (-item[1], str(item[0])))}
+
+
+def build_report(name, path, summary):
+    """
+    一个产物的报告：字段问题、重复、分布，以及超过阈值的问题列表。
+    """
+    spec = ARTIFACTS[name]
+    records = summary['records']
+    duplicates = {key: count for key, count in summary['keys'].items() if count > 1}
+    fields = {}
+    problems = []
+    for field, (_, selector) in spec['fields'].items():
+        counts = {problem: summary[problem][field] for problem in ('missing', 'na', 'empty', 'type_errors')
+                  if summary[problem][field]}
+        if not counts:
+            continue
+        rate = sum(counts.values()) / records if records else 0
+        fields[field] = {**counts, 'rate': round(rate, 4), 'selector': selector,
+                         'examples': {problem: summary['examples'].get(f"{problem}:{field}") for problem in counts}}
+        if rate > MAX_MISSING_RATE:
+            problems.append(f"{field} 缺失率 {rate:.1%}" + (f"（选择器 {selector}）" if selector else ''))
+    if summary['type_errors']['<record>']:
+        problems.append(f"{summary['type_errors']['<record>']} 条记录不是对象")
+    if spec['unique'] and duplicates:
+        problems.append(f"{len(duplicates)} 个规范键重复")
+    return {
+        'path': path,
+        'records': records,
+        'unique_keys': len(summary['keys']),
+        'duplicate_keys': len(duplicates),
+        'duplicate_examples': dict(sorted(duplicates.items(), key=lambda item: -item[1])[:10]),
+        'fields': fields,
+        'distributions': {key: _sorted_counts(counter) for key, counter in summary['dist'].items()},
+        'problems': problems,
+    }
+
+
+def print_report(name, report):
+    print(f"[{name}] {report['path']}: {report['records']} 条，唯一键 {report['unique_keys']}，"
+          f"重复键 {report['duplicate_keys']}")
+    for field, info in report['fields'].items():
+        counts = '，'.join(f"{problem} {info[problem]}" for problem in ('missing', 'na', 'empty', 'type_errors')
+                          if problem in info)
+        selector = f"  选择器: {info['selector']}" if info['selector'] else ''
+        print(f"    {field}: {counts}（{info['rate']:.1%}）{selector}")
+    for key, counts in report['distributions'].items():
+        top = '，'.join(f"{value}: {count}" for value, count in list(counts.items())[:8])
+        print(f"    分布 {key}: {top}")
+    for problem in report['problems']:
+        print(f"    问题: {problem}")
+
+
+def parse_args(argv):
+    """
+    命令行参数 -> {产物名称: 文件}；没有参数时为所有存在的默认文件。
+    """
+    targets = {}
+    for arg in argv:
+        name, _, path = arg.partition('=')
+        if name not in ARTIFACTS:
+            raise SystemExit(f"未知的产物: {name}（可选: {', '.join(ARTIFACTS)}）")
+        targets[name] = path or ARTIFACTS[name]['path']
+    if not argv:
+        targets = {name: spec['path'] for name, spec in ARTIFACTS.items() if os.path.exists(spec['path'])}
+    return targets
+
+
+def main():
+    targets = parse_args(sys.argv[1:])
+    missing = [path for path in targets.values() if not os.path.exists(path)]
+    if missing:
+        raise SystemExit(f"错误: 文件不存在: {', '.join(missing)}")
+    if not targets:
+        print("没有找到可校验的文件。")
+        return
+
+    start_time = time.time()
+    summaries = {name: _new_summary() for name in targets}
+
+    def tasks():
+        for name, path in targets.items():
+            yield from iter_chunks(name, path)
+
+    with Pool(WORKERS) as pool:
+        for name, stats in pool.imap_unordered(check_chunk, tasks()):
+            merge(summaries[name], stats)
+
+    reports = {name: build_report(name, path, summaries[name]) for name, path in targets.items()}
+    for name, report in reports.items():
+        print_report(name, report)
+    with open(REPORT_FILE, 'w', encoding='utf-8') as f:
+        json.dump(reports, f, ensure_ascii=False, indent=4)
+
+    problem_count = sum(len(report['problems']) for report in reports.values())
+    print(f"校验完成（{WORKERS} 个进程，耗时 {time.time() - start_time:.1f} 秒），报告已写入 {REPORT_FILE}，"
+          f"共 {problem_count} 个问题。")
+    if problem_count:
+        sys.exit(1)
+
 
-try:
-    with open('所有颜色变体URL_Cursor.json', 'r', encoding='utf-8') as f:
-        data = json.load(f)
-    
-    print(f"JSON对象数量: {len(data)}")
-    print(f"数据类型: {type(data)}")
-    
-    if isinstance(data, list) and len(data) > 0:
-        print(f"第一个对象: {data[0]}")
-        print(f"最后一个对象: {data[-1]}")
-        
-        # 检查是否有重复的URL
-        urls = [item.get('url') for item in data if isinstance(item, dict)]
-        unique_urls = set(urls)
-        print(f"唯一URL数量: {len(unique_urls)}")
-        print(f"总URL数量: {len(urls)}")
-        
-        # 检查是否有None或空URL
-        none_urls = [url for url in urls if not url]
-        print(f"空URL数量: {len(none_urls)}")
-        
-except Exception as e:
-    print(f"错误: {e}")
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+从分类网格刷新价格，不访问产品详情页。
+
+分类网格的每个 tile 上已经显示价格。这里复用第二步单线程脚本 scrape_product_urls_from_category 的翻页流程
+（打开三级分类、点击“加载更多”直到加载完毕），在加载完毕后一次性解析网格 HTML（xhr_capture.parse_grid_html），
+取得每个 tile 的 pid（每个颜色有自己的 pid）和价格，然后只更新已采集产品记录中的 price 字段，其余字段不变。
+全量价格刷新只需约数百个请求（168 个三级分类及其“加载更多”），而不是数千个详情页。
+
+设置了 CATALOG_DB 时更新目录库中的详情记录并重新导出详情 JSON，否则直接改写详情 JSON 文件。
+
+环境变量：
+    GRID_PRICE_NAV           导航目录文件（默认 第一步_导航目录.json）
+    GRID_PRICE_DETAILS       详情文件（默认 birkenstock_all_products_details.json）
+    GRID_PRICE_CONCURRENCY   同时打开的分类页数（默认 5）
+    CATALOG_DB               目录库文件（设置时使用目录库）
+"""
+import asyncio
+import importlib
+import json
+import os
+
+from playwright.async_api import async_playwright
+
+import catalog_store
+import json_stream
+import sfcc_url
+import xhr_capture
+
+step2 = importlib.import_module('第二步_从导航采集所有分类下产品链接_单线程')
+
+NAV_FILE = os.getenv('GRID_PRICE_NAV', '第一步_导航目录.json')
+DETAILS_FILE = os.getenv('GRID_PRICE_DETAILS', 'birkenstock_all_products_details.json')
+CONCURRENCY = int(os.getenv('GRID_PRICE_CONCURRENCY', '5'))
+
+
+def tile_prices(tiles):
+    """
+    网格 tile -> {pid: 价格}，没有价格的 tile 跳过。
+    """
+    prices = {}
+    for tile in tiles:
+        pid = sfcc_url.pid(tile['url']) or tile.get('pid')
+        if pid and tile.get('price'):
+            prices.setdefault(pid, tile['price'])
+    return prices
+
+
+async def collect_grid_prices(browser, categories):
+    """
+    并发遍历所有三级分类，返回 {pid: 价格}。同一产品出现在多个分类中时保留首次读到的价格。
+    """
+    prices = {}
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+
+    async def on_loaded(page, category_data):
+        category_prices = tile_prices(xhr_capture.parse_grid_html(await page.content()))
+        for pid, price in category_prices.items():
+            prices.setdefault(pid, price)
+        print(f"三级分类 '{category_data['level3_category']}' 读取到 {len(category_prices)} 个价格")
+
+    async def bounded_scrape(category_data):
+        async with semaphore:
+            await step2.scrape_product_urls_from_category(browser, category_data, on_loaded)
+
+    await asyncio.gather(*(bounded_scrape(category_data) for category_data in categories))
+    return prices
+
+
+def update_details_json(path, prices):
+    """
+    逐条读写详情 JSON，只替换 price 字段。返回 (匹配到网格价格的记录数, 价格变化的记录数, 记录总数)。
+    """
+    stats = {'matched': 0, 'changed': 0, 'total': 0}
+
+    def updated_records():
+        for product in json_stream.iter_records(path):
+            stats['total'] += 1
+            price = prices.get(sfcc_url.pid(product.get('url') or ''))
+            if price is not None:
+                stats['matched'] += 1
+                if product.get('price') != price:
+                    product['price'] = price
+                    stats['changed'] += 1
+            yield product
+
+    tmp_path = path + '.tmp'
+    json_stream.write_json_array(tmp_path, updated_records())
+    os.replace(tmp_path, path)
+    return stats['matched'], stats['changed'], stats['total']
+
+
+async def main():
+    try:
+        with open(NAV_FILE, 'r', encoding='utf-8') as f:
+            categories = step2.third_level_categories(json.load(f))
+    except FileNotFoundError:
+        print(f"错误: 未找到 {NAV_FILE} 文件。")
+        return
+    if not categories:
+        print("未找到任何三级分类。")
+        return
+    print(f"从 {len(categories)} 个三级分类的网格刷新价格。")
+
+    async with async_playwright() as p:
+        browser = await p.chromium.launch(headless=True)
+        try:
+            prices = await collect_grid_prices(browser, categories)
+        finally:
+            await browser.close()
+    print(f"网格上共读取到 {len(prices)} 个产品的价格。")
+    if not prices:
+        return
+
+    if os.getenv('CATALOG_DB'):
+        with catalog_store.CatalogStore() as store:
+            changed = store.update_prices(prices)
+            store.commit()
+            print(f"目录库 {store.path} 中 {changed} 条详情记录的价格已更新。")
+            print(f"从 {store.path} 导出 {store.export_details(DETAILS_FILE)} 条产品数据到 {DETAILS_FILE}。")
+    elif os.path.exists(DETAILS_FILE):
+        matched, changed, total = update_details_json(DETAILS_FILE, prices)
+        print(f"{DETAILS_FILE} 共 {total} 条记录，{matched} 条在网格上找到价格，其中 {changed} 条价格已更新。")
+    else:
+        print(f"错误: 未找到详情文件 {DETAILS_FILE}。")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
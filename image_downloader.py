@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+"""
+把产品记录中的 image_urls 镜像到本地。
+
+- 规范化 CDN 地址：去掉 sw/sh/sm 等缩放参数，每张图只下载一次原图
+- 有上限的连接池（aiohttp），中断的下载保留 .part 文件，下次用 Range 续传；续传时带 If-Range（.part 开始下载时的
+  ETag 或 Last-Modified），远端文件变化时服务器返回 200，从头重新下载，不会把新内容拼接到旧的部分文件后面
+- 按内容 sha256 去重存储：不同颜色/产品共用的同一张图只占一份空间
+- manifest.json 记录 规范化 URL -> 本地文件，重新运行时跳过已下载的图片
+
+环境变量：
+    IMAGE_INPUT              产品 JSON/JSONL 文件（默认 birkenstock_all_products_details.json）
+    IMAGE_DIR                图片目录（默认 images）
+    IMAGE_CONCURRENCY        最大并发连接数（默认 8）
+    IMAGE_TIMEOUT            单张图片超时秒数（默认 60）
+"""
+import asyncio
+import hashlib
+import json
+import mimetypes
+import os
+import urllib.parse
+
+import aiohttp
+
+import json_stream
+
+# Demandware 动态图片服务（/dw/image/v2/）的缩放、裁剪、格式参数
+CDN_RESIZE_PARAMS = {'sw', 'sh', 'sm', 'sfrm', 'q', 'bgcolor', 'cx', 'cy', 'cw', 'ch', 'strip'}
+MANIFEST_SAVE_EVERY = 100
+
+
+def normalize_image_url(url):
+    """
+    去掉缩放参数并补全协议，例如 //www.birkenstock.com/dw/image/...jpg?sw=1500&sh=1500 -> https://www.birkenstock.com/dw/image/...jpg
+    """
+    if url.startswith('//'):
+        url = 'https:' + url
+    parsed = urllib.parse.urlsplit(url)
+    query = [(k, v) for k, v in urllib.parse.parse_qsl(parsed.query, keep_blank_values=True)
+             if k not in CDN_RESIZE_PARAMS]
+    return urllib.parse.urlunsplit((parsed.scheme, parsed.netloc, parsed.path, urllib.parse.urlencode(query), ''))
+
+
+def iter_image_urls(json_input_file):
+    for product in json_stream.iter_records(json_input_file):
+        for url in product.get('image_urls') or []:
+            if url:
+                yield url
+
+
+class ImageDownloader:
+
+    def __init__(self, image_dir='images', concurrency=8, timeout=60):
+        self.image_dir = image_dir
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.partial_dir = os.path.join(image_dir, '.partial')
+        self.manifest_path = os.path.join(image_dir, 'manifest.json')
+        os.makedirs(self.partial_dir, exist_ok=True)
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                self.manifest = json.load(f)
+        except FileNotFoundError:
+            self.manifest = {}
+        self.bytes_downloaded = 0
+        self._completed_since_save = 0
+
+    def save_manifest(self):
+        tmp_path = self.manifest_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.manifest, f, ensure_ascii=False, indent=4)
+        os.replace(tmp_path, self.manifest_path)
+        self._completed_since_save = 0
+
+    def local_path(self, url):
+        """
+        返回某个图片地址（任意尺寸参数）对应的本地文件，未下载时返回 None。
+        """
+        entry = self.manifest.get(normalize_image_url(url))
+        return os.path.join(self.image_dir, entry['file']) if entry else None
+
+    def _is_done(self, normalized_url):
+        entry = self.manifest.get(normalized_url)
+        return bool(entry) and os.path.exists(os.path.join(self.image_dir, entry['file']))
+
+    @staticmethod
+    def _validator(response):
+        """
+        可用于 If-Range 的校验值：强 ETag 优先（弱 ETag 不能用于 If-Range），其次 Last-Modified。
+        """
+        etag = response.headers.get('ETag')
+        if etag and not etag.startswith('W/'):
+            return etag
+        return response.headers.get('Last-Modified')
+
+    async def _fetch(self, session, normalized_url):
+        """
+        下载到 .part 文件，已有部分内容时用 Range + If-Range 续传。返回 (part_path, content_type)。
+        .part 旁的 .validator 记录开始下载时的 ETag / Last-Modified；没有记录时不续传，从头下载。
+        """
+        part_path = os.path.join(self.partial_dir, hashlib.sha1(normalized_url.encode('utf-8')).hexdigest() + '.part')
+        validator_path = part_path[:-len('.part')] + '.validator'
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        validator = None
+        if offset and os.path.exists(validator_path):
+            with open(validator_path, 'r', encoding='utf-8') as f:
+                validator = f.read().strip() or None
+        headers = {'Range': f'bytes={offset}-', 'If-Range': validator} if validator else {}
+
+        async with session.get(normalized_url, headers=headers) as response:
+            if response.status == 416 and validator:
+                # 校验值一致且 .part 已经是完整文件
+                return part_path, response.headers.get('Content-Type', '')
+            response.raise_for_status()
+            if response.status == 206 and self._validator(response) not in (None, validator):
+                # 服务器忽略了 If-Range（部分服务器只支持日期形式）：校验值已变化，丢弃 .part 从头下载
+                os.remove(part_path)
+                os.remove(validator_path)
+                return await self._fetch(session, normalized_url)
+            if response.status == 206:
+                mode = 'ab'
+            else:
+                # 200：服务器不支持 Range，或远端文件已变化（If-Range 不匹配），从头重新下载
+                mode = 'wb'
+                new_validator = self._validator(response)
+                if new_validator:
+                    with open(validator_path, 'w', encoding='utf-8') as f:
+                        f.write(new_validator)
+                elif os.path.exists(validator_path):
+                    os.remove(validator_path)
+            with open(part_path, mode) as f:
+                async for chunk in response.content.iter_chunked(1 << 16):
+                    f.write(chunk)
+                    self.bytes_downloaded += len(chunk)
+            return part_path, response.headers.get('Content-Type', '')
+
+    def _store_file(self, normalized_url, part_path, content_type):
+        """
+        在线程中执行：计算 sha256 并按内容哈希存放文件，已有相同内容时直接丢弃新下载的副本。
+        返回 manifest 条目。
+        """
+        sha256 = hashlib.sha256()
+        with open(part_path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                sha256.update(block)
+        digest = sha256.hexdigest()
+
+        ext = os.path.splitext(urllib.parse.urlsplit(normalized_url).path)[1].lower()
+        if not ext:
+            ext = mimetypes.guess_extension(content_type.split(';')[0].strip()) or '.bin'
+        relative_path = os.path.join(digest[:2], digest + ext)
+        target_path = os.path.join(self.image_dir, relative_path)
+        if os.path.exists(target_path):
+            os.remove(part_path)
+        else:
+            os.makedirs(os.path.dirname(target_path), exist_ok=True)
+            os.replace(part_path, target_path)
+        validator_path = part_path[:-len('.part')] + '.validator'
+        if os.path.exists(validator_path):
+            os.remove(validator_path)
+        return {'file': relative_path, 'sha256': digest, 'bytes': os.path.getsize(target_path)}
+
+    async def _store(self, normalized_url, part_path, content_type):
+        """
+        哈希和文件移动放到线程中，不阻塞事件循环里的其他下载；manifest 只在事件循环中修改。
+        """
+        entry = await asyncio.to_thread(self._store_file, normalized_url, part_path, content_type)
+        self.manifest[normalized_url] = entry
+        self._completed_since_save += 1
+        if self._completed_since_save >= MANIFEST_SAVE_EVERY:
+            self.save_manifest()
+
+    async def _download_one(self, session, semaphore, normalized_url, failures):
+        try:
+            async with semaphore:
+                part_path, content_type = await self._fetch(session, normalized_url)
+            await self._store(normalized_url, part_path, content_type)
+        except (aiohttp.ClientError, asyncio.TimeoutError, OSError, ValueError) as e:
+            # 单张图片失败（网络、超时、磁盘）只记录下来，不影响其他图片和 manifest 的保存
+            failures.append({'url': normalized_url, 'error': str(e) or type(e).__name__})
+
+    async def download_all(self, urls):
+        references = 0
+        pending = []
+        seen = set()
+        for url in urls:
+            references += 1
+            normalized_url = normalize_image_url(url)
+            if normalized_url in seen:
+                continue
+            seen.add(normalized_url)
+            if not self._is_done(normalized_url):
+                pending.append(normalized_url)
+
+        print(f"共 {references} 个图片引用，规范化后 {len(seen)} 张，需下载 {len(pending)} 张。")
+        failures = []
+        if pending:
+            connector = aiohttp.TCPConnector(limit=self.concurrency)
+            timeout = aiohttp.ClientTimeout(total=self.timeout)
+            semaphore = asyncio.Semaphore(self.concurrency)
+            try:
+                async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+                    await asyncio.gather(*(self._download_one(session, semaphore, url, failures) for url in pending))
+            finally:
+                # 中断（Ctrl+C 等）时也保存已完成的部分
+                self.save_manifest()
+        else:
+            self.save_manifest()
+
+        unique_files = {entry['sha256'] for entry in self.manifest.values()}
+        stored_bytes = sum({entry['sha256']: entry['bytes'] for entry in self.manifest.values()}.values())
+        print(f"下载完成：本次下载 {self.bytes_downloaded / 1024 / 1024:.1f} MB，"
+              f"清单中 {len(self.manifest)} 个地址对应 {len(unique_files)} 个不同文件（共 {stored_bytes / 1024 / 1024:.1f} MB）。")
+        if failures:
+            print(f"警告: {len(failures)} 张图片下载失败，重新运行即可续传。")
+            for failure in failures[:10]:
+                print(f"  - {failure['url']}: {failure['error']}")
+        return failures
+
+
+async def main():
+    json_input_file = os.getenv('IMAGE_INPUT', 'birkenstock_all_products_details.json')
+    if not os.path.exists(json_input_file):
+        print(f"错误: 输入文件 '{json_input_file}' 未找到。")
+        return
+
+    downloader = ImageDownloader(
+        image_dir=os.getenv('IMAGE_DIR', 'images'),
+        concurrency=int(os.getenv('IMAGE_CONCURRENCY', '8')),
+        timeout=int(os.getenv('IMAGE_TIMEOUT', '60')),
+    )
+    await downloader.download_all(iter_image_urls(json_input_file))
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""
+流式读取流水线中的大 JSON 文件，内存占用与文件大小无关。
+
+- .jsonl 文件：逐行解析
+- JSON 数组文件：安装了 ijson 时使用 ijson，否则用标准库 JSONDecoder.raw_decode 分块增量解析
+
+write_json_array 逐条写出 JSON 数组，输出与 json.dump(records, f, ensure_ascii=False, indent=4) 逐字节一致。
+"""
+import json
+import os
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+CHUNK_SIZE = 1 << 16
+_WHITESPACE = ' \t\r\n'
+
+
+def iter_jsonl(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def _iter_array_stdlib(path, chunk_size=CHUNK_SIZE):
+    decoder = json.JSONDecoder()
+    with open(path, 'r', encoding='utf-8') as f:
+        buf = ''
+        eof = False
+
+        def fill():
+            nonlocal buf, eof
+            chunk = f.read(chunk_size)
+            if chunk:
+                buf += chunk
+            else:
+                eof = True
+
+        # 跳过开头的 '['
+        while True:
+            buf = buf.lstrip(_WHITESPACE)
+            if buf or eof:
+                break
+            fill()
+        if not buf.startswith('['):
+            raise ValueError(f"{path} 顶层不是 JSON 数组")
+        buf = buf[1:]
+
+        while True:
+            buf = buf.lstrip(_WHITESPACE + ',')
+            if not buf:
+                if eof:
+                    raise ValueError(f"{path} 在数组结束前意外终止")
+                fill()
+                continue
+            if buf[0] == ']':
+                return
+            try:
+                item, end = decoder.raw_decode(buf)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                # 当前元素还没读完整，继续读下一块
+                fill()
+                continue
+            yield item
+            buf = buf[end:]
+
+
+def iter_json_array(path):
+    if ijson is not None:
+        with open(path, 'rb') as f:
+            # use_float 保证数字与 json.load 的结果一致
+            yield from ijson.items(f, 'item', use_float=True)
+    else:
+        yield from _iter_array_stdlib(path)
+
+
+def iter_records(path):
+    """
+    按文件扩展名选择 JSONL 或 JSON 数组的流式读取。
+    """
+    if path.endswith('.jsonl'):
+        return iter_jsonl(path)
+    return iter_json_array(path)
+
+
+def write_json_array(path, records):
+    """
+    逐条写出 JSON 数组（先写临时文件再替换），返回写出的条数。
+    """
+    count = 0
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write('[')
+        for record in records:
+            f.write(',\n    ' if count else '\n    ')
+            f.write(json.dumps(record, ensure_ascii=False, indent=4).replace('\n', '\n    '))
+            count += 1
+        f.write('\n]' if count else ']')
+    os.replace(tmp_path, path)
+    return count
@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+"""
+各阶段的耗时和吞吐指标：直方图按 Prometheus 文本格式导出，运行结束时另写一份含 p50/p95/p99 的 JSON 汇总。
+
+阶段（stage 标签）：nav（3获取分类.py）、grid（第二步）、colour（variation_matrix.py）、detail（1-1）、export（4ALLjson2csv.py）。
+指标：
+    navigation_seconds   page.goto 到 domcontentloaded
+    wait_seconds         固定等待（wait_for_timeout），例如“加载更多”后的等待、悬停菜单后的等待
+    extraction_seconds   从页面或片段读取字段 / 导出时组装变体并渲染 CSV 行
+    fetch_seconds        页面内批量 fetch 片段（一次 page.evaluate，网络和解析都在页面内完成）；第一步快速路径的导航 HTML 请求
+    write_seconds        写 JSON / CSV / 目录库
+    response_bytes       页面收到的每个响应体的传输大小（request.sizes() 的 responseBodySize，包括分块传输和压缩的响应；
+                         取不到时退回 Content-Length）
+    responses_total      按状态码计数的响应数（包括页面内 fetch 的请求）
+    run_seconds          整个脚本的运行时间
+
+用法：
+    with metrics.timer('grid', 'navigation'): ...     记录一次耗时
+    await metrics.wait(page, 'grid', 2000)            代替 page.wait_for_timeout，同时记入 wait_seconds
+    metrics.attach_page(page, 'grid')                 通过 page.on('response') 记录状态码和字节数
+    metrics.finish('grid')                            写出 metrics/grid.prom 和 metrics/grid.json，并打印各指标汇总
+
+命令行用法：
+    python metrics.py     汇总 metrics/ 下所有阶段的 JSON，按总耗时从大到小列出，看哪一步占用了大部分时间
+
+环境变量：
+    METRICS=0             关闭指标记录
+    METRICS_DIR           输出目录（默认 metrics）
+    METRICS_PORT          设置时在该端口提供 http://127.0.0.1:<端口>/metrics，供 Prometheus 在运行期间抓取
+    METRICS_MAX_SAMPLES   每个指标保留用于计算分位数的样本数上限（默认 20000，超过后蓄水池抽样）
+"""
+import glob
+import json
+import os
+import random
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ENABLED = os.getenv('METRICS', '1') == '1'
+METRICS_DIR = os.getenv('METRICS_DIR', 'metrics')
+PORT = int(os.getenv('METRICS_PORT', '0'))
+MAX_SAMPLES = int(os.getenv('METRICS_MAX_SAMPLES', '20000'))
+
+PREFIX = 'birkenstock'
+SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+BYTES_BUCKETS = (1024, 10240, 102400, 1048576, 10485760)
+
+_started_at = time.time()
+_lock = threading.Lock()
+_series = {}
+_statuses = Counter()
+_server = None
+
+
+class _Series:
+    """
+    一个 (阶段, 指标) 的累计直方图，以及计算分位数用的样本。
+    """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.bucket_counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.samples = []
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, upper in enumerate(self.buckets):
+            if value <= upper:
+                self.bucket_counts[i] += 1
+                break
+        if len(self.samples) < MAX_SAMPLES:
+            self.samples.append(value)
+        else:
+            index = random.randrange(self.count)
+            if index < MAX_SAMPLES:
+                self.samples[index] = value
+
+    def percentile(self, q):
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, max(0, int(round(q * len(ordered))) - 1))]
+
+
+def observe(stage, name, value):
+    if not ENABLED:
+        return
+    with _lock:
+        series = _series.get((stage, name))
+        if series is None:
+            series = _series[(stage, name)] = _Series(BYTES_BUCKETS if name.endswith('_bytes') else SECONDS_BUCKETS)
+        series.observe(value)
+
+
+def record_status(stage, status):
+    if ENABLED:
+        with _lock:
+            _statuses[(stage, str(status))] += 1
+
+
+@contextmanager
+def timer(stage, name):
+    """
+    记录 with 块的耗时到 <name>_seconds（块内抛出异常时同样记录）。
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, f"{name}_seconds", time.perf_counter() - start)
+
+
+async def wait(page, stage, milliseconds):
+    with timer(stage, 'wait'):
+        await page.wait_for_timeout(milliseconds)
+
+
+def attach_page(page, stage):
+    """
+    记录页面收到的每个响应的状态码和大小，并按需启动 /metrics 端点。
+    """
+    if not ENABLED:
+        return
+    serve()
+
+    async def on_response(response):
+        record_status(stage, response.status)
+        size = None
+        try:
+            # 等响应体接收完后才有结果，分块传输和压缩的响应同样可以取到
+            size = (await response.request.sizes()).get('responseBodySize')
+        except Exception:
+            pass
+        if size is None or size < 0:
+            length = response.headers.get('content-length')
+            size = int(length) if length and length.isdigit() else None
+        if size is not None:
+            observe(stage, 'response_bytes', size)
+
+    page.on('response', on_response)
+
+
+# ---- 导出 ----
+
+def _labels(**labels):
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels.items()) + '}'
+
+
+def _format_le(upper):
+    return str(upper)
+
+
+def prometheus_text():
+    """
+    当前所有指标的 Prometheus 文本格式。
+    """
+    with _lock:
+        series_items = sorted(_series.items())
+        statuses = sorted(_statuses.items())
+    lines = []
+    by_name = {}
+    for (stage, name), series in series_items:
+        by_name.setdefault(name, []).append((stage, series))
+    for name, entries in sorted(by_name.items()):
+        metric = f"{PREFIX}_{name}"
+        lines.append(f"# TYPE {metric} histogram")
+        for stage, series in entries:
+            cumulative = 0
+            for upper, count in zip(series.buckets, series.bucket_counts):
+                cumulative += count
+                lines.append(f"{metric}_bucket{_labels(stage=stage, le=_format_le(upper))} {cumulative}")
+            lines.append(f"{metric}_bucket{_labels(stage=stage, le='+Inf')} {series.count}")
+            lines.append(f"{metric}_sum{_labels(stage=stage)} {series.sum:.6f}")
+            lines.append(f"{metric}_count{_labels(stage=stage)} {series.count}")
+    if statuses:
+        lines.append(f"# TYPE {PREFIX}_responses_total counter")
+        for (stage, status), count in statuses:
+            lines.append(f"{PREFIX}_responses_total{_labels(stage=stage, status=status)} {count}")
+    lines.append(f"# TYPE {PREFIX}_run_seconds gauge")
+    lines.append(f"{PREFIX}_run_seconds {time.time() - _started_at:.3f}")
+    return '\n'.join(lines) + '\n'
+
+
+def summary(job):
+    """
+    运行结束时的汇总：每个 (阶段, 指标) 的次数、总和、平均值和 p50/p95/p99，以及状态码计数。
+    """
+    with _lock:
+        series_items = sorted(_series.items())
+        statuses = sorted(_statuses.items())
+    stages = {}
+    for (stage, name), series in series_items:
+        stages.setdefault(stage, {})[name] = {
+            'count': series.count,
+            'sum': round(series.sum, 6),
+            'mean': round(series.sum / series.count, 6) if series.count else None,
+            'p50': series.percentile(0.50),
+            'p95': series.percentile(0.95),
+            'p99': series.percentile(0.99),
+        }
+    for (stage, status), count in statuses:
+        stages.setdefault(stage, {}).setdefault('responses_total', {})[status] = count
+    return {'job': job, 'started_at': _started_at, 'run_seconds': round(time.time() - _started_at, 3), 'stages': stages}
+
+
+def print_summary(report):
+    print(f"[{report['job']}] 运行 {report['run_seconds']:.1f} 秒")
+    for stage, series_by_name in report['stages'].items():
+        for name, values in series_by_name.items():
+            if name == 'responses_total':
+                print(f"    {stage} 响应状态码: " + '，'.join(f"{status}: {count}" for status, count in values.items()))
+            elif name.endswith('_seconds'):
+                print(f"    {stage} {name}: {values['count']} 次，共 {values['sum']:.1f} 秒，"
+                      f"p50 {values['p50']:.3f} / p95 {values['p95']:.3f} / p99 {values['p99']:.3f}")
+            else:
+                print(f"    {stage} {name}: {values['count']} 个，共 {values['sum']:.0f}，p50 {values['p50']:.0f}")
+
+
+def finish(job):
+    """
+    写出 <METRICS_DIR>/<job>.prom 和 <job>.json，打印汇总。各脚本在运行结束时调用一次。
+    """
+    if not ENABLED:
+        return
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    with open(os.path.join(METRICS_DIR, f"{job}.prom"), 'w', encoding='utf-8') as f:
+        f.write(prometheus_text())
+    report = summary(job)
+    with open(os.path.join(METRICS_DIR, f"{job}.json"), 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=4)
+    print_summary(report)
+    print(f"指标已写入 {METRICS_DIR}/{job}.prom 和 {METRICS_DIR}/{job}.json。")
+
+
+# ---- /metrics 端点 ----
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path != '/metrics':
+            self.send_error(404)
+            return
+        body = prometheus_text().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve():
+    """
+    设置了 METRICS_PORT 时在后台线程启动 /metrics 端点（只启动一次）。
+    """
+    global _server
+    if not ENABLED or not PORT or _server is not None:
+        return
+    _server = ThreadingHTTPServer(('127.0.0.1', PORT), _MetricsHandler)
+    threading.Thread(target=_server.serve_forever, daemon=True).start()
+    print(f"指标端点: http://127.0.0.1:{PORT}/metrics")
+
+
+def main():
+    reports = []
+    for path in sorted(glob.glob(os.path.join(METRICS_DIR, '*.json'))):
+        with open(path, 'r', encoding='utf-8') as f:
+            reports.append(json.load(f))
+    if not reports:
+        print(f"{METRICS_DIR} 下没有指标汇总文件。")
+        return
+    total = sum(report['run_seconds'] for report in reports) or 1
+    print("各脚本运行时间（从大到小）：")
+    for report in sorted(reports, key=lambda report: -report['run_seconds']):
+        print(f"    {report['job']}: {report['run_seconds']:.1f} 秒（{report['run_seconds'] / total:.0%}）")
+    rows = []
+    for report in reports:
+        for stage, series_by_name in report['stages'].items():
+            for name, values in series_by_name.items():
+                if name.endswith('_seconds'):
+                    rows.append((values['sum'], stage, name, values))
+    print("各阶段耗时（从大到小）：")
+    for total_seconds, stage, name, values in sorted(rows, key=lambda row: -row[0]):
+        print(f"    {stage} {name}: 共 {total_seconds:.1f} 秒，{values['count']} 次，"
+              f"p50 {values['p50']:.3f} / p95 {values['p95']:.3f} / p99 {values['p99']:.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,392 @@
+# -*- coding: utf-8 -*-
+"""
+导航分类树的版本管理和结构差异。
+
+- 兼容两种树结构：第一步_JS获取导航栏链接.js 输出的 children 和 3获取分类.py 输出的 sub_categories；
+  两者都写 第一步_导航目录.json（第二步读取的文件），版本只从这个文件记录
+- 每次提取到的树按内容哈希保存为一个版本（nav_versions/vNNNN.json，index.json 记录版本列表），内容不变时不新增版本
+- 与第二步上次使用的版本比较（第二步还没有确认过任何版本时与上一版本比较），得到新增、删除、改名、移动
+  （上级分类变化）的分类，写入差异文件；受影响的三级分类（自身或上级有变化）列在 changed_level3_urls 中，
+  供第二步只调度这些分类（NAV_CHANGED_ONLY=1）
+- 第二步保存结果后调用 acknowledge 记录已使用的版本（nav_versions/consumed.json）；第一步在第二步之前运行多次时，
+  差异会一直累积到第二步确认为止，不会被后一次“无变化”的运行覆盖
+- 导航菜单 HTML 的哈希也记录在版本中，3获取分类.py 用它走快速路径：哈希不变时不启动浏览器
+
+命令行用法：
+    python nav_tree.py [导航文件]     把已有的导航文件（默认 第一步_导航目录.json）记录为新版本并输出差异
+
+环境变量：
+    NAV_VERSION_DIR          版本目录（默认 nav_versions）
+    NAV_DIFF_FILE            差异文件（默认 第一步_导航目录_变更.json）
+    NAV_CHANGED_ONLY=1       第二步只采集导航结构有变化或上次没有结果的三级分类，其余沿用上次的记录
+"""
+import hashlib
+import json
+import os
+import sys
+import time
+import urllib.request
+from html.parser import HTMLParser
+
+VERSION_DIR = os.getenv('NAV_VERSION_DIR', 'nav_versions')
+DIFF_FILE = os.getenv('NAV_DIFF_FILE', '第一步_导航目录_变更.json')
+CHANGED_ONLY = os.getenv('NAV_CHANGED_ONLY', '0') == '1'
+
+USER_AGENT = ('Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 '
+              '(KHTML, like Gecko) Chrome/124.0 Safari/537.36')
+
+
+def children(category):
+    """
+    下级分类列表，兼容 children 和 sub_categories 两种写法。
+    """
+    return category.get('children') or category.get('sub_categories') or []
+
+
+def iter_nodes(tree):
+    """
+    把树展开成节点 (level, name, url, parent_url)，顺序与树中一致。
+    """
+    for level1 in tree:
+        yield 1, level1.get('level1_category'), level1.get('level1_url'), None
+        for level2 in children(level1):
+            yield 2, level2.get('level2_category'), level2.get('level2_url'), level1.get('level1_url')
+            for level3 in children(level2):
+                yield 3, level3.get('level3_category'), level3.get('level3_url'), level2.get('level2_url')
+
+
+def _index(tree):
+    """
+    {(level, url): {'name': 首个名称, 'parents': 上级 url 集合}}；同一分类可能挂在多个上级下。
+    """
+    nodes = {}
+    for level, name, url, parent_url in iter_nodes(tree):
+        if not url:
+            continue
+        node = nodes.setdefault((level, url), {'name': (name or '').strip(), 'parents': set()})
+        node['parents'].add(parent_url)
+    return nodes
+
+
+def tree_hash(tree):
+    canonical = [list(node) for node in iter_nodes(tree)]
+    return hashlib.sha1(json.dumps(canonical, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+def diff_trees(old_tree, new_tree):
+    """
+    结构差异：added / removed / renamed / moved，以及受影响的三级分类 changed_level3_urls。
+    """
+    old_nodes = _index(old_tree or [])
+    new_nodes = _index(new_tree)
+    diff = {'added': [], 'removed': [], 'renamed': [], 'moved': []}
+    for (level, url), node in new_nodes.items():
+        old = old_nodes.get((level, url))
+        if old is None:
+            diff['added'].append({'level': level, 'url': url, 'name': node['name']})
+            continue
+        if old['name'] != node['name']:
+            diff['renamed'].append({'level': level, 'url': url, 'old_name': old['name'], 'new_name': node['name']})
+        if old['parents'] != node['parents']:
+            diff['moved'].append({'level': level, 'url': url, 'name': node['name'],
+                                  'old_parents': sorted(p for p in old['parents'] if p),
+                                  'new_parents': sorted(p for p in node['parents'] if p)})
+    for (level, url), node in old_nodes.items():
+        if (level, url) not in new_nodes:
+            diff['removed'].append({'level': level, 'url': url, 'name': node['name']})
+
+    # 自身有变化，或一级/二级上级改名、移动（分类名称会写进产品记录）的三级分类都需要重新调度
+    touched = {(item['level'], item['url']) for key in ('added', 'renamed', 'moved') for item in diff[key]}
+    changed = []
+    for level1 in new_tree:
+        level1_touched = (1, level1.get('level1_url')) in touched
+        for level2 in children(level1):
+            level2_touched = level1_touched or (2, level2.get('level2_url')) in touched
+            for level3 in children(level2):
+                url = level3.get('level3_url')
+                if url and url not in changed and (level2_touched or (3, url) in touched):
+                    changed.append(url)
+    diff['changed_level3_urls'] = changed
+    return diff
+
+
+# ---- 版本 ----
+
+def _index_path():
+    return os.path.join(VERSION_DIR, 'index.json')
+
+
+def load_index():
+    try:
+        with open(_index_path(), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return []
+
+
+def _save_index(index):
+    os.makedirs(VERSION_DIR, exist_ok=True)
+    tmp_path = _index_path() + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(index, f, ensure_ascii=False, indent=4)
+    os.replace(tmp_path, _index_path())
+
+
+def latest_version():
+    index = load_index()
+    return index[-1] if index else None
+
+
+def load_tree(version):
+    with open(os.path.join(VERSION_DIR, version['file']), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_version(tree, html_hash=None, source=None):
+    """
+    记录一次提取结果，返回 (版本信息, 与上一版本的差异)。树内容与上一版本相同时不新增版本，只更新检查时间和 HTML 哈希。
+    """
+    index = load_index()
+    previous = index[-1] if index else None
+    digest = tree_hash(tree)
+    now = time.time()
+    if previous is not None and previous['tree_hash'] == digest:
+        previous['checked_at'] = now
+        if html_hash:
+            previous['html_hash'] = html_hash
+        _save_index(index)
+        return previous, diff_trees(tree, tree)
+
+    version_number = previous['version'] + 1 if previous else 1
+    version = {
+        'version': version_number,
+        'file': f"v{version_number:04d}.json",
+        'tree_hash': digest,
+        'html_hash': html_hash,
+        'source': source,
+        'created_at': now,
+        'checked_at': now,
+    }
+    os.makedirs(VERSION_DIR, exist_ok=True)
+    with open(os.path.join(VERSION_DIR, version['file']), 'w', encoding='utf-8') as f:
+        json.dump(tree, f, ensure_ascii=False, indent=4)
+    index.append(version)
+    _save_index(index)
+    return version, diff_trees(load_tree(previous) if previous else [], tree)
+
+
+def _consumed_path():
+    return os.path.join(VERSION_DIR, 'consumed.json')
+
+
+def _find_version(number):
+    version = next((v for v in load_index() if v['version'] == number), None)
+    if version is None or not os.path.exists(os.path.join(VERSION_DIR, version['file'])):
+        return None
+    return version
+
+
+def consumed_version():
+    """
+    第二步上次确认使用的版本信息；没有记录或该版本文件已不存在时返回 None。
+    """
+    try:
+        with open(_consumed_path(), 'r', encoding='utf-8') as f:
+            number = json.load(f).get('version')
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    return _find_version(number)
+
+
+def diff_version():
+    """
+    差异文件对应的版本号（to_version），没有差异文件时取最新版本。第二步开始时读取，结束时传给 acknowledge。
+    """
+    diff = load_diff()
+    if diff and diff.get('to_version'):
+        return diff['to_version']
+    latest = latest_version()
+    return latest['version'] if latest else None
+
+
+def acknowledge(version_number):
+    """
+    第二步保存结果后调用：记录它使用的版本，之后第一步的差异从这个版本算起。
+    """
+    if version_number is None:
+        return
+    os.makedirs(VERSION_DIR, exist_ok=True)
+    with open(_consumed_path(), 'w', encoding='utf-8') as f:
+        json.dump({'version': version_number, 'acknowledged_at': time.time()}, f, ensure_ascii=False, indent=4)
+
+
+def pending_diff(version):
+    """
+    版本 version 与第二步上次使用的版本之间的差异，返回 (差异, 起始版本号)。
+    第二步还没有确认过版本时，从现有差异文件的起始版本算起（其中的变化同样还没有被使用）；两者都没有时返回 (None, None)。
+    """
+    base = consumed_version()
+    if base is None:
+        base = _find_version((load_diff() or {}).get('from_version'))
+    if base is None:
+        return None, None
+    if base['version'] == version['version']:
+        return diff_trees([], []), base['version']
+    return diff_trees(load_tree(base), load_tree(version)), base['version']
+
+
+def write_diff(diff, version, previous_version=None):
+    record = {'from_version': previous_version, 'to_version': version['version'], 'generated_at': time.time(), **diff}
+    with open(DIFF_FILE, 'w', encoding='utf-8') as f:
+        json.dump(record, f, ensure_ascii=False, indent=4)
+
+
+def print_diff(diff):
+    print(f"导航结构变化：新增 {len(diff['added'])}，删除 {len(diff['removed'])}，改名 {len(diff['renamed'])}，"
+          f"移动 {len(diff['moved'])}；需重新调度的三级分类 {len(diff['changed_level3_urls'])} 个。")
+    for item in diff['renamed'][:10]:
+        print(f"  改名（{item['level']}级）：{item['old_name']} -> {item['new_name']}")
+    for item in diff['added'][:10]:
+        print(f"  新增（{item['level']}级）：{item['name']} {item['url']}")
+    for item in diff['removed'][:10]:
+        print(f"  删除（{item['level']}级）：{item['name']} {item['url']}")
+
+
+def record_tree(tree, html_hash=None, source=None):
+    """
+    保存版本、写差异文件并打印摘要，返回写入差异文件的差异（相对第二步上次使用的版本）。
+    """
+    previous = latest_version()
+    version, diff = save_version(tree, html_hash, source)
+    pending, base_version = pending_diff(version)
+    if pending is None:
+        pending, base_version = diff, (previous['version'] if previous else None)
+    write_diff(pending, version, base_version)
+    if previous is None:
+        print(f"已记录导航树第 {version['version']} 版（首个版本，共 {len(_index(tree))} 个分类）。")
+    elif version['version'] == previous['version']:
+        print(f"导航树与第 {version['version']} 版相同，未新增版本。")
+    else:
+        print(f"已记录导航树第 {version['version']} 版。")
+        print_diff(diff)
+    if base_version is not None and base_version != (previous or {}).get('version'):
+        print(f"相对第二步上次使用的第 {base_version} 版，", end='')
+        print_diff(pending)
+    return pending
+
+
+# ---- 快速路径：导航菜单 HTML 哈希 ----
+
+class _NavLinkParser(HTMLParser):
+    """
+    只收集导航菜单中一/二/三级分类链接（a-level-1/2/3）的地址和文字，忽略页面其他部分的动态内容。
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.links = []
+        self._current = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag != 'a':
+            return
+        attrs = dict(attrs)
+        classes = (attrs.get('class') or '').split()
+        level = next((c for c in classes if c in ('a-level-1', 'a-level-2', 'a-level-3')), None)
+        if level:
+            self._current = [level, attrs.get('href') or '', '']
+            self.links.append(self._current)
+
+    def handle_endtag(self, tag):
+        if tag == 'a':
+            self._current = None
+
+    def handle_data(self, data):
+        if self._current is not None:
+            self._current[2] += data
+
+
+def nav_html_hash(html):
+    """
+    导航菜单链接的哈希；页面中没有导航链接时返回 None。
+    """
+    parser = _NavLinkParser()
+    parser.feed(html)
+    if not parser.links:
+        return None
+    canonical = [[level, href, ' '.join(text.split())] for level, href, text in parser.links]
+    return hashlib.sha1(json.dumps(canonical, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+def check_fast_path(html_hash):
+    """
+    导航 HTML 哈希与最新版本记录的相同时，写出相对第二步上次使用版本的差异（第二步已使用最新版本时为空）并返回该版本；
+    否则返回 None，需要重新提取。
+    """
+    latest = latest_version()
+    if not html_hash or latest is None or latest.get('html_hash') != html_hash:
+        return None
+    pending, base_version = pending_diff(latest)
+    if pending is None:
+        # 没有可比较的版本：保留已有的差异文件，不用空差异覆盖
+        if load_diff() is None:
+            write_diff(diff_trees([], []), latest, latest['version'])
+        return latest
+    write_diff(pending, latest, base_version)
+    return latest
+
+
+def fetch_nav_hash(url, timeout=30):
+    """
+    用普通 HTTP 请求取首页并计算导航哈希（不启动浏览器）；请求失败或被拦截时返回 None，调用方回退到浏览器。
+    """
+    request = urllib.request.Request(url, headers={'User-Agent': USER_AGENT, 'Accept-Language': 'en-US,en;q=0.9'})
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            html = response.read().decode(response.headers.get_content_charset() or 'utf-8', errors='replace')
+    except Exception as e:
+        print(f"获取导航 HTML 失败（{e}），将使用浏览器提取。")
+        return None
+    return nav_html_hash(html)
+
+
+# ---- 第二步调度 ----
+
+def load_diff():
+    try:
+        with open(DIFF_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def split_by_changes(categories, previous_categories):
+    """
+    NAV_CHANGED_ONLY=1 时，把第二步的三级分类分为 (要采集的, 沿用上次记录的)。
+    导航结构有变化、或上次没有结果的分类要采集；没有差异文件或未开启时全部采集。
+    """
+    diff = load_diff() if CHANGED_ONLY else None
+    if diff is None:
+        return categories, []
+    changed = set(diff.get('changed_level3_urls') or [])
+    to_scrape = []
+    kept = []
+    for category in categories:
+        previous = previous_categories.get(category['level3_url'])
+        if category['level3_url'] in changed or not previous or not previous.get('product_urls'):
+            to_scrape.append(category)
+        else:
+            kept.append(previous)
+    return to_scrape, kept
+
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else '第一步_导航目录.json'
+    with open(path, 'r', encoding='utf-8') as f:
+        tree = json.load(f)
+    record_tree(tree, source=path)
+    print(f"差异已写入 {DIFF_FILE}，版本目录: {VERSION_DIR}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,345 @@
+# -*- coding: utf-8 -*-
+"""
+按优先级重新采集：为每个三级分类和每个已采集颜色记录下次到期时间，用最小堆取出到期任务，在请求预算内驱动现有采集流程。
+
+- 分类任务：复用第二步单线程脚本的 scrape_product_urls_from_category（网格指纹未变时只打开首屏），
+  产品链接集合有变化即视为“变化”，结果写回 第二步_产品链接.json，新出现的产品写入目录库 masters 表
+- 颜色任务：复用 stock_watcher.watch_round 读取价格和尺码可售状态，产生变化事件即视为“变化”
+
+间隔按观察到的变化频率调整：本次有变化时间隔减半，没有变化时乘以 SCHED_DECAY（稳定的条目越来越少采集），
+限制在 [SCHED_MIN_INTERVAL, SCHED_MAX_INTERVAL] 之间；名称或 URL 命中 SCHED_BOOST_KEYWORDS 的分类
+（The Latest / New Arrivals / Last Chance / Sale 等）下次到期时间按 间隔 / SCHED_BOOST 计算。
+颜色不按所属分类加速（这些分类覆盖了绝大多数颜色），只由各自的价格/库存变化频率决定。调度状态保存在目录库 crawl_schedule 表中，中断后继续。
+
+请求预算：最近 SCHED_WINDOW 秒内已执行任务（每次执行和失败重试都计入，见目录库 crawl_attempts 表）的请求数（分类按 1 + 产品数 / SCHED_GRID_PAGE_SIZE 估算“加载更多”次数，
+颜色按宽度数）不超过 SCHED_BUDGET；预算用完时剩余的到期任务顺延到下一轮。单个任务的估算超过 SCHED_BUDGET 时按
+SCHED_BUDGET 计；放不进剩余预算的任务顺延，继续取后面更便宜的到期任务，但已逾期超过一个窗口的任务放不进时不再跳过，
+把预算留给它。
+
+环境变量：
+    CATALOG_DB                  目录库文件（默认 catalog.db）
+    SCHED_NAV                   导航目录文件（默认 第一步_导航目录.json）
+    SCHED_LINKS                 第二步输出文件（默认 第二步_产品链接.json）
+    SCHED_DETAILS               目录库为空时导入的详情文件（默认 birkenstock_all_products_details.json）
+    SCHED_BUDGET                每个时间窗口的请求预算（默认 600）
+    SCHED_WINDOW                预算时间窗口秒数（默认 3600）
+    SCHED_INITIAL_INTERVAL      新条目的初始间隔秒数（默认 86400）
+    SCHED_MIN_INTERVAL          最短间隔秒数（默认 3600）
+    SCHED_MAX_INTERVAL          最长间隔秒数（默认 1209600，即 14 天）
+    SCHED_DECAY                 没有变化时间隔的放大倍数（默认 1.5）
+    SCHED_BOOST                 重点分类的加速倍数（默认 4）
+    SCHED_BOOST_KEYWORDS        重点分类关键字，逗号分隔，匹配二级、三级分类名称和三级 URL（不区分大小写）
+    SCHED_GRID_PAGE_SIZE        网格每次“加载更多”的产品数，用于估算分类任务的请求数（默认 24）
+    SCHED_CATEGORY_CONCURRENCY  同时打开的分类页数（默认 3）
+    SCHED_POLL                  两轮之间最长等待秒数（默认 300）
+    SCHED_ONCE=1                只运行一轮（由 cron 等外部调度时使用）
+"""
+import asyncio
+import hashlib
+import heapq
+import importlib
+import json
+import os
+import time
+
+from playwright.async_api import async_playwright
+
+import asset_cache
+import catalog_store
+import category_fingerprint
+import sfcc_url
+import stock_watcher
+import storage_state
+
+step2 = importlib.import_module('第二步_从导航采集所有分类下产品链接_单线程')
+
+NAV_FILE = os.getenv('SCHED_NAV', '第一步_导航目录.json')
+LINKS_FILE = os.getenv('SCHED_LINKS', '第二步_产品链接.json')
+DETAILS_FILE = os.getenv('SCHED_DETAILS', 'birkenstock_all_products_details.json')
+BUDGET = int(os.getenv('SCHED_BUDGET', '600'))
+WINDOW = float(os.getenv('SCHED_WINDOW', '3600'))
+INITIAL_INTERVAL = float(os.getenv('SCHED_INITIAL_INTERVAL', '86400'))
+MIN_INTERVAL = float(os.getenv('SCHED_MIN_INTERVAL', '3600'))
+MAX_INTERVAL = float(os.getenv('SCHED_MAX_INTERVAL', str(14 * 86400)))
+DECAY = float(os.getenv('SCHED_DECAY', '1.5'))
+BOOST = float(os.getenv('SCHED_BOOST', '4'))
+BOOST_KEYWORDS = [keyword.strip().lower() for keyword in os.getenv(
+    'SCHED_BOOST_KEYWORDS', "what's new,the latest,new arrivals,new-arrivals,new for,last chance,last-chance,sale"
+).split(',') if keyword.strip()]
+GRID_PAGE_SIZE = int(os.getenv('SCHED_GRID_PAGE_SIZE', '24'))
+CATEGORY_CONCURRENCY = int(os.getenv('SCHED_CATEGORY_CONCURRENCY', '3'))
+POLL = float(os.getenv('SCHED_POLL', '300'))
+ONCE = os.getenv('SCHED_ONCE', '0') == '1'
+
+CATEGORY = 'category'
+PRODUCT = 'product'
+
+
+# ---- 优先级 ----
+
+def category_boost(category):
+    """
+    二级、三级分类名称或三级 URL 命中重点关键字时返回 SCHED_BOOST，否则为 1。
+    不看一级名称：What's New 一级菜单下挂着按品类/颜色浏览的全量分类，按一级加速会覆盖几乎全部产品。
+    """
+    text = ' '.join(str(category.get(key) or '') for key in
+                    ('level2_category', 'level3_category', 'level3_url')).lower()
+    return BOOST if any(keyword in text for keyword in BOOST_KEYWORDS) else 1.0
+
+
+def estimate_cost(kind, url, previous_categories, store):
+    """
+    任务的请求数估算：分类为首屏 + “加载更多”次数，颜色为宽度数（还没有快照时按 2 计）。
+    """
+    if kind == CATEGORY:
+        product_count = len((previous_categories.get(url) or {}).get('product_urls') or [])
+        return 1 + product_count // GRID_PAGE_SIZE
+    snapshot = store.get_stock(url)
+    return max(1, len((snapshot or {}).get('width_values') or {})) if snapshot else 2
+
+
+def record_result(store, entry, changed, now, cost):
+    """
+    更新调度记录，并把本次执行（包括失败）的请求数记入预算。
+    """
+    store.upsert_schedule(reschedule(entry, changed, now, cost))
+    store.record_attempt(entry['kind'], entry['url'], cost, now)
+
+
+def reschedule(entry, changed, now, cost):
+    """
+    根据本次结果更新调度记录：changed 为 None 表示采集失败，保持间隔并在最短间隔后重试。
+    """
+    entry = dict(entry, last_checked=now, last_cost=cost)
+    if changed is None:
+        entry['next_due'] = now + MIN_INTERVAL
+        return entry
+    entry['checks'] += 1
+    if changed:
+        entry['changes'] += 1
+        entry['last_changed'] = now
+        interval = entry['interval'] / 2
+    else:
+        interval = entry['interval'] * DECAY
+    entry['interval'] = min(MAX_INTERVAL, max(MIN_INTERVAL, interval))
+    entry['next_due'] = now + max(MIN_INTERVAL, entry['interval'] / entry['boost'])
+    return entry
+
+
+# ---- 调度表 ----
+
+def sync_entries(store, seeds, now):
+    """
+    seeds 为 {(kind, url): (名称, 加速倍数)}。新条目立即到期；已有条目只更新名称和加速倍数。
+    返回当前导航和目录库中仍然存在的条目 {(kind, url): 调度记录}。
+    """
+    existing = {(entry['kind'], entry['url']): entry for entry in store.iter_schedule()}
+    entries = {}
+    for (kind, url), (name, boost) in seeds.items():
+        entry = existing.get((kind, url))
+        if entry is None:
+            entry = {'kind': kind, 'url': url, 'name': name, 'boost': boost, 'interval': INITIAL_INTERVAL,
+                     'next_due': now, 'checks': 0, 'changes': 0, 'content_hash': None,
+                     'last_checked': None, 'last_changed': None, 'last_cost': 0}
+            store.upsert_schedule(entry)
+        elif entry['name'] != name or entry['boost'] != boost:
+            entry.update(name=name, boost=boost)
+            store.upsert_schedule(entry)
+        entries[(kind, url)] = entry
+    store.commit()
+    return entries
+
+
+def build_heap(entries):
+    """
+    (下次到期时间, -加速倍数, kind, url) 的最小堆：到期早的先执行，同时到期时重点条目优先。
+    """
+    heap = [(entry['next_due'], -entry['boost'], kind, url) for (kind, url), entry in entries.items()]
+    heapq.heapify(heap)
+    return heap
+
+
+def take_due(heap, now, budget, cost_of, max_cost=None):
+    """
+    按优先级取出已到期的任务，返回 ([(kind, url, 估算请求数)], 剩余预算)。
+    估算请求数不超过 max_cost（默认 SCHED_BUDGET），否则这个任务永远放不进预算。放不进剩余预算的任务顺延到下一轮，
+    继续尝试后面的任务；逾期超过 SCHED_WINDOW 的任务放不进时停止取任务，避免它一直被更便宜的任务挤掉。
+    """
+    max_cost = BUDGET if max_cost is None else max_cost
+    jobs = []
+    deferred = []
+    while heap and heap[0][0] <= now:
+        item = heapq.heappop(heap)
+        due, _, kind, url = item
+        cost = min(cost_of(kind, url), max_cost)
+        if cost > budget:
+            deferred.append(item)
+            if now - due > WINDOW:
+                break
+            continue
+        jobs.append((kind, url, cost))
+        budget -= cost
+    for item in deferred:
+        heapq.heappush(heap, item)
+    return jobs, budget
+
+
+def links_hash(urls):
+    pids = sorted({sfcc_url.pid(url) or url for url in urls})
+    return hashlib.sha1(json.dumps(pids).encode('utf-8')).hexdigest()[:16]
+
+
+# ---- 任务执行 ----
+
+async def run_categories(browser, store, entries, jobs, categories_by_url, previous_categories, now):
+    """
+    并发重新采集到期的分类，更新调度记录，返回 {level3_url: 新的分类记录}（采集失败的不返回）。
+    """
+    semaphore = asyncio.Semaphore(CATEGORY_CONCURRENCY)
+    updated = {}
+
+    async def run(url):
+        async with semaphore:
+            category_data = dict(categories_by_url[url], product_urls=[])
+            previous = previous_categories.get(url)
+            urls, category_data = await step2.scrape_product_urls_from_category(browser, category_data, previous=previous)
+        entry = entries[(CATEGORY, url)]
+        if not urls:
+            record_result(store, entry, None, now, 1)
+            return
+        category_data['product_urls'] = urls
+        updated[url] = category_data
+        digest = links_hash(urls)
+        changed = entry['content_hash'] is not None and entry['content_hash'] != digest
+        new_pids = {sfcc_url.pid(u) for u in urls} - {sfcc_url.pid(u) for u in (previous or {}).get('product_urls') or []}
+        for product_url in urls:
+            store.upsert_master(product_url, url)
+        if changed:
+            print(f"分类 '{category_data['level3_category']}' 的产品有变化（新增 {len(new_pids)} 个）。")
+        # 网格指纹未变时只打开了首屏（traversed_at 沿用上次的时间）
+        skipped = (category_data.get('fingerprint') or {}).get('traversed_at', now) < now
+        cost = 1 if skipped else 1 + len(urls) // GRID_PAGE_SIZE
+        record_result(store, dict(entry, content_hash=digest), changed, now, cost)
+
+    results = await asyncio.gather(*(run(url) for _, url, _ in jobs), return_exceptions=True)
+    for (_, url, _), result in zip(jobs, results):
+        if isinstance(result, Exception):
+            # 单个分类出错不影响其他分类的结果，按采集失败处理
+            print(f"分类 {url} 重新采集时发生错误: {result}")
+            record_result(store, entries[(CATEGORY, url)], None, now, 1)
+    store.commit()
+    return updated
+
+
+async def run_products(page, store, entries, jobs, now):
+    """
+    用库存监控读取到期颜色的价格和尺码，更新调度记录，返回变化的颜色数。
+    """
+    urls = [url for _, url, _ in jobs]
+    events, failed = await stock_watcher.watch_round(page, store, urls)
+    changed_urls = {event['url'] for event in events}
+    for url in urls:
+        snapshot = store.get_stock(url)
+        cost = max(1, len((snapshot or {}).get('width_values') or {}))
+        changed = None if url in failed else url in changed_urls
+        record_result(store, entries[(PRODUCT, url)], changed, now, cost)
+    store.commit()
+    return len(changed_urls)
+
+
+def save_links(categories, previous_categories, updated):
+    """
+    把重新采集的分类写回第二步输出（按导航顺序，没有采集过的分类保持上次的记录）。
+    """
+    records = []
+    for category in categories:
+        record = updated.get(category['level3_url']) or previous_categories.get(category['level3_url'])
+        if record is not None:
+            records.append(record)
+    with open(LINKS_FILE, 'w', encoding='utf-8') as f:
+        json.dump(records, f, ensure_ascii=False, indent=4)
+
+
+def load_categories():
+    try:
+        with open(NAV_FILE, 'r', encoding='utf-8') as f:
+            return step2.third_level_categories(json.load(f))
+    except (FileNotFoundError, json.JSONDecodeError):
+        print(f"错误: 无法读取 {NAV_FILE}，本轮不调度分类。")
+        return []
+
+
+async def schedule_round(browser, store):
+    """
+    执行一轮：同步调度表、取出预算内的到期任务并执行。返回下一个任务的到期时间（没有任务时为 None）。
+    """
+    now = time.time()
+    categories = load_categories()
+    categories_by_url = {category['level3_url']: category for category in categories}
+    previous_categories = category_fingerprint.load_previous(LINKS_FILE)
+
+    seeds = {(CATEGORY, url): (category['level3_category'], category_boost(category))
+             for url, category in categories_by_url.items()}
+    for url in store.detail_color_urls():
+        seeds[(PRODUCT, url)] = (None, 1.0)
+    entries = sync_entries(store, seeds, now)
+
+    heap = build_heap(entries)
+    store.prune_attempts(now - WINDOW)
+    budget = BUDGET - store.schedule_spent(now - WINDOW)
+    jobs, remaining = take_due(heap, now, budget,
+                               lambda kind, url: estimate_cost(kind, url, previous_categories, store))
+    overdue = sum(1 for due, _, _, _ in heap if due <= now)
+    category_jobs = [job for job in jobs if job[0] == CATEGORY]
+    product_jobs = [job for job in jobs if job[0] == PRODUCT]
+    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 调度 {len(entries)} 个条目：本轮 {len(category_jobs)} 个分类、"
+          f"{len(product_jobs)} 个颜色（预算剩余 {max(0, budget)} 个请求），{overdue} 个到期任务顺延。")
+
+    if category_jobs:
+        updated = await run_categories(browser, store, entries, category_jobs, categories_by_url,
+                                       previous_categories, now)
+        if updated:
+            save_links(categories, previous_categories, updated)
+            print(f"已重新采集 {len(updated)} 个分类并写回 {LINKS_FILE}。")
+    if product_jobs:
+        context = await storage_state.new_context(browser)
+        await asset_cache.attach_if_enabled(context)
+        page = await context.new_page()
+        try:
+            await page.goto(storage_state.locale_root(product_jobs[0][1]), timeout=60000)
+            await page.wait_for_load_state('domcontentloaded')
+            changed = await run_products(page, store, entries, product_jobs, now)
+            print(f"{len(product_jobs)} 个颜色中 {changed} 个有价格或库存变化。")
+        except Exception as e:
+            print(f"颜色任务执行时发生错误: {e}")
+        finally:
+            await context.close()
+
+    upcoming = [entry['next_due'] for entry in store.iter_schedule()
+                if (entry['kind'], entry['url']) in entries]
+    return min(upcoming) if upcoming else None
+
+
+async def main():
+    store = catalog_store.CatalogStore()
+    if store.detail_count() == 0 and os.path.exists(DETAILS_FILE):
+        print(f"从 {DETAILS_FILE} 导入 {store.import_details(DETAILS_FILE)} 条已采集数据到 {store.path}。")
+    print(f"请求预算: 每 {WINDOW:.0f} 秒 {BUDGET} 个请求，调度状态保存在 {store.path}。")
+
+    async with async_playwright() as p:
+        browser = await p.chromium.launch(headless=True)
+        try:
+            while True:
+                next_due = await schedule_round(browser, store)
+                if ONCE:
+                    break
+                # 预算用完时到期任务仍在堆顶，按 SCHED_POLL 等待，不空转
+                wait = POLL if next_due is None or next_due <= time.time() else min(POLL, next_due - time.time())
+                await asyncio.sleep(wait)
+        finally:
+            await browser.close()
+            store.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+"""
+Birkenstock（SFCC）产品链接的统一解析与规范化，所有步骤共用。
+
+同一个变体会以多种地址出现：
+    /us/<名称>/<pid>.html?dwvar_<pid>_color=...
+    /on/demandware.store/Sites-US-Site/en_US/Product-Variation?pid=...&dwvar_<pid>_color=...&dwvar_<pid>_width=...
+    /on/demandware.store/Sites-US-Site/en_US/Product-GetSetItem?pid=...
+    以及参数顺序不同、带 size 参数、相对地址等写法。
+parse_product_url 把它们统一解析为 ProductKey(site, locale, pid, color, width)，
+variant_key 给出对应的紧凑字符串键，去重集合、缓存和数据库索引都应使用它而不是原始 URL；
+color_key 是不含宽度的颜色级别键（详情阶段每个颜色只访问一次）；
+每个颜色有自己的 pid（<款式>_<颜色代码>），master_key 去掉颜色后缀，是款式级别的键。
+第二步的 /us/…/<pid>.html 地址不带 dwvar 颜色参数，颜色取自 pid 的颜色后缀，与第三步带参数的地址得到相同的键；
+两者都有但不一致时以参数为准（片段按参数选中颜色），pid 换成 <款式>_<参数中的颜色>。
+解析结果带 LRU 缓存，同一地址重复出现时不再重复解析。
+键的计算规则变化时 KEY_VERSION 加一，目录库据此重新计算已保存的键列。
+
+命令行用法：
+    python sfcc_url.py [文件 ...]     自检两种地址写法的键是否一致；给出 JSON 文件（第二步/第三步/详情）时，
+                                     列出其中同一颜色 pid 对应多个颜色键的情况
+
+环境变量：
+    SFCC_URL_CACHE_SIZE      LRU 缓存条数（默认 65536）
+"""
+import json
+import os
+import re
+import sys
+import urllib.parse
+from collections import defaultdict
+from collections import namedtuple
+from functools import lru_cache
+
+BASE_URL = 'https://www.birkenstock.com'
+CACHE_SIZE = int(os.getenv('SFCC_URL_CACHE_SIZE', '65536'))
+KEY_VERSION = 2
+
+# 店铺路径（/us/...）中没有语言段时使用的默认语言
+SITE_DEFAULT_LOCALES = {'US': 'en_US'}
+
+ProductKey = namedtuple('ProductKey', 'site locale pid color width')
+
+_SITE_RE = re.compile(r'^Sites-(\w+?)-Site$')
+_LOCALE_RE = re.compile(r'^[a-z]{2}_[A-Z]{2}$')
+_DWVAR_RE = re.compile(r'^dwvar_(.+)_(color|width|size)$')
+_HTML_PID_RE = re.compile(r'/([^/]+)\.html$')
+_COLOR_VALUE_RE = re.compile(r'[a-zA-Z0-9]*')
+_RAW_COLOR_RE = re.compile(r'dwvar_.*?_color=([a-zA-Z0-9]+)')
+_COLOR_PID_RE = re.compile(r'^(.+)_(\d+)$')
+
+
+def absolute_url(href, base=BASE_URL):
+    """
+    补全站内相对地址（/us/...、//www...），其他地址原样返回。
+    """
+    if not href:
+        return href
+    if href.startswith('//'):
+        return 'https:' + href
+    if href.startswith('/'):
+        return base + href
+    return href
+
+
+def _site_and_locale(segments):
+    for i, segment in enumerate(segments):
+        match = _SITE_RE.match(segment)
+        if match:
+            site = match.group(1).upper()
+            locale = segments[i + 1] if i + 1 < len(segments) and _LOCALE_RE.match(segments[i + 1]) else ''
+            return site, locale or SITE_DEFAULT_LOCALES.get(site, '')
+    if segments and len(segments[0]) == 2 and segments[0] != 'on':
+        site = segments[0].upper()
+        if len(segments) > 1 and len(segments[1]) == 2 and segments[1].isalpha():
+            return site, f"{segments[1].lower()}_{site}"
+        return site, SITE_DEFAULT_LOCALES.get(site, '')
+    return '', ''
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def parse_product_url(url):
+    """
+    解析产品地址，返回 ProductKey；不是产品地址（取不到 pid）时返回 None。
+    """
+    parsed = urllib.parse.urlsplit(absolute_url(url))
+    segments = [s for s in parsed.path.split('/') if s]
+    site, locale = _site_and_locale(segments)
+
+    pid = None
+    dwvar_pid = None
+    attributes = {'color': None, 'width': None}
+    for name, value in urllib.parse.parse_qsl(parsed.query):
+        if name == 'pid':
+            pid = pid or value
+            continue
+        match = _DWVAR_RE.match(name)
+        if match:
+            # dwvar 参数名中的 pid 把 '_' 转义成了 '__'
+            dwvar_pid = dwvar_pid or match.group(1).replace('__', '_')
+            if match.group(2) in attributes and attributes[match.group(2)] is None:
+                attributes[match.group(2)] = value
+    if not pid:
+        match = _HTML_PID_RE.search(parsed.path)
+        pid = match.group(1) if match else dwvar_pid
+    if not pid:
+        return None
+    color = attributes['color']
+    match = _COLOR_PID_RE.match(pid)
+    if match:
+        # 颜色 pid 的后缀就是颜色代码：没有颜色参数时取后缀，参数与后缀不一致时以参数为准
+        code = _COLOR_VALUE_RE.match(color).group(0) if color else ''
+        if not code:
+            color = match.group(2)
+        elif code != match.group(2):
+            pid = f"{match.group(1)}_{code}"
+    return ProductKey(site, locale, pid, color, attributes['width'])
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def variant_key(url):
+    """
+    变体的紧凑键 "site|locale|pid|color|width"，同一变体的不同地址写法得到相同的键。
+    不是产品地址时退回原始 URL。
+    """
+    key = parse_product_url(url)
+    if key is None:
+        return url
+    return '|'.join(part or '' for part in key)
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def color_key(url):
+    """
+    颜色级别的键 "site|locale|pid|color"，不含宽度。一个颜色的所有宽度在同一个详情页上采集，
+    因此详情阶段的去重和“是否已采集”判断使用这个键。
+    """
+    key = parse_product_url(url)
+    if key is None:
+        return url
+    return '|'.join(part or '' for part in key[:4])
+
+
+def master_pid(pid):
+    """
+    颜色 pid 去掉末尾的 _<颜色代码>，得到款式 pid，例如 boston-...-eva-m_254 -> boston-...-eva-m。
+    """
+    match = _COLOR_PID_RE.match(pid)
+    return match.group(1) if match else pid
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def master_key(url):
+    """
+    款式级别的键 "site|locale|款式 pid"，同一款式所有颜色、宽度得到相同的键。
+    """
+    key = parse_product_url(url)
+    if key is None:
+        return url
+    return '|'.join((key.site or '', key.locale or '', master_pid(key.pid)))
+
+
+def _dwvar_name(pid, attribute):
+    return f"dwvar_{pid.replace('_', '__')}_{attribute}"
+
+
+def variation_url(key, width=None, base=BASE_URL):
+    """
+    由 ProductKey 拼出 Product-Variation 片段地址（format=ajax），width 为宽度代码，None 时沿用 key 中的宽度。
+    """
+    site = key.site or 'US'
+    locale = key.locale or SITE_DEFAULT_LOCALES.get(site, 'default')
+    query = [('pid', key.pid)]
+    if key.color:
+        query.append((_dwvar_name(key.pid, 'color'), key.color))
+    width = width if width is not None else key.width
+    if width:
+        query.append((_dwvar_name(key.pid, 'width'), width))
+    query.append(('format', 'ajax'))
+    return (f"{base}/on/demandware.store/Sites-{site}-Site/{locale}/Product-Variation?"
+            + urllib.parse.urlencode(query))
+
+
+def pid(url):
+    key = parse_product_url(url)
+    return key.pid if key else None
+
+
+def color_code(url):
+    """
+    dwvar 颜色参数的值（只保留字母数字），没有颜色参数时返回 ''。
+    只看地址中的参数，不取 pid 后缀（导出的 handle 和 SKU 由它生成，保持与以前一致）。
+    """
+    # 参数拼接不规范（例如缺少 '?'）的地址同样可以找到
+    match = _RAW_COLOR_RE.search(url)
+    return match.group(1) if match else ''
+
+
+def product_show_url(url):
+    """
+    Product-Variation 片段地址换成完整的 Product-Show 页面地址，其他地址原样返回。
+    """
+    if 'Product-Variation' not in url:
+        return url
+    key = parse_product_url(url)
+    if key is None:
+        return url
+    base = url.split('Product-Variation')[0]
+    return urllib.parse.urljoin(base, f'Product-Show?pid={key.pid}')
+
+
+# ---- 自检 ----
+
+_SELF_CHECK_PAIRS = [
+    ('https://www.birkenstock.com/us/arizona-birko-flor/arizona-birkoflor-0-eva-u_1.html',
+     'https://www.birkenstock.com/on/demandware.store/Sites-US-Site/en_US/Product-Variation'
+     '?pid=arizona-birkoflor-0-eva-u_1&dwvar_arizona-birkoflor-0-eva-u__1_color=1&dwvar_arizona-birkoflor-0-eva-u__1_width=N'),
+    ('/us/boston/boston-suede-0-eva-u_254.html?dwvar_boston-suede-0-eva-u__254_color=254',
+     'https://www.birkenstock.com/us/boston/boston-suede-0-eva-u_254.html'),
+]
+
+
+def self_check():
+    """
+    同一颜色 pid 的 /us/…/<pid>.html 地址与 Product-Variation 地址应得到相同的 color_key，返回不一致的组合。
+    """
+    return [(a, b) for a, b in _SELF_CHECK_PAIRS if color_key(a) != color_key(b)]
+
+
+def _iter_file_urls(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    for item in data if isinstance(data, list) else []:
+        if isinstance(item, dict):
+            yield from item.get('product_urls') or []
+            if item.get('url'):
+                yield item['url']
+
+
+def main():
+    problems = self_check()
+    for a, b in problems:
+        print(f"自检失败：{a} 与 {b} 的颜色键不同（{color_key(a)} / {color_key(b)}）")
+    keys_by_pid = defaultdict(set)
+    for path in sys.argv[1:]:
+        for url in _iter_file_urls(path):
+            key = parse_product_url(url)
+            if key is not None and _COLOR_PID_RE.match(key.pid):
+                keys_by_pid[key.pid].add(color_key(url))
+    split = {pid: keys for pid, keys in keys_by_pid.items() if len(keys) > 1}
+    if sys.argv[1:]:
+        print(f"{len(keys_by_pid)} 个颜色 pid 中 {len(split)} 个对应多个颜色键。")
+        for pid, keys in list(split.items())[:10]:
+            print(f"  {pid}: {sorted(keys)}")
+    sys.exit(1 if problems or split else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,427 @@
+# -*- coding: utf-8 -*-
+"""
+通过 Shopify Admin GraphQL 的批量操作直接发布产品，不再手动上传 CSV。
+
+流程（每个分块一次批量操作）：
+    1. 用 4ALLjson2csv.py 的 plan_product 把产品记录映射为 productSet 的输入，按分块写成 JSONL
+    2. stagedUploadsCreate 申请暂存地址并上传 JSONL
+    3. bulkOperationRunMutation 启动批量 productSet
+    4. 轮询批量操作直到完成，下载结果 JSONL，按行号对账每个产品的 userErrors
+
+状态保存在 <输出目录>/state.json，中断后重新运行会跳过已完成的分块、继续轮询已提交的分块；
+以 FAILED / CANCELED / EXPIRED 结束的分块会清除批量操作和暂存文件，重新运行时重新上传并提交。
+
+库存、重量、运费/税和 SEO 与 CSV 导出使用相同的默认值（库存 100、500 g、需要运输、收税）；
+价格缺失（N/A）或为 0 的产品以草稿（DRAFT）发布，不会以 $0 上架。
+
+每个店铺同时只能运行一个批量 mutation，BULK_CONCURRENCY>1 时各分块的生成、上传和结果对账并行进行，
+bulkOperationRunMutation 的提交串行进行，另一个批量操作仍在运行时等待 BULK_POLL_SECONDS 后重试。
+
+环境变量：
+    SHOPIFY_SHOP             店铺域名（xxx.myshopify.com），也可以是完整地址（例如本地假服务器 http://127.0.0.1:8000）
+    SHOPIFY_ACCESS_TOKEN     Admin API 访问令牌
+    SHOPIFY_API_VERSION      API 版本（默认 2025-01）
+    SHOPIFY_LOCATION_ID      设置库存的地点 id（gid://shopify/Location/... 或数字；默认店铺的第一个地点）
+    BULK_INVENTORY_QTY       每个变体的库存数量（默认与 CSV 的 Variant Inventory Qty 相同，100）
+    BULK_INPUT               产品 JSON/JSONL 文件（默认 all_scraped_products.json）
+    BULK_OUTPUT_DIR          分块、状态与错误输出目录（默认 shopify_bulk）
+    BULK_CHUNK_SIZE          每个批量操作包含的产品数（默认 5000）
+    BULK_CONCURRENCY         同时处理的分块数（默认 1；批量操作本身仍逐个运行）
+    BULK_POLL_SECONDS        轮询间隔秒数（默认 5）
+"""
+import hashlib
+import html
+import importlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+import json_stream
+
+exporter = importlib.import_module('4ALLjson2csv')
+
+PRODUCT_SET_MUTATION = """
+mutation call($identifier: ProductSetIdentifiers, $input: ProductSetInput!) {
+  productSet(identifier: $identifier, input: $input) {
+    product { id handle }
+    userErrors { field message code }
+  }
+}
+"""
+
+STAGED_UPLOADS_CREATE = """
+mutation stagedUploadsCreate($input: [StagedUploadInput!]!) {
+  stagedUploadsCreate(input: $input) {
+    stagedTargets { url resourceUrl parameters { name value } }
+    userErrors { field message }
+  }
+}
+"""
+
+BULK_OPERATION_RUN_MUTATION = """
+mutation bulkOperationRunMutation($mutation: String!, $stagedUploadPath: String!) {
+  bulkOperationRunMutation(mutation: $mutation, stagedUploadPath: $stagedUploadPath) {
+    bulkOperation { id status }
+    userErrors { field message }
+  }
+}
+"""
+
+LOCATIONS_QUERY = """
+query locations {
+  locations(first: 1) { nodes { id } }
+}
+"""
+
+BULK_OPERATION_STATUS = """
+query bulkOperation($id: ID!) {
+  node(id: $id) {
+    ... on BulkOperation { id status errorCode objectCount url partialDataUrl }
+  }
+}
+"""
+
+FINISHED_STATUSES = {'COMPLETED', 'FAILED', 'CANCELED', 'EXPIRED'}
+# 另一个批量 mutation 仍在运行时 bulkOperationRunMutation 返回的 userErrors 信息
+IN_PROGRESS_MESSAGE = 'already in progress'
+DEFAULT_INVENTORY_QTY = int(exporter._VARIANT_CONSTANTS['Variant Inventory Qty'])
+VARIANT_GRAMS = float(exporter._VARIANT_CONSTANTS['Variant Grams'])
+
+
+class ShopifyError(Exception):
+    pass
+
+
+def location_gid(location_id):
+    return location_id if location_id.startswith('gid://') else f'gid://shopify/Location/{location_id}'
+
+
+def product_set_line(plan, location_id, inventory_qty=DEFAULT_INVENTORY_QTY):
+    """
+    把导出计划转换为一行 productSet 的变量（与 CSV 使用同一套选项、SKU、价格、库存、重量和 SEO）。
+    价格不大于 0（缺失价格时 plan_product 给出 0.00）的产品设为 DRAFT。
+    """
+    option_names = [name for name in plan['option_names'] if name]
+    option_values = {name: [] for name in option_names}
+    variants = []
+    for variant in plan['variants']:
+        values = variant[:len(option_names)]
+        for name, value in zip(option_names, values):
+            if value not in option_values[name]:
+                option_values[name].append(value)
+        variants.append({
+            'optionValues': [{'optionName': name, 'name': value} for name, value in zip(option_names, values)],
+            'price': plan['price'],
+            'compareAtPrice': plan['compare_at_price'],
+            'inventoryPolicy': 'DENY',
+            'taxable': True,
+            'inventoryItem': {
+                'sku': variant[-1],
+                'tracked': True,
+                'requiresShipping': True,
+                'measurement': {'weight': {'value': VARIANT_GRAMS, 'unit': 'GRAMS'}},
+            },
+            'inventoryQuantities': [{'locationId': location_id, 'name': 'available', 'quantity': inventory_qty}],
+        })
+
+    return {
+        'identifier': {'handle': plan['handle']},
+        'input': {
+            'handle': plan['handle'],
+            'title': plan['title'],
+            'descriptionHtml': f"<p>{html.escape(plan['description'])}</p>",
+            'vendor': exporter.Vendor,
+            'productType': exporter.Type,
+            'tags': [tag for tag in plan['tags'].split(',') if tag],
+            'status': 'ACTIVE' if float(plan['price']) > 0 else 'DRAFT',
+            'seo': {'title': plan['title'], 'description': (plan['description'] or '')[:255]},
+            'productOptions': [
+                {'name': name, 'position': i, 'values': [{'name': value} for value in option_values[name]]}
+                for i, name in enumerate(option_names, start=1)
+            ],
+            'variants': variants,
+            'files': [
+                {'originalSource': url, 'contentType': 'IMAGE', 'alt': plan['title']}
+                for url in plan['image_urls']
+            ],
+        },
+    }
+
+
+class ShopifyBulkUploader:
+
+    def __init__(self, shop, access_token, api_version='2025-01', output_dir='shopify_bulk',
+                 poll_seconds=5, concurrency=1, location_id=None, inventory_qty=DEFAULT_INVENTORY_QTY):
+        base_url = shop if shop.startswith('http') else f'https://{shop}'
+        self.endpoint = f"{base_url.rstrip('/')}/admin/api/{api_version}/graphql.json"
+        self.output_dir = output_dir
+        self.poll_seconds = poll_seconds
+        self.concurrency = concurrency
+        self.location_id = location_gid(location_id) if location_id else None
+        self.inventory_qty = inventory_qty
+        self.session = requests.Session()
+        self.session.headers.update({
+            'X-Shopify-Access-Token': access_token,
+            'Content-Type': 'application/json',
+        })
+        self.state_file = os.path.join(output_dir, 'state.json')
+        self.errors_file = os.path.join(output_dir, 'errors.jsonl')
+        self._lock = threading.Lock()
+        self._submit_lock = threading.Lock()
+        os.makedirs(output_dir, exist_ok=True)
+        try:
+            with open(self.state_file, 'r', encoding='utf-8') as f:
+                self.state = json.load(f)
+        except FileNotFoundError:
+            self.state = {}
+
+    def _save_state(self, chunk_name, **fields):
+        with self._lock:
+            self.state.setdefault(chunk_name, {}).update(fields)
+            tmp_path = self.state_file + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.state, f, ensure_ascii=False, indent=4)
+            os.replace(tmp_path, self.state_file)
+
+    def graphql(self, query, variables=None, retries=5):
+        """
+        执行一次 GraphQL 请求，被限流（THROTTLED）或网络错误时按指数退避重试。
+        """
+        for attempt in range(retries):
+            try:
+                response = self.session.post(self.endpoint, json={'query': query, 'variables': variables or {}}, timeout=60)
+            except requests.exceptions.RequestException as e:
+                if attempt == retries - 1:
+                    raise ShopifyError(f"请求 Shopify 失败: {e}")
+                time.sleep(2 ** attempt)
+                continue
+            if response.status_code == 429 or response.status_code >= 500:
+                time.sleep(2 ** attempt)
+                continue
+            response.raise_for_status()
+            payload = response.json()
+            errors = payload.get('errors')
+            if errors:
+                if any(e.get('extensions', {}).get('code') == 'THROTTLED' for e in errors):
+                    time.sleep(2 ** attempt)
+                    continue
+                raise ShopifyError(f"GraphQL 错误: {errors}")
+            return payload['data']
+        raise ShopifyError("多次重试后 Shopify 仍然限流或不可用")
+
+    def _location(self):
+        """
+        未配置 SHOPIFY_LOCATION_ID 时使用店铺的第一个地点。
+        """
+        if not self.location_id:
+            nodes = self.graphql(LOCATIONS_QUERY)['locations']['nodes']
+            if not nodes:
+                raise ShopifyError("店铺中没有可用的地点，无法设置库存，请设置 SHOPIFY_LOCATION_ID")
+            self.location_id = nodes[0]['id']
+        return self.location_id
+
+    def write_chunks(self, json_input_file, chunk_size):
+        """
+        流式读取产品，按分块写出 productSet 变量 JSONL，返回 [(分块文件名, handle 列表)]。
+        """
+        chunks = []
+        current_file = None
+        current_handles = []
+        location_id = self._location()
+        drafts = 0
+
+        def close_current():
+            if current_file:
+                current_file.close()
+                chunks.append((os.path.basename(current_file.name), current_handles))
+
+        for product in json_stream.iter_records(json_input_file):
+            if current_file is None or len(current_handles) >= chunk_size:
+                close_current()
+                path = os.path.join(self.output_dir, f'chunk_{len(chunks) + 1:04d}.jsonl')
+                current_file = open(path, 'w', encoding='utf-8')
+                current_handles = []
+            plan = exporter.plan_product(product)
+            line = product_set_line(plan, location_id, self.inventory_qty)
+            drafts += line['input']['status'] == 'DRAFT'
+            current_file.write(json.dumps(line, ensure_ascii=False) + '\n')
+            current_handles.append(plan['handle'])
+        close_current()
+        if drafts:
+            print(f"{drafts} 个产品没有有效价格，以草稿（DRAFT）发布。")
+        return chunks
+
+    def _stage_upload(self, chunk_path):
+        filename = os.path.basename(chunk_path)
+        data = self.graphql(STAGED_UPLOADS_CREATE, {'input': [{
+            'resource': 'BULK_MUTATION_VARIABLES',
+            'filename': filename,
+            'mimeType': 'text/jsonl',
+            'httpMethod': 'POST',
+        }]})['stagedUploadsCreate']
+        if data['userErrors']:
+            raise ShopifyError(f"申请暂存上传地址失败: {data['userErrors']}")
+        target = data['stagedTargets'][0]
+        parameters = {p['name']: p['value'] for p in target['parameters']}
+        with open(chunk_path, 'rb') as f:
+            response = requests.post(target['url'], data=parameters, files={'file': (filename, f, 'text/jsonl')}, timeout=300)
+        if response.status_code >= 300:
+            raise ShopifyError(f"上传 {filename} 失败: HTTP {response.status_code}")
+        return parameters['key']
+
+    def _start_operation(self, chunk_name, staged_path):
+        """
+        启动批量 productSet，返回批量操作 id。提交串行进行；店铺中已有批量 mutation 在运行时等待后重试。
+        """
+        waiting = False
+        while True:
+            with self._submit_lock:
+                data = self.graphql(BULK_OPERATION_RUN_MUTATION, {
+                    'mutation': PRODUCT_SET_MUTATION,
+                    'stagedUploadPath': staged_path,
+                })['bulkOperationRunMutation']
+            user_errors = data['userErrors']
+            if not user_errors:
+                return data['bulkOperation']['id']
+            if not any(IN_PROGRESS_MESSAGE in (e.get('message') or '').lower() for e in user_errors):
+                raise ShopifyError(f"[{chunk_name}] 启动批量操作失败: {user_errors}")
+            if not waiting:
+                print(f"[{chunk_name}] 店铺中已有批量操作在运行，等待其结束后提交。")
+                waiting = True
+            time.sleep(self.poll_seconds)
+
+    def _wait_for_operation(self, operation_id):
+        while True:
+            operation = self.graphql(BULK_OPERATION_STATUS, {'id': operation_id})['node']
+            if operation['status'] in FINISHED_STATUSES:
+                return operation
+            time.sleep(self.poll_seconds)
+
+    def _reconcile(self, chunk_name, handles, result_url):
+        """
+        下载结果 JSONL，按 __lineNumber 对应回 handle，记录每个产品的 userErrors。
+        下载和解析不持有锁，只有追加错误文件时才加锁。
+        """
+        succeeded = 0
+        error_lines = []
+        response = requests.get(result_url, timeout=300, stream=True)
+        response.raise_for_status()
+        for line in response.iter_lines(decode_unicode=True):
+            if not line:
+                continue
+            result = json.loads(line)
+            line_number = result.get('__lineNumber', 0)
+            handle = handles[line_number] if line_number < len(handles) else None
+            payload = (result.get('data') or {}).get('productSet') or {}
+            user_errors = payload.get('userErrors') or result.get('errors') or []
+            if user_errors:
+                error_lines.append(json.dumps({'chunk': chunk_name, 'handle': handle, 'errors': user_errors},
+                                              ensure_ascii=False) + '\n')
+            else:
+                succeeded += 1
+        if error_lines:
+            with self._lock, open(self.errors_file, 'a', encoding='utf-8') as errors_out:
+                errors_out.writelines(error_lines)
+        return succeeded, len(error_lines)
+
+    def run_chunk(self, chunk_name, handles):
+        chunk_path = os.path.join(self.output_dir, chunk_name)
+        with open(chunk_path, 'rb') as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+        chunk_state = self.state.get(chunk_name, {})
+        if chunk_state.get('sha256') != digest:
+            # 分块内容变了（输入更新），之前的进度作废
+            with self._lock:
+                self.state.pop(chunk_name, None)
+            chunk_state = {}
+
+        if chunk_state.get('status') == 'completed':
+            print(f"[{chunk_name}] 已完成，跳过。")
+            return chunk_state
+
+        # 旧状态文件中以失败结束的分块可能仍带着操作 id，不再轮询
+        failed_before = chunk_state.get('status') in ('failed', 'canceled', 'expired')
+        operation_id = None if failed_before else chunk_state.get('operation_id')
+        if not operation_id:
+            staged_path = None if failed_before else chunk_state.get('staged_path')
+            if not staged_path:
+                staged_path = self._stage_upload(chunk_path)
+                self._save_state(chunk_name, sha256=digest, status='staged', staged_path=staged_path)
+            try:
+                operation_id = self._start_operation(chunk_name, staged_path)
+            except ShopifyError:
+                # 暂存文件可能已失效，下次重新上传
+                self._save_state(chunk_name, staged_path=None)
+                raise
+            self._save_state(chunk_name, sha256=digest, status='submitted', operation_id=operation_id)
+            print(f"[{chunk_name}] 已提交批量操作 {operation_id}（{len(handles)} 个产品）")
+        else:
+            print(f"[{chunk_name}] 继续等待批量操作 {operation_id}")
+
+        operation = self._wait_for_operation(operation_id)
+        succeeded, failed = 0, 0
+        result_url = operation.get('url') or operation.get('partialDataUrl')
+        if result_url:
+            succeeded, failed = self._reconcile(chunk_name, handles, result_url)
+
+        if operation['status'] == 'COMPLETED':
+            self._save_state(chunk_name, sha256=digest, status='completed', operation_id=operation_id,
+                             succeeded=succeeded, failed=failed, error_code=None)
+        else:
+            # 以失败、取消或过期结束的操作不会再变化：清除操作和暂存文件，重新运行时重新提交此分块
+            self._save_state(chunk_name, sha256=digest, status=operation['status'].lower(), operation_id=None,
+                             staged_path=None, last_operation_id=operation_id,
+                             succeeded=succeeded, failed=failed, error_code=operation.get('errorCode'))
+        print(f"[{chunk_name}] 批量操作 {operation['status']}：成功 {succeeded}，失败 {failed}")
+        return self.state[chunk_name]
+
+    def upload(self, json_input_file, chunk_size=5000):
+        chunks = self.write_chunks(json_input_file, chunk_size)
+        print(f"共 {sum(len(h) for _, h in chunks)} 个产品，分为 {len(chunks)} 个批量操作，并发 {self.concurrency}。")
+        results = {}
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            futures = {executor.submit(self.run_chunk, name, handles): name for name, handles in chunks}
+            for future, name in futures.items():
+                try:
+                    results[name] = future.result()
+                except Exception as e:
+                    print(f"[{name}] 发生错误: {e}（重新运行即可从此分块继续）")
+                    results[name] = {'status': 'error', 'error': str(e)}
+
+        succeeded = sum(r.get('succeeded', 0) for r in results.values())
+        failed = sum(r.get('failed', 0) for r in results.values())
+        print(f"发布完成：成功 {succeeded} 个产品，失败 {failed} 个，错误详情见 '{self.errors_file}'。")
+        return results
+
+
+def main():
+    shop = os.getenv('SHOPIFY_SHOP')
+    access_token = os.getenv('SHOPIFY_ACCESS_TOKEN')
+    if not shop or not access_token:
+        print("错误: 请先设置环境变量 SHOPIFY_SHOP 和 SHOPIFY_ACCESS_TOKEN。")
+        return
+
+    json_input_file = os.getenv('BULK_INPUT', 'all_scraped_products.json')
+    if not os.path.exists(json_input_file):
+        print(f"错误: 输入文件 '{json_input_file}' 未找到。")
+        return
+
+    uploader = ShopifyBulkUploader(
+        shop,
+        access_token,
+        api_version=os.getenv('SHOPIFY_API_VERSION', '2025-01'),
+        output_dir=os.getenv('BULK_OUTPUT_DIR', 'shopify_bulk'),
+        poll_seconds=float(os.getenv('BULK_POLL_SECONDS', '5')),
+        concurrency=int(os.getenv('BULK_CONCURRENCY', '1')),
+        location_id=os.getenv('SHOPIFY_LOCATION_ID'),
+        inventory_qty=int(os.getenv('BULK_INVENTORY_QTY', str(DEFAULT_INVENTORY_QTY))),
+    )
+    uploader.upload(json_input_file, int(os.getenv('BULK_CHUNK_SIZE', '5000')))
+
+
+if __name__ == '__main__':
+    main()
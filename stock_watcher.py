@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+"""
+轻量库存/价格监控：定时轮询已采集 SKU 的 Product-Variation 片段，只读取价格和各宽度的尺码可售状态。
+
+不打开详情页、不读取描述和图片。只打开一个店铺页面，在页面内并发 fetch 片段（解析规则与 variation_matrix.py 相同），
+与目录库中的上次快照（stock 表）比较，只输出发生变化的事件：
+    price          价格变化
+    availability   某个宽度/尺码组/尺码的可售状态变化
+    size_added     新出现的宽度/尺码
+    size_removed   消失的宽度/尺码
+事件追加到 JSONL 文件并写入目录库 stock_events 表（CatalogStore.iter_stock_events 可增量读取），
+首次监控某个颜色时只记录快照，不产生事件。
+
+每个颜色每轮的请求数等于宽度数：首次监控时先请求默认片段读取宽度色块，之后按快照中的宽度代码直接请求。
+SKU 列表为目录库中已采集的颜色（details 表），数据库为空时先导入详情 JSON。
+
+环境变量：
+    CATALOG_DB               目录库文件（默认 catalog.db）
+    WATCH_DETAILS            目录库为空时导入的详情文件（默认 birkenstock_all_products_details.json）
+    WATCH_EVENTS             事件输出文件（默认 stock_events.jsonl）
+    WATCH_INTERVAL           两轮之间的间隔秒数（默认 900）
+    WATCH_ONCE=1             只运行一轮（由 cron 等外部调度时使用）
+    WATCH_CONCURRENCY        页面内并发 fetch 数（默认 6）
+    WATCH_BATCH_SIZE         每次 page.evaluate 处理的请求数（默认 50）
+"""
+import asyncio
+import json
+import os
+import time
+
+from playwright.async_api import async_playwright
+
+import asset_cache
+import catalog_store
+import sfcc_url
+import storage_state
+import variation_fetch
+import variation_matrix
+
+DETAILS_FILE = os.getenv('WATCH_DETAILS', 'birkenstock_all_products_details.json')
+EVENTS_FILE = os.getenv('WATCH_EVENTS', 'stock_events.jsonl')
+INTERVAL = int(os.getenv('WATCH_INTERVAL', '900'))
+ONCE = os.getenv('WATCH_ONCE', '0') == '1'
+CONCURRENCY = int(os.getenv('WATCH_CONCURRENCY', '6'))
+BATCH_SIZE = int(os.getenv('WATCH_BATCH_SIZE', '50'))
+
+# 没有宽度色块的产品，尺码矩阵使用这个宽度名称（与详情记录中 width 缺失时的写法一致）
+NO_WIDTH = 'N/A'
+
+
+async def fetch_fragments(page, items):
+    results = []
+    for start in range(0, len(items), BATCH_SIZE):
+        batch = items[start:start + BATCH_SIZE]
+        results.extend(await page.evaluate(variation_matrix.MATRIX_JS, {'items': batch, 'concurrency': CONCURRENCY}))
+    return results
+
+
+def plan_requests(store, urls):
+    """
+    快照中有宽度代码的颜色直接按宽度请求；其余颜色先请求默认片段（width 为 None），第二阶段再补其他宽度。
+    """
+    items = []
+    for url in urls:
+        key = sfcc_url.parse_product_url(url)
+        snapshot = store.get_stock(url)
+        width_values = (snapshot or {}).get('width_values') or {}
+        if width_values:
+            for label, value in width_values.items():
+                items.append({'url': url, 'width': label, 'fetch_url': sfcc_url.variation_url(key, value)})
+        else:
+            items.append({'url': url, 'width': None, 'fetch_url': sfcc_url.variation_url(key._replace(width=None))})
+    return items
+
+
+def _discovered_widths(results):
+    """
+    默认片段 -> 补全 width（当前选中的宽度名称）后的结果，以及其他宽度的片段请求。
+    """
+    resolved = []
+    extra_items = []
+    for result in results:
+        if result['width'] is not None or result.get('error'):
+            resolved.append(result)
+            continue
+        swatches = result.get('width_swatches') or []
+        selected = [swatch['label'] for swatch in swatches if swatch.get('selected')] or [NO_WIDTH]
+        resolved.append({**result, 'width': selected[0]})
+        key = sfcc_url.parse_product_url(result['url'])
+        for swatch in swatches:
+            if swatch['label'] != selected[0] and swatch.get('value'):
+                extra_items.append({'url': result['url'], 'width': swatch['label'],
+                                    'fetch_url': sfcc_url.variation_url(key, swatch['value'])})
+    return resolved, extra_items
+
+
+def build_snapshots(results):
+    """
+    片段结果 -> {url: {'price', 'size_matrix', 'width_values'}}。有宽度请求失败的颜色不生成快照，避免误报尺码消失。
+    """
+    failed = {result['url']: result['error'] for result in results if result.get('error')}
+    ok_results = [result for result in results if result['url'] not in failed]
+    matrices = variation_fetch.build_size_matrices(ok_results)
+    snapshots = {}
+    for result in ok_results:
+        snapshot = snapshots.setdefault(result['url'], {'price': None, 'size_matrix': {}, 'width_values': {}})
+        if result.get('price') and not snapshot['price']:
+            snapshot['price'] = result['price']
+        for swatch in result.get('width_swatches') or []:
+            if swatch.get('value'):
+                snapshot['width_values'][swatch['label']] = swatch['value']
+    for url, snapshot in snapshots.items():
+        snapshot['size_matrix'] = matrices.get(url, {})
+    return snapshots, failed
+
+
+def diff_snapshots(url, old, new, observed_at):
+    """
+    比较两次快照，返回变化事件列表。
+    """
+    events = []
+
+    def event(event_type, old_value, new_value, width=None, group=None, size=None):
+        events.append({'url': url, 'type': event_type, 'width': width, 'group': group, 'size': size,
+                       'old': old_value, 'new': new_value, 'observed_at': observed_at})
+
+    if new['price'] != old['price'] and new['price']:
+        event('price', old['price'], new['price'])
+    old_matrix = old.get('size_matrix') or {}
+    new_matrix = new.get('size_matrix') or {}
+    for width in list(old_matrix) + [w for w in new_matrix if w not in old_matrix]:
+        old_groups = old_matrix.get(width) or {}
+        new_groups = new_matrix.get(width) or {}
+        for group in list(old_groups) + [g for g in new_groups if g not in old_groups]:
+            old_sizes = old_groups.get(group) or {}
+            new_sizes = new_groups.get(group) or {}
+            for size in list(old_sizes) + [s for s in new_sizes if s not in old_sizes]:
+                if size not in new_sizes:
+                    event('size_removed', old_sizes[size], None, width, group, size)
+                elif size not in old_sizes:
+                    event('size_added', None, new_sizes[size], width, group, size)
+                elif old_sizes[size] != new_sizes[size]:
+                    event('availability', old_sizes[size], new_sizes[size], width, group, size)
+    return events
+
+
+async def watch_round(page, store, urls):
+    """
+    轮询一轮，返回 (变化事件列表, {url: 失败原因})。
+    """
+    results = await fetch_fragments(page, plan_requests(store, urls))
+    results, extra_items = _discovered_widths(results)
+    if extra_items:
+        results.extend(await fetch_fragments(page, extra_items))
+    snapshots, failed = build_snapshots(results)
+
+    observed_at = time.time()
+    events = []
+    with open(EVENTS_FILE, 'a', encoding='utf-8') as f:
+        for url, snapshot in snapshots.items():
+            old = store.get_stock(url)
+            if old is not None:
+                for event in diff_snapshots(url, old, snapshot, observed_at):
+                    f.write(json.dumps(event, ensure_ascii=False) + '\n')
+                    store.record_stock_event(event)
+                    events.append(event)
+            store.upsert_stock(url, snapshot['price'], snapshot['size_matrix'], snapshot['width_values'])
+    for url, error in failed.items():
+        store.record_failure(url, 'watch', error)
+    store.commit()
+    return events, failed
+
+
+async def main():
+    store = catalog_store.CatalogStore()
+    if store.detail_count() == 0 and os.path.exists(DETAILS_FILE):
+        print(f"从 {DETAILS_FILE} 导入 {store.import_details(DETAILS_FILE)} 条已采集数据到 {store.path}。")
+    urls = store.detail_color_urls()
+    if not urls:
+        print(f"错误：目录库 {store.path} 中没有已采集的产品。")
+        store.close()
+        return
+    print(f"监控 {len(urls)} 个颜色，事件写入 {EVENTS_FILE} 和 {store.path}。")
+
+    async with async_playwright() as p:
+        browser = await p.chromium.launch(headless=True)
+        context = await storage_state.new_context(browser)
+        await asset_cache.attach_if_enabled(context)
+        page = await context.new_page()
+        storefront_url = storage_state.locale_root(urls[0])
+        try:
+            while True:
+                start = time.time()
+                # 每轮重新打开店铺页面，刷新会话 Cookie
+                await page.goto(storefront_url, timeout=60000)
+                await page.wait_for_load_state('domcontentloaded')
+                try:
+                    events, failed = await watch_round(page, store, urls)
+                    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 本轮 {len(urls)} 个颜色，"
+                          f"{len(events)} 个变化事件，{len(failed)} 个读取失败（耗时 {time.time() - start:.1f} 秒）。")
+                except Exception as e:
+                    print(f"本轮监控时发生错误: {e}")
+                if ONCE:
+                    break
+                await asyncio.sleep(max(0, INTERVAL - (time.time() - start)))
+        finally:
+            await browser.close()
+            store.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
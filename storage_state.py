@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""
+预热浏览器上下文的 storage_state。
+
+每个新的 context 都要重新经历一次首访流程（Cookie/同意弹窗、地区/语言跳转、会话 Cookie 下发）。
+这里按 (站点语言入口, 代理) 只做一次预热，把 Playwright 的 storage_state 保存到磁盘，
+之后所有采集脚本创建的新 context 都从保存的状态启动；状态过期后自动重新预热。
+有效期取 TTL 与会话/同意 Cookie 中最早过期的一个两者中较早的时间；统计、广告等短期 Cookie 不参与计算，
+否则它们会让几乎每次运行都重新预热。
+
+环境变量：
+    STORAGE_STATE=0                  关闭预热，直接使用空白 context
+    STORAGE_STATE_DIR                状态文件目录（默认 storage_state）
+    STORAGE_STATE_TTL                状态有效期，单位秒（默认 21600，即 6 小时）
+    STORAGE_STATE_COOKIES            决定有效期的 Cookie 名称前缀，逗号分隔（默认为 SFCC 会话和 OneTrust/TrustArc 同意 Cookie）
+    STORAGE_STATE_MIN_COOKIE_TTL     预热时剩余有效期短于此秒数的 Cookie 不参与计算（默认 600）
+"""
+import asyncio
+import hashlib
+import json
+import os
+import time
+import urllib.parse
+
+STORAGE_STATE_DIR = os.getenv('STORAGE_STATE_DIR', 'storage_state')
+STORAGE_STATE_TTL = int(os.getenv('STORAGE_STATE_TTL', '21600'))
+MIN_COOKIE_TTL = int(os.getenv('STORAGE_STATE_MIN_COOKIE_TTL', '600'))
+# 会话（SFCC dwsid / dwanonymous_* / sid）和同意（OneTrust / TrustArc）Cookie 的名称前缀
+SESSION_COOKIE_PREFIXES = tuple(
+    prefix.strip() for prefix in os.getenv(
+        'STORAGE_STATE_COOKIES',
+        'dwsid,dwanonymous_,dwsecuretoken_,sid,dw_dnt,OptanonConsent,OptanonAlertBoxClosed,notice_preferences,'
+        'notice_gdpr_prefs,TAconsentID,cmapi_cookie_privacy',
+    ).split(',') if prefix.strip())
+DEFAULT_LOCALE_URL = 'https://www.birkenstock.com/us/'
+
+# Cookie 同意弹窗的“接受”按钮
+CONSENT_SELECTORS = [
+    '#onetrust-accept-btn-handler',
+    'button#truste-consent-button',
+    'button.js-cookie-consent-accept',
+]
+
+# 地区/语言提示弹窗中“留在当前站点”或关闭按钮
+LOCALE_PROMPT_SELECTORS = [
+    'button.js-stay-on-site',
+    '.country-selector-dialog button.ui-dialog-titlebar-close',
+    'div.geo-redirect button.close',
+]
+
+# 同一个 key 的预热只允许同时进行一次，其余协程等待结果
+_warm_up_locks = {}
+
+
+def is_enabled():
+    return os.getenv('STORAGE_STATE', '1') == '1'
+
+
+def locale_root(url):
+    """
+    从任意站内 URL 推出站点语言入口，例如 https://www.birkenstock.com/us/xxx -> https://www.birkenstock.com/us/
+    """
+    parsed = urllib.parse.urlparse(url)
+    segments = [s for s in parsed.path.split('/') if s]
+    # SFCC 控制器地址：/on/demandware.store/Sites-US-Site/en_US/...
+    for segment in segments:
+        if segment.startswith('Sites-') and segment.endswith('-Site'):
+            return f"{parsed.scheme}://{parsed.netloc}/{segment[6:-5].lower()}/"
+    if segments and len(segments[0]) == 2 and segments[0] != 'on':
+        return f"{parsed.scheme}://{parsed.netloc}/{segments[0]}/"
+    return DEFAULT_LOCALE_URL
+
+
+def _proxy_server(proxy):
+    if not proxy:
+        return ''
+    if isinstance(proxy, dict):
+        return proxy.get('server', '')
+    return str(proxy)
+
+
+def _state_paths(locale_url, proxy=None):
+    key = f"{locale_url}|{_proxy_server(proxy)}"
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+    state_path = os.path.join(STORAGE_STATE_DIR, f"{digest}.json")
+    meta_path = os.path.join(STORAGE_STATE_DIR, f"{digest}.meta.json")
+    return state_path, meta_path
+
+
+def _is_fresh(state_path, meta_path):
+    """
+    状态文件存在，且没有超过预热时记录的 expires_at（TTL 与会话/同意 Cookie 过期时间中较早的一个）才认为可用。
+    这里只比较 meta 中的 expires_at，不重新读取 Cookie。
+    """
+    if not os.path.exists(state_path) or not os.path.exists(meta_path):
+        return False
+    try:
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return False
+
+    now = time.time()
+    if now >= meta.get('expires_at', 0):
+        return False
+    return True
+
+
+def _expires_at(cookies, now):
+    """
+    有效期取 TTL 与会话/同意 Cookie 中最早过期的一个两者中较早的时间。
+    其他 Cookie、浏览器会话期 Cookie（expires 为 -1）以及几分钟内就过期的 Cookie 不参与计算。
+    """
+    expires_at = now + STORAGE_STATE_TTL
+    for cookie in cookies:
+        if not cookie.get('name', '').startswith(SESSION_COOKIE_PREFIXES):
+            continue
+        cookie_expires = cookie.get('expires', -1)
+        if cookie_expires and cookie_expires > now + MIN_COOKIE_TTL:
+            expires_at = min(expires_at, cookie_expires)
+    return expires_at
+
+
+async def _click_if_visible(page, selectors):
+    for selector in selectors:
+        try:
+            locator = page.locator(selector).first
+            if await locator.is_visible():
+                await locator.click(timeout=3000)
+                await page.wait_for_timeout(500)
+        except Exception:
+            pass
+
+
+async def warm_up_storage_state(browser, locale_url=DEFAULT_LOCALE_URL, proxy=None):
+    """
+    打开一次站点语言入口，处理同意弹窗和地区提示，然后保存 storage_state。
+    返回保存的状态文件路径。
+    """
+    state_path, meta_path = _state_paths(locale_url, proxy)
+    os.makedirs(STORAGE_STATE_DIR, exist_ok=True)
+
+    context_kwargs = {'proxy': proxy} if isinstance(proxy, dict) else {}
+    context = await browser.new_context(**context_kwargs)
+    try:
+        page = await context.new_page()
+        print(f"预热 storage_state: {locale_url}")
+        await page.goto(locale_url, timeout=60000)
+        await page.wait_for_load_state('domcontentloaded')
+        await _click_if_visible(page, CONSENT_SELECTORS)
+        await _click_if_visible(page, LOCALE_PROMPT_SELECTORS)
+        # 等待会话 Cookie 下发
+        await page.wait_for_timeout(1000)
+
+        tmp_path = state_path + '.tmp'
+        state = await context.storage_state(path=tmp_path)
+        os.replace(tmp_path, state_path)
+
+        now = time.time()
+        expires_at = _expires_at(state.get('cookies', []), now)
+
+        with open(meta_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'locale_url': locale_url,
+                'proxy': _proxy_server(proxy),
+                'created_at': now,
+                'expires_at': expires_at,
+            }, f, ensure_ascii=False, indent=4)
+        print(f"storage_state 已保存到 {state_path}，有效期 {int(expires_at - now)} 秒。")
+    finally:
+        await context.close()
+
+    return state_path
+
+
+async def get_storage_state(browser, locale_url=DEFAULT_LOCALE_URL, proxy=None):
+    """
+    返回可用的 storage_state 文件路径，过期或不存在时自动重新预热。
+    """
+    state_path, meta_path = _state_paths(locale_url, proxy)
+    if _is_fresh(state_path, meta_path):
+        return state_path
+
+    key = (locale_url, _proxy_server(proxy))
+    lock = _warm_up_locks.setdefault(key, asyncio.Lock())
+    async with lock:
+        # 等锁期间可能已经被其他协程预热完成
+        if _is_fresh(state_path, meta_path):
+            return state_path
+        return await warm_up_storage_state(browser, locale_url, proxy)
+
+
+async def new_context(browser, locale_url=DEFAULT_LOCALE_URL, proxy=None, **kwargs):
+    """
+    创建一个从预热状态启动的新 context。预热失败时退回到空白 context。
+    """
+    if isinstance(proxy, dict):
+        kwargs['proxy'] = proxy
+    if not is_enabled():
+        return await browser.new_context(**kwargs)
+
+    try:
+        state_path = await get_storage_state(browser, locale_url, proxy)
+        return await browser.new_context(storage_state=state_path, **kwargs)
+    except Exception as e:
+        print(f"警告: 预热 storage_state 失败 ({e})，使用空白 context。")
+        return await browser.new_context(**kwargs)
@@ -1,15 +1,24 @@
 import json
 
 def update_widths(file_path):
+    """
+    旧数据中每个宽度是一条单独的记录，这里按 (title, color) 合并宽度列表。
+    详情阶段现在一次采集所有宽度（size_matrix 字段），带矩阵的记录已经是每个颜色一条，原样保留。
+    """
     with open(file_path, 'r', encoding='utf-8') as f:
         products = json.load(f)
 
     # 使用字典来存储唯一的产品，键为 (title, color)，值为产品数据
     # 并且将宽度存储在一个列表中
     unique_products = {}
+    merged_count = 0
 
-    for product in products:
-        key = (product['title'], product['color'])
+    for index, product in enumerate(products):
+        if product.get('size_matrix'):
+            unique_products[('size_matrix', index)] = product
+            continue
+        merged_count += 1
+        key = (product['title'], product.get('color'))
         if key not in unique_products:
             # 如果是新产品，复制一份产品数据，并将宽度初始化为列表
             new_product = product.copy()
@@ -20,6 +29,10 @@ def update_widths(file_path):
             if product['width'] not in unique_products[key]['width']:
                 unique_products[key]['width'].append(product['width'])
 
+    if not merged_count:
+        print("所有记录都已包含宽度×尺码矩阵，无需合并。")
+        return
+
     # 将字典的值转换为列表，形成新的产品列表
     updated_products = list(unique_products.values())
 
@@ -0,0 +1,368 @@
+# -*- coding: utf-8 -*-
+"""
+在浏览器页面内批量 fetch 产品片段，不再逐个导航。
+
+每个 context 只打开一个店铺页面，然后在该页面里调用 fetch()（自动带上 Cookie 和反爬状态），
+并发拉取多个 Product-Variation / Product-Show 片段，用 DOMParser 解析，
+解析规则与 1-1从json中读取批量NoColor.py 中的 scrape_product_details 保持一致。
+结果按批次返回给 Python，再组装成与逐页采集完全相同的产品字典。
+
+宽度×尺码矩阵：详情页只显示当前宽度的尺码，其余宽度的尺码和可售状态
+通过在页面内 fetch 各宽度的 Product-Variation 片段得到（size_matrix 字段），每个颜色只需打开一次详情页。
+
+详情阶段“是否已采集”的判断和去重使用 detail_key：采集矩阵时按颜色键（一个颜色只打开一次），
+WIDTH_MATRIX=0 时每个宽度单独采集，按变体键。
+
+环境变量：
+    WIDTH_MATRIX=0           不采集宽度×尺码矩阵
+"""
+import json
+import os
+
+import sfcc_url
+from sfcc_url import product_show_url
+
+WIDTH_MATRIX_ENABLED = os.getenv('WIDTH_MATRIX', '1') == '1'
+# detail_key 对应的 sfcc_url 键函数名（也是 catalog_store 中的列名）
+DETAIL_KEY_NAME = 'color_key' if WIDTH_MATRIX_ENABLED else 'variant_key'
+
+
+def detail_key(url):
+    """
+    详情阶段的去重键：采集宽度矩阵时为颜色键（同一颜色的所有宽度在一个页面内得到），否则为变体键（每个宽度单独采集）。
+    """
+    return getattr(sfcc_url, DETAIL_KEY_NAME)(url)
+
+# 读取宽度色块（名称、切换地址、宽度代码），在当前文档或 DOMParser 解析出的文档上执行
+_WIDTH_SWATCHES_FN = """
+    const widthSwatches = (doc) => {
+        const swatches = [];
+        doc.querySelectorAll('ul.swatches.width li span.swatchanchor.width-type.width').forEach(el => {
+            let label = null;
+            const ariaLabel = el.getAttribute('aria-label');
+            if (ariaLabel && ariaLabel.startsWith('Width ')) {
+                label = ariaLabel.replace('Width ', '').trim();
+            } else {
+                const span = el.querySelector('span');
+                if (span) label = (span.innerText || span.textContent || '').trim();
+            }
+            if (!label) return;
+            const li = el.closest('li');
+            const anchor = el.closest('a');
+            const url = el.getAttribute('data-selectionurl') || el.getAttribute('data-href')
+                || (anchor && anchor.getAttribute('href')) || (li && li.getAttribute('data-selectionurl'));
+            swatches.push({
+                label,
+                url: url && url !== '#' ? url : null,
+                value: el.getAttribute('data-value') || (li && li.getAttribute('data-value')),
+                selected: !!(li && li.classList.contains('selected')),
+            });
+        });
+        return swatches;
+    };
+"""
+
+WIDTH_SWATCHES_JS = "() => {" + _WIDTH_SWATCHES_FN + "    return widthSwatches(document);\n}"
+
+# 读取一个尺码组（.wsizegroup/.msizegroup/.ksizegroup）的尺码及是否可售，依赖外层定义的 text()
+_SIZE_ENTRIES_FN = """
+    const sizeEntries = (doc, selector) => {
+        const group = doc.querySelector(selector);
+        if (!group) return [];
+        const result = [];
+        group.querySelectorAll('.swatchanchor').forEach(item => {
+            const top = item.querySelector('.size-top');
+            if (!top) return;
+            const li = item.closest('li');
+            const unavailable = (li && li.classList.contains('unselectable')) || item.classList.contains('unselectable');
+            result.push({ size: text(top).trim().replace(' US', ''), available: !unavailable });
+        });
+        return result;
+    };
+"""
+
+# 并发 fetch 各宽度的 Product-Variation 片段，按女码/男码/童码读取尺码及是否可售
+SIZE_MATRIX_JS = """
+async ({ items, concurrency }) => {
+    const parser = new DOMParser();
+    const text = el => (el ? (el.innerText || el.textContent || '') : '');
+/* size_entries */
+
+    const results = new Array(items.length);
+    let next = 0;
+    const worker = async () => {
+        while (next < items.length) {
+            const index = next++;
+            const item = items[index];
+            try {
+                const response = await fetch(item.fetch_url, { credentials: 'include' });
+                if (!response.ok) {
+                    results[index] = { url: item.url, width: item.width, error: `HTTP ${response.status}` };
+                    continue;
+                }
+                const doc = parser.parseFromString(await response.text(), 'text/html');
+                results[index] = {
+                    url: item.url,
+                    width: item.width,
+                    sizes: {
+                        women: sizeEntries(doc, '.wsizegroup'),
+                        men: sizeEntries(doc, '.msizegroup'),
+                        kids: sizeEntries(doc, '.ksizegroup'),
+                    },
+                };
+            } catch (e) {
+                results[index] = { url: item.url, width: item.width, error: String(e) };
+            }
+        }
+    };
+    await Promise.all(Array.from({ length: Math.min(concurrency, items.length) }, worker));
+    return results;
+}
+""".replace('/* size_entries */', _SIZE_ENTRIES_FN)
+
+# 与 scrape_product_details 相同的选择器，在页面内对 DOMParser 解析出的文档执行
+EXTRACT_BATCH_JS = """
+async ({ items, concurrency }) => {
+    const parser = new DOMParser();
+    const text = el => (el ? (el.innerText || el.textContent || '') : null);
+/* width_swatches */
+    const sizeTexts = (doc, selector) => {
+        const group = doc.querySelector(selector);
+        if (!group) return null;
+        const result = [];
+        group.querySelectorAll('.swatchanchor').forEach(item => {
+            const top = item.querySelector('.size-top');
+            if (top) result.push(text(top).trim().replace(' US', ''));
+        });
+        return result;
+    };
+
+    const extract = (html) => {
+        const doc = parser.parseFromString(html, 'text/html');
+
+        const widths = [];
+        doc.querySelectorAll('ul.swatches.width li span.swatchanchor.width-type.width').forEach(el => {
+            const ariaLabel = el.getAttribute('aria-label');
+            if (ariaLabel && ariaLabel.startsWith('Width ')) {
+                widths.push(ariaLabel.replace('Width ', '').trim());
+            } else {
+                const span = el.querySelector('span');
+                if (span) widths.push(text(span).trim());
+            }
+        });
+
+        const descriptionParts = [];
+        const mainDescription = doc.querySelector('span.product-description-text');
+        if (mainDescription) descriptionParts.push(text(mainDescription));
+        doc.querySelectorAll('ul.product-description-list li').forEach(li => descriptionParts.push(text(li)));
+        doc.querySelectorAll('ul.product-description-additional-list li').forEach(li => {
+            const t = text(li).trim();
+            if (t && !t.includes('content-asset')) descriptionParts.push(t);
+        });
+        const contentAsset = doc.querySelector('div.toggle-container.expanded div.toggle-content div.content-asset');
+        if (contentAsset) {
+            const t = text(contentAsset).trim();
+            if (t) descriptionParts.push(t);
+        }
+
+        const images = [];
+        doc.querySelectorAll('div.grid-tile.thumb img.productthumbnail').forEach(img => {
+            images.push({ lgimg: img.getAttribute('data-lgimg'), src: img.getAttribute('src') });
+        });
+
+        return {
+            title: text(doc.querySelector('span.heading-1')),
+            price: text(doc.querySelector('span.price-standard')),
+            widths,
+            width_swatches: widthSwatches(doc),
+            women: sizeTexts(doc, '.wsizegroup'),
+            men: sizeTexts(doc, '.msizegroup'),
+            kids: sizeTexts(doc, '.ksizegroup'),
+            description_parts: descriptionParts,
+            images,
+        };
+    };
+
+    const results = new Array(items.length);
+    let next = 0;
+    const worker = async () => {
+        while (next < items.length) {
+            const index = next++;
+            const item = items[index];
+            try {
+                const response = await fetch(item.fetch_url, { credentials: 'include' });
+                if (!response.ok) {
+                    results[index] = { url: item.url, error: `HTTP ${response.status}` };
+                    continue;
+                }
+                const html = await response.text();
+                results[index] = { url: item.url, raw: extract(html) };
+            } catch (e) {
+                results[index] = { url: item.url, error: String(e) };
+            }
+        }
+    };
+    await Promise.all(Array.from({ length: Math.min(concurrency, items.length) }, worker));
+    return results;
+}
+""".replace('/* width_swatches */', _WIDTH_SWATCHES_FN)
+
+
+def classify_kids_sizes(size_texts):
+    """
+    根据尺码范围把童鞋尺码分为 little_kids 和 big_kids，规则与 scrape_product_details 相同。
+    """
+    kids_sizes = {}
+    for size_text in size_texts:
+        try:
+            first_size = float(size_text.split('-')[0]) if '-' in size_text else float(size_text)
+            group = 'little_kids' if first_size <= 10.5 else 'big_kids'
+        except ValueError:
+            group = 'little_kids'
+        kids_sizes.setdefault(group, []).append(size_text)
+    return kids_sizes
+
+
+def _image_urls(images):
+    image_urls = []
+    base_url = 'https:'
+    for image in images:
+        lg_img_data = image.get('lgimg')
+        if lg_img_data:
+            try:
+                lg_img_json = json.loads(lg_img_data)
+                full_url = lg_img_json.get('hires') or lg_img_json.get('url')
+                if full_url and not full_url.startswith('http'):
+                    full_url = base_url + full_url
+                if full_url:
+                    image_urls.append(full_url)
+                    continue
+            except json.JSONDecodeError:
+                pass
+        src = image.get('src')
+        if src and not src.startswith('http'):
+            image_urls.append(base_url + src)
+    return image_urls
+
+
+def build_product_data(url, raw):
+    """
+    把页面内解析出的原始字段组装成产品字典。
+    返回 (product_data, missing_fields)，缺少关键字段时 product_data 为 None。
+    """
+    width = ', '.join(raw.get('widths') or []) or 'N/A'
+
+    sizes = {}
+    if raw.get('women'):
+        sizes['women'] = raw['women']
+    if raw.get('men'):
+        sizes['men'] = raw['men']
+    if raw.get('kids'):
+        kids_sizes = classify_kids_sizes(raw['kids'])
+        if kids_sizes:
+            sizes['kids'] = kids_sizes
+    if not sizes:
+        sizes = 'N/A'
+
+    description_parts = raw.get('description_parts') or []
+    description = ' '.join(description_parts).strip() if description_parts else 'N/A'
+
+    product_data = {
+        'url': url,
+        'title': (raw.get('title') or 'N/A').strip(),
+        'width': width,
+        'sizes': sizes,
+        'price': (raw.get('price') or 'N/A').strip(),
+        'description': description.strip(),
+        'image_urls': list(set(_image_urls(raw.get('images') or [])))
+    }
+
+    missing_fields = [field for field in ('title', 'width', 'price', 'description') if product_data[field] == 'N/A']
+    if not product_data['image_urls']:
+        missing_fields.append('image_urls')
+    if missing_fields:
+        return None, missing_fields
+    return product_data, []
+
+
+def width_variation_items(url, swatches):
+    """
+    每个宽度一个待 fetch 的片段地址：优先使用色块上的切换地址，没有时用 pid、颜色和宽度代码拼出。
+    """
+    key = sfcc_url.parse_product_url(url)
+    items = []
+    seen = set()
+    for swatch in swatches or []:
+        label = swatch.get('label')
+        if not label or label in seen:
+            continue
+        if swatch.get('url'):
+            fetch_url = sfcc_url.absolute_url(swatch['url'])
+        elif key is not None and swatch.get('value'):
+            fetch_url = sfcc_url.variation_url(key, swatch['value'])
+        else:
+            continue
+        seen.add(label)
+        items.append({'url': url, 'width': label, 'fetch_url': fetch_url})
+    return items
+
+
+def build_size_matrices(results):
+    """
+    把片段解析结果组装成 {产品 url: {宽度: {'women'|'men'|'kids': {尺码: 是否可售}}}}。
+    """
+    matrices = {}
+    for result in results:
+        if result.get('error'):
+            print(f"警告: {result['url']} 的宽度 {result['width']} 尺码读取失败: {result['error']}")
+            continue
+        groups = {}
+        for group in ('women', 'men', 'kids'):
+            entries = result['sizes'].get(group) or []
+            if entries:
+                groups[group] = {entry['size']: entry['available'] for entry in entries}
+        if groups:
+            matrices.setdefault(result['url'], {})[result['width']] = groups
+    return matrices
+
+
+async def fetch_size_matrices(page, items, concurrency=6):
+    if not items:
+        return {}
+    results = await page.evaluate(SIZE_MATRIX_JS, {'items': items, 'concurrency': concurrency})
+    return build_size_matrices(results)
+
+
+async def fetch_product_batch(page, urls, concurrency=6, known_matrices=None):
+    """
+    在已打开的店铺页面中并发 fetch 一批产品 URL。
+    known_matrices 为 {url: size_matrix}，其中的产品直接使用已有矩阵（例如 variation_matrix.py 的结果），不再 fetch 各宽度片段。
+    返回 [(url, product_data 或 None, 错误说明, 缺失字段列表)]，顺序与输入一致。
+    """
+    known_matrices = known_matrices or {}
+    items = [{'url': url, 'fetch_url': product_show_url(url)} for url in urls]
+    results = await page.evaluate(EXTRACT_BATCH_JS, {'items': items, 'concurrency': concurrency})
+
+    batch = []
+    width_items = []
+    for result in results:
+        url = result['url']
+        if result.get('error'):
+            batch.append((url, None, result['error'], []))
+            continue
+        product_data, missing_fields = build_product_data(url, result['raw'])
+        if product_data is None:
+            batch.append((url, None, f"缺少关键数据: {', '.join(missing_fields)}", missing_fields))
+        else:
+            batch.append((url, product_data, '', []))
+            if url in known_matrices:
+                product_data['size_matrix'] = known_matrices[url]
+                continue
+            width_items.extend(width_variation_items(url, result['raw'].get('width_swatches')))
+
+    if WIDTH_MATRIX_ENABLED and width_items:
+        matrices = await fetch_size_matrices(page, width_items, concurrency)
+        for url, product_data, _, _ in batch:
+            if product_data and url in matrices:
+                product_data['size_matrix'] = matrices[url]
+    return batch
@@ -0,0 +1,338 @@
+# -*- coding: utf-8 -*-
+"""
+按款式（master）采集颜色×宽度×尺码矩阵，代替第三步逐个颜色打开详情页。
+
+每个颜色有自己的 pid（<款式>_<颜色代码>），同一款式的所有颜色共享一套色块。
+这里按 sfcc_url.master_key 把第二步的产品链接归并为款式（约数百个，而颜色变体有数千个），
+只打开一个店铺页面，在页面内 fetch 每个款式的一个 Product-Variation 片段，读取颜色色块、宽度色块、价格和尺码可售状态，
+再按深度补充少量宽度片段，最后展开成与第三步相同结构的颜色记录（url、color、level1-3 分类），
+并附带 price、size_matrix（{宽度: {'women'|'men'|'kids': {尺码: 是否可售}}}）和 matrix_color。
+
+MATRIX_DEPTH：
+    width    （默认）每个款式 1 + (宽度数 - 1) 个请求：尺码矩阵在默认颜色上测得，
+             同一款式的其他颜色沿用（哪些宽度提供哪些尺码在颜色之间一致，可售状态以 matrix_color 为准）；
+             价格只写在默认颜色的记录上，其他颜色没有测过价格，不带 price 字段（由详情阶段读取）
+    color    每个颜色、每个宽度各一个片段请求，得到每个颜色自己的价格和可售状态（仍是 XHR，不打开页面）
+size_matrix 测自本颜色（matrix_color == color）的记录，详情阶段直接使用，不再 fetch 各宽度片段。
+
+环境变量：
+    MATRIX_INPUT             第二步产品链接文件（默认 第二步_产品链接.json）
+    MATRIX_OUTPUT            颜色记录输出文件（默认 所有颜色变体URL_Cursor.json，即去重脚本的输入）
+    MATRIX_FAILED            失败记录文件（默认 variation_matrix_failed.json）
+    MATRIX_DEPTH             width 或 color（默认 width）
+    MATRIX_CONCURRENCY       页面内并发 fetch 数（默认 6）
+    MATRIX_BATCH_SIZE        每次 page.evaluate 处理的请求数（默认 50）
+"""
+import asyncio
+import json
+import os
+
+from playwright.async_api import async_playwright
+
+import asset_cache
+import json_stream
+import metrics
+import sfcc_url
+import storage_state
+import variation_fetch
+
+INPUT_FILE = os.getenv('MATRIX_INPUT', '第二步_产品链接.json')
+OUTPUT_FILE = os.getenv('MATRIX_OUTPUT', '所有颜色变体URL_Cursor.json')
+FAILED_FILE = os.getenv('MATRIX_FAILED', 'variation_matrix_failed.json')
+DEPTH = os.getenv('MATRIX_DEPTH', 'width')
+CONCURRENCY = int(os.getenv('MATRIX_CONCURRENCY', '6'))
+BATCH_SIZE = int(os.getenv('MATRIX_BATCH_SIZE', '50'))
+
+# 并发 fetch Product-Variation 片段，读取颜色色块、宽度色块、价格和各尺码组的可售状态
+MATRIX_JS = """
+async ({ items, concurrency }) => {
+    const parser = new DOMParser();
+    const text = el => (el ? (el.innerText || el.textContent || '') : '');
+/* width_swatches */
+/* size_entries */
+    const colorSwatches = (doc) => {
+        const swatches = [];
+        doc.querySelectorAll('.swatchanchor.color').forEach(el => {
+            const li = el.closest('li');
+            swatches.push({
+                color: el.getAttribute('data-value'),
+                url: el.getAttribute('data-selectionurl') || el.getAttribute('href'),
+                selected: !!(li && li.classList.contains('selected')),
+            });
+        });
+        return swatches;
+    };
+
+    const results = new Array(items.length);
+    let next = 0;
+    const worker = async () => {
+        while (next < items.length) {
+            const index = next++;
+            const item = items[index];
+            try {
+                const response = await fetch(item.fetch_url, { credentials: 'include' });
+                if (!response.ok) {
+                    results[index] = { ...item, error: `HTTP ${response.status}` };
+                    continue;
+                }
+                const doc = parser.parseFromString(await response.text(), 'text/html');
+                results[index] = {
+                    ...item,
+                    price: text(doc.querySelector('span.price-standard') || doc.querySelector('span.price-sales')).trim() || null,
+                    colors: colorSwatches(doc),
+                    width_swatches: widthSwatches(doc),
+                    sizes: {
+                        women: sizeEntries(doc, '.wsizegroup'),
+                        men: sizeEntries(doc, '.msizegroup'),
+                        kids: sizeEntries(doc, '.ksizegroup'),
+                    },
+                };
+            } catch (e) {
+                results[index] = { ...item, error: String(e) };
+            }
+        }
+    };
+    await Promise.all(Array.from({ length: Math.min(concurrency, items.length) }, worker));
+    return results;
+}
+""".replace('/* width_swatches */', variation_fetch._WIDTH_SWATCHES_FN).replace(
+    '/* size_entries */', variation_fetch._SIZE_ENTRIES_FN)
+
+
+def load_masters(path):
+    """
+    把第二步的产品链接按款式归并：{master_key: {'urls': [...], 'categories': [...]}}，保持首次出现的顺序。
+    同一款式出现在多个分类下时，展开后的每个颜色都属于这些分类（与第三步的结果一致）。
+    """
+    masters = {}
+    for category in json_stream.iter_records(path):
+        levels = {
+            'level1_category': category.get('level1_category', 'N/A'),
+            'level2_category': category.get('level2_category', 'N/A'),
+            'level3_category': category.get('level3_category', 'N/A'),
+        }
+        for url in category.get('product_urls') or []:
+            if sfcc_url.parse_product_url(url) is None:
+                continue
+            master = masters.setdefault(sfcc_url.master_key(url), {'urls': [], 'categories': []})
+            if url not in master['urls']:
+                master['urls'].append(url)
+            if levels not in master['categories']:
+                master['categories'].append(levels)
+    return masters
+
+
+async def fetch_fragments(page, items):
+    """
+    分批在页面内 fetch 片段，返回与 items 顺序一致的解析结果。
+    """
+    results = []
+    for start in range(0, len(items), BATCH_SIZE):
+        batch = items[start:start + BATCH_SIZE]
+        with metrics.timer('colour', 'fetch'):
+            results.extend(await page.evaluate(MATRIX_JS, {'items': batch, 'concurrency': CONCURRENCY}))
+        print(f"  已完成 {start + len(batch)}/{len(items)} 个片段请求")
+    return results
+
+
+def _default_width(swatches):
+    selected = [swatch['label'] for swatch in swatches if swatch.get('selected')]
+    if selected:
+        return selected[0]
+    return swatches[0]['label'] if len(swatches) == 1 else None
+
+
+def _color_variants(fragment, fetched_key):
+    """
+    片段中的颜色色块 -> [(颜色名, 颜色地址, ProductKey)]，并返回默认（当前选中）颜色的下标。
+    """
+    variants = []
+    seen = set()
+    default_index = None
+    for swatch in fragment.get('colors') or []:
+        if not swatch.get('color') or not swatch.get('url') or swatch['url'] == '#':
+            continue
+        url = sfcc_url.absolute_url(swatch['url'])
+        key = sfcc_url.parse_product_url(url)
+        if key is None or sfcc_url.color_key(url) in seen:
+            continue
+        seen.add(sfcc_url.color_key(url))
+        if swatch.get('selected') or (default_index is None and key.pid == fetched_key.pid):
+            default_index = len(variants)
+        variants.append((swatch['color'].strip(), url, key))
+    return variants, default_index or 0
+
+
+def _width_items(master_id, color_url, color_key, swatches, skip_label):
+    """
+    某个颜色除 skip_label 以外各宽度的片段请求：用 pid、颜色和宽度代码拼出，没有宽度代码时用属于该颜色的色块切换地址。
+    """
+    items = []
+    for swatch in swatches:
+        if swatch['label'] == skip_label:
+            continue
+        if swatch.get('value'):
+            fetch_url = sfcc_url.variation_url(color_key._replace(width=None), swatch['value'])
+        elif swatch.get('url') and sfcc_url.pid(sfcc_url.absolute_url(swatch['url'])) == color_key.pid:
+            fetch_url = sfcc_url.absolute_url(swatch['url'])
+        else:
+            continue
+        items.append({'master': master_id, 'url': color_url, 'width': swatch['label'], 'fetch_url': fetch_url})
+    return items
+
+
+def plan_width_requests(masters, depth=DEPTH):
+    """
+    根据款式片段决定第二轮要 fetch 的宽度片段。
+    width 深度只补默认颜色的其他宽度；color 深度为每个颜色的每个宽度各发一个请求（默认颜色的默认宽度已在第一轮取得）。
+    """
+    items = []
+    for master_id, master in masters.items():
+        fragment = master.get('fragment')
+        if not fragment or not master['colors']:
+            continue
+        swatches = fragment.get('width_swatches') or []
+        default_width = master['default_width']
+        for index, (_, color_url, color_key) in enumerate(master['colors']):
+            if depth != 'color' and index != master['default_color']:
+                continue
+            skip_label = default_width if index == master['default_color'] else None
+            items.extend(_width_items(master_id, color_url, color_key, swatches, skip_label))
+    return items
+
+
+def expand_records(masters, width_results, depth=DEPTH):
+    """
+    把款式片段和宽度片段展开成每个颜色、每个分类一条记录，结构与第三步输出相同，附带 price、size_matrix、matrix_color。
+    price 只来自本颜色的片段：没有 fetch 过的颜色不带 price，不沿用默认颜色的价格。
+    """
+    # 第一轮片段本身就是默认颜色在默认宽度上的尺码
+    results = []
+    for master in masters.values():
+        if master.get('fragment') and master['default_width']:
+            default_url = master['colors'][master['default_color']][1]
+            results.append({'url': default_url, 'width': master['default_width'], 'sizes': master['fragment']['sizes']})
+    matrices = variation_fetch.build_size_matrices(results + list(width_results))
+    prices = {}
+    for result in width_results:
+        if result.get('price') and not result.get('error'):
+            prices.setdefault(result['url'], result['price'])
+
+    records = []
+    for master in masters.values():
+        if not master.get('fragment'):
+            continue
+        # 矩阵中的宽度按页面上宽度色块的顺序排列
+        labels = [swatch['label'] for swatch in master['fragment'].get('width_swatches') or []]
+        for _, color_url, _ in master['colors']:
+            if color_url in matrices:
+                matrices[color_url] = {label: matrices[color_url][label] for label in labels if label in matrices[color_url]}
+        default_name, default_url, _ = master['colors'][master['default_color']]
+        for color_name, color_url, _ in master['colors']:
+            record_fields = {}
+            price = prices.get(color_url) if depth == 'color' else None
+            if not price and color_url == default_url:
+                price = master['fragment'].get('price')
+            if price:
+                record_fields['price'] = price
+            if depth == 'color':
+                if color_url in matrices:
+                    record_fields['size_matrix'] = matrices[color_url]
+                    record_fields['matrix_color'] = color_name
+            elif default_url in matrices:
+                record_fields['size_matrix'] = matrices[default_url]
+                record_fields['matrix_color'] = default_name
+            for category in master['categories']:
+                records.append({'url': color_url, 'color': color_name, **category, **record_fields})
+    return records
+
+
+def exact_size_matrix(record):
+    """
+    颜色记录中测自本颜色的 size_matrix；沿用其他颜色测得的矩阵或没有矩阵时返回 None。
+    """
+    if record.get('size_matrix') and record.get('matrix_color') == record.get('color'):
+        return record['size_matrix']
+    return None
+
+
+async def collect(page, masters, depth=DEPTH):
+    """
+    两轮请求：每个款式一个片段，然后按深度补宽度片段。返回 (records, failures)。
+    """
+    failures = []
+    master_items = []
+    for master_id, master in masters.items():
+        key = sfcc_url.parse_product_url(master['urls'][0])
+        master['key'] = key
+        master_items.append({'master': master_id, 'fetch_url': sfcc_url.variation_url(key._replace(width=None))})
+
+    print(f"第一轮：{len(master_items)} 个款式片段。")
+    for result in await fetch_fragments(page, master_items):
+        master = masters[result['master']]
+        if result.get('error'):
+            failures.extend({'url': url, 'reason': result['error']} for url in master['urls'])
+            continue
+        master['colors'], master['default_color'] = _color_variants(result, master['key'])
+        if not master['colors']:
+            failures.extend({'url': url, 'reason': '片段中没有颜色色块'} for url in master['urls'])
+            continue
+        master['fragment'] = result
+        master['default_width'] = _default_width(result.get('width_swatches') or [])
+        # 第二步中出现、但不在款式色块里的颜色交给第三步逐个访问
+        swatch_pids = {key.pid for _, _, key in master['colors']}
+        for url in master['urls']:
+            if sfcc_url.pid(url) not in swatch_pids:
+                failures.append({'url': url, 'reason': '颜色不在款式色块中'})
+
+    width_items = plan_width_requests(masters, depth)
+    print(f"第二轮（MATRIX_DEPTH={depth}）：{len(width_items)} 个宽度片段。")
+    width_results = await fetch_fragments(page, width_items) if width_items else []
+    return expand_records(masters, width_results, depth), failures
+
+
+async def main():
+    if DEPTH not in ('width', 'color'):
+        print(f"错误：MATRIX_DEPTH 只能是 width 或 color，当前为 {DEPTH}")
+        return
+    if not os.path.exists(INPUT_FILE):
+        print(f"错误：未找到输入文件 {INPUT_FILE}")
+        return
+    masters = load_masters(INPUT_FILE)
+    url_count = sum(len(master['urls']) for master in masters.values())
+    print(f"从 {INPUT_FILE} 读取到 {url_count} 个产品链接，归并为 {len(masters)} 个款式。")
+    if not masters:
+        return
+
+    async with async_playwright() as p:
+        browser = await p.chromium.launch(headless=True)
+        context = await storage_state.new_context(browser)
+        await asset_cache.attach_if_enabled(context)
+        page = await context.new_page()
+        metrics.attach_page(page, 'colour')
+        first_url = next(iter(masters.values()))['urls'][0]
+        storefront_url = storage_state.locale_root(first_url)
+        with metrics.timer('colour', 'navigation'):
+            await page.goto(storefront_url, timeout=60000)
+            await page.wait_for_load_state('domcontentloaded')
+        print(f"已打开 {storefront_url}，页面内并发 {CONCURRENCY}。")
+        try:
+            records, failures = await collect(page, masters, DEPTH)
+        finally:
+            await browser.close()
+
+    with metrics.timer('colour', 'write'):
+        json_stream.write_json_array(OUTPUT_FILE, records)
+    color_count = len({sfcc_url.color_key(record['url']) for record in records})
+    exact_count = len({sfcc_url.color_key(record['url']) for record in records if exact_size_matrix(record)})
+    print(f"完成：{color_count} 个颜色（{len(records)} 条分类记录）已写入 {OUTPUT_FILE}，"
+          f"其中 {exact_count} 个颜色的尺码矩阵测自本颜色。")
+    if failures:
+        with open(FAILED_FILE, 'w', encoding='utf-8') as f:
+            json.dump(failures, f, ensure_ascii=False, indent=4)
+        print(f"警告: {len(failures)} 个产品链接未能展开，已记录到 {FAILED_FILE}。")
+    metrics.finish('colour')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
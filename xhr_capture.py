@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+"""
+拦截 SFCC 的 XHR/JSON 响应，直接解析成结构化记录，而不是在每次交互后重新遍历渲染后的 DOM。
+
+- 分类页首屏文档和“加载更多”（Search-Show / Search-UpdateGrid）返回的是产品 tile 的 HTML 片段
+- 切换颜色/宽度时 Product-Variation 返回的是变体片段（价格、尺码、颜色色块）
+
+ResponseCapture 通过 page.on("response") 在响应到达时解析，可选地把每条记录追加写入 JSONL 文件。
+"""
+import asyncio
+import json
+import time
+from html.parser import HTMLParser
+
+import sfcc_url
+from sfcc_url import absolute_url
+
+GRID_ENDPOINTS = ('Search-Show', 'Search-UpdateGrid')
+VARIATION_ENDPOINTS = ('Product-Variation',)
+
+
+class TileParser(HTMLParser):
+    """
+    从分类网格 HTML 中提取每个 tile 的产品链接、pid、价格以及 tile 上的颜色色块。
+    tile 上只显示部分色块（带“更多颜色”提示）时 colors_truncated 为 True。
+    价格与详情页一致优先取 price-standard，没有时取促销价；tile 上没有价格时为 None。
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._tiles = []
+        self._current = None
+        self._price_field = None
+        self._price_depth = 0
+        self._price_text = []
+
+    @property
+    def tiles(self):
+        tiles = []
+        for tile in self._tiles:
+            if not tile['url']:
+                continue
+            tile['colors'] = [c for c in tile['colors'] if c['color']]
+            prices = tile.pop('_prices')
+            tile['price'] = prices.get('standard') or prices.get('sales')
+            tiles.append(tile)
+        return tiles
+
+    def _new_tile(self, pid):
+        self._current = {'url': None, 'pid': pid, 'colors': [], 'colors_truncated': False, '_prices': {}}
+        self._tiles.append(self._current)
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        classes = (attrs.get('class') or '').split()
+        pid = attrs.get('data-itemid') or attrs.get('data-pid')
+        if tag != 'a' and ('product-tile' in classes or 'grid-tile' in classes):
+            self._new_tile(pid)
+            return
+        if tag == 'a' and 'product-tile' in classes and attrs.get('href'):
+            if self._current is None or self._current['url']:
+                self._new_tile(pid)
+            self._current['url'] = absolute_url(attrs['href'])
+            self._current['pid'] = self._current['pid'] or pid
+            return
+        if self._current is None:
+            return
+
+        if tag == 'span' and self._price_field:
+            # 价格 span 内嵌套的货币符号等 span
+            self._price_depth += 1
+        elif tag == 'span' and 'price-standard' in classes:
+            self._price_field, self._price_text = 'standard', []
+        elif tag == 'span' and ('price-sales' in classes or 'product-sales' in classes):
+            self._price_field, self._price_text = 'sales', []
+        elif any(c in classes for c in ('swatch-more', 'swatches-more', 'product-swatches-all', 'more-swatches')):
+            self._current['colors_truncated'] = True
+        elif 'swatch' in classes or ('swatchanchor' in classes and 'color' in classes):
+            href = attrs.get('data-selectionurl') or attrs.get('href') or attrs.get('data-href')
+            color = attrs.get('data-value') or attrs.get('title') or attrs.get('aria-label')
+            if href and href != '#':
+                self._current['colors'].append({'color': color.strip() if color else None, 'url': absolute_url(href)})
+        elif tag == 'img' and 'swatch-image' in classes and self._current['colors']:
+            # 色块名称有时只出现在 img 的 alt 上
+            last = self._current['colors'][-1]
+            if not last['color'] and attrs.get('alt'):
+                last['color'] = attrs['alt'].strip()
+
+    def handle_endtag(self, tag):
+        if tag != 'span' or not self._price_field:
+            return
+        if self._price_depth:
+            self._price_depth -= 1
+            return
+        text = ''.join(self._price_text).strip()
+        if text:
+            self._current['_prices'].setdefault(self._price_field, ' '.join(text.split()))
+        self._price_field = None
+
+    def handle_data(self, data):
+        if self._price_field:
+            self._price_text.append(data)
+
+
+class VariationParser(HTMLParser):
+    """
+    从 Product-Variation 片段中提取价格、尺码可售状态和颜色色块。
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.price = None
+        self.sizes = []
+        self.colors = []
+        self._in_price = False
+        self._in_size_top = False
+        self._size_li_available = None
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        classes = (attrs.get('class') or '').split()
+        if tag == 'span' and ('price-standard' in classes or 'price-sales' in classes) and self.price is None:
+            self._in_price = True
+        elif tag == 'li' and ('selectable' in classes or 'unselectable' in classes):
+            self._size_li_available = 'selectable' in classes
+        elif 'size-top' in classes:
+            self._in_size_top = True
+        elif 'swatchanchor' in classes and 'color' in classes:
+            self.colors.append({
+                'color': attrs.get('data-value'),
+                'url': absolute_url(attrs.get('data-selectionurl') or attrs.get('href')),
+            })
+
+    def handle_endtag(self, tag):
+        if tag == 'span':
+            self._in_price = False
+        if tag == 'li':
+            self._size_li_available = None
+
+    def handle_data(self, data):
+        text = data.strip()
+        if not text:
+            return
+        if self._in_price:
+            self.price = text
+            self._in_price = False
+        elif self._in_size_top:
+            self.sizes.append({
+                'size': text.replace(' US', ''),
+                'available': self._size_li_available is not False,
+            })
+            self._in_size_top = False
+
+
+def parse_grid_html(html):
+    parser = TileParser()
+    parser.feed(html)
+    return parser.tiles
+
+
+def harvest_tile_colors(tiles):
+    """
+    把 tile 上的颜色色块直接展开成颜色变体。
+    返回 (color_variants, urls_needing_visit)：色块完整的产品不必再打开详情页，
+    色块被截断或 tile 上没有色块的产品仍需要第三步逐个访问。
+    """
+    color_variants = []
+    urls_needing_visit = []
+    for tile in tiles:
+        if tile['colors_truncated'] or not tile['colors']:
+            urls_needing_visit.append(tile['url'])
+            continue
+        seen = set()
+        for swatch in tile['colors']:
+            key = sfcc_url.color_key(swatch['url'])
+            if key not in seen:
+                seen.add(key)
+                color_variants.append({'url': swatch['url'], 'color': swatch['color']})
+    return color_variants, urls_needing_visit
+
+
+def parse_variation_payload(text, content_type=''):
+    """
+    Product-Variation 可能返回 JSON（format=ajax）或 HTML 片段，两种都解析成同一结构。
+    """
+    if 'json' in content_type:
+        try:
+            return {'json': json.loads(text)}
+        except json.JSONDecodeError:
+            pass
+    parser = VariationParser()
+    parser.feed(text)
+    return {'price': parser.price, 'sizes': parser.sizes, 'colors': parser.colors}
+
+
+def classify_response(response):
+    url = response.url
+    if any(endpoint in url for endpoint in VARIATION_ENDPOINTS):
+        return 'variation'
+    if any(endpoint in url for endpoint in GRID_ENDPOINTS):
+        return 'grid'
+    try:
+        is_main_document = (response.request.resource_type == 'document'
+                            and response.request.frame.parent_frame is None)
+    except Exception:
+        is_main_document = False
+    return 'grid' if is_main_document else None
+
+
+class ResponseCapture:
+    """
+    挂在 page 上的响应采集器。tile_urls() 返回按出现顺序去重（按颜色键）后的产品链接。
+    """
+
+    def __init__(self, page, persist_path=None):
+        self.page = page
+        self.persist_path = persist_path
+        self.records = []
+        self._pending = set()
+
+    def attach(self):
+        self.page.on('response', self._on_response)
+        return self
+
+    def is_grid_response(self, response):
+        return classify_response(response) == 'grid' and response.request.resource_type != 'document'
+
+    def _on_response(self, response):
+        kind = classify_response(response)
+        if kind is None or response.status != 200:
+            return
+        # 先占位，保证记录顺序与响应到达顺序一致
+        slot = len(self.records)
+        self.records.append(None)
+        task = asyncio.ensure_future(self._parse(kind, response, slot))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    async def _parse(self, kind, response, slot):
+        try:
+            text = await response.text()
+        except Exception:
+            return
+        content_type = response.headers.get('content-type', '')
+        record = {'kind': kind, 'url': response.url, 'captured_at': time.time()}
+        if kind == 'grid':
+            record['tiles'] = parse_grid_html(text)
+        else:
+            record.update(parse_variation_payload(text, content_type))
+        self.records[slot] = record
+
+        if self.persist_path:
+            with open(self.persist_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+    async def drain(self):
+        """
+        等待所有已到达响应的解析任务完成。
+        """
+        if self._pending:
+            await asyncio.gather(*list(self._pending), return_exceptions=True)
+
+    def tiles(self):
+        seen = set()
+        tiles = []
+        for record in self.records:
+            if record is None:
+                continue
+            for tile in record.get('tiles', []):
+                key = sfcc_url.color_key(tile['url'])
+                if key not in seen:
+                    seen.add(key)
+                    tiles.append(tile)
+        return tiles
+
+    def tile_urls(self):
+        return [tile['url'] for tile in self.tiles()]
@@ -1,88 +1,200 @@
 # -*- coding: utf-8 -*-
+"""
+颜色变体 URL 去重。
+
+输入按条流式读取，分块写入磁盘上的临时 SQLite 表；由 SQLite 按详情阶段的去重键（variation_fetch.detail_key）外部排序后逐组合并：
+采集宽度矩阵时为颜色键（站点、语言、pid、颜色），同一颜色的不同宽度合并为一条（详情阶段在一个页面内读取所有宽度的尺码）；
+WIDTH_MATRIX=0 时为变体键，不同宽度分别保留。
+内存占用与输入规模无关。同一键的多条记录合并 level1/level2 分类集合，color/level3 保留首个非空值，
+不一致的情况只做统计，最后输出汇总而不是逐条打印。
+variation_matrix.py 输出的 price、size_matrix、matrix_color 字段保留首个非空值，原样带到输出中。
+
+颜色变体来自两处，本脚本把它们合并后一起去重：
+    1. 第二步（多线程）：分类网格 tile 上直接得到的颜色变体写入 第二步_网格颜色变体.json，
+       色块不完整、仍需展开颜色的产品写入 第二步_需展开颜色的产品链接.json
+    2. 第三步（STEP3_INPUT=第二步_需展开颜色的产品链接.json）：逐个打开这些产品展开颜色，
+       结果（第三步_所有颜色变体.json）另存为 所有颜色变体URL_Cursor.json
+    3. 本脚本：读取 所有颜色变体URL_Cursor.json 和 第二步_网格颜色变体.json，合并去重
+输入文件按顺序读取，同一颜色的 color/level3 保留先读到的值；不存在的输入文件跳过并提示。
+
+环境变量：
+    DEDUP_INPUT              输入文件，多个用逗号分隔（默认 所有颜色变体URL_Cursor.json,第二步_网格颜色变体.json，
+                             也支持 .jsonl）
+    DEDUP_OUTPUT             输出文件（默认 所有颜色变体URL_Cursor_dedup.json）
+    DEDUP_CHUNK_SIZE         每次批量写入临时表的条数（默认 50000）
+    DEDUP_TMP_DIR            临时数据库目录（默认系统临时目录）
+    WIDTH_MATRIX             与详情阶段一致（见 variation_fetch.py），为 0 时按变体键去重
+"""
 import json
-from collections import defaultdict
+import os
+import sqlite3
+import tempfile
+import time
 
-INPUT_FILE = '所有颜色变体URL_Cursor.json'
-OUTPUT_FILE = '所有颜色变体URL_Cursor_dedup.json'
+import json_stream
+import variation_fetch
 
+INPUT_FILES = [path.strip() for path in
+               os.getenv('DEDUP_INPUT', '所有颜色变体URL_Cursor.json,第二步_网格颜色变体.json').split(',') if path.strip()]
+OUTPUT_FILE = os.getenv('DEDUP_OUTPUT', '所有颜色变体URL_Cursor_dedup.json')
+CHUNK_SIZE = int(os.getenv('DEDUP_CHUNK_SIZE', '50000'))
+CONFLICT_EXAMPLES = 5
+# 原样带到输出中的附加字段（variation_matrix.py 的款式矩阵结果）
+CARRIED_FIELDS = ('price', 'size_matrix', 'matrix_color')
 
-def main():
-    try:
-        with open(INPUT_FILE, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-    except FileNotFoundError:
-        print(f"错误：未找到输入文件 {INPUT_FILE}")
-        return
-    except json.JSONDecodeError as e:
-        print(f"错误：无法解析 {INPUT_FILE} 的JSON：{e}")
-        return
 
-    if not isinstance(data, list):
-        print("错误：输入JSON顶层应为数组(list)")
-        return
+def _as_list(value):
+    if not value:
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+def _iter_inputs(paths):
+    for path in paths:
+        for item in json_stream.iter_records(path):
+            yield item
 
-    grouped = {}
 
-    for idx, item in enumerate(data):
+def load_input(conn, stats, paths):
+    """
+    按顺序流式读取各输入文件，分块写入临时表 raw。
+    """
+    conn.execute('CREATE TABLE raw (seq INTEGER PRIMARY KEY, key TEXT, url TEXT, color TEXT, level3 TEXT, '
+                 'level1 TEXT, level2 TEXT, extra TEXT)')
+    rows = []
+    for seq, item in enumerate(_iter_inputs(paths)):
+        stats['input'] += 1
         if not isinstance(item, dict):
-            print(f"警告：第{idx}项不是对象，已跳过")
+            stats['skipped_not_object'] += 1
             continue
-
         url = item.get('url')
         if not url:
-            print(f"警告：第{idx}项缺少url字段，已跳过")
+            stats['skipped_no_url'] += 1
             continue
+        level1 = _as_list(item.get('level1_category'))
+        level2 = _as_list(item.get('level2_category'))
+        carried = {field: item[field] for field in CARRIED_FIELDS if item.get(field) is not None}
+        extra = json.dumps(carried, ensure_ascii=False) if carried else None
+        # 一条记录有多个分类时拆成多行，合并时与单值记录一样处理
+        for i in range(max(len(level1), len(level2), 1)):
+            rows.append((
+                variation_fetch.detail_key(url), url,
+                item.get('color') if i == 0 else None,
+                item.get('level3_category') if i == 0 else None,
+                level1[i] if i < len(level1) else None,
+                level2[i] if i < len(level2) else None,
+                extra if i == 0 else None,
+            ))
+        if len(rows) >= CHUNK_SIZE:
+            conn.executemany('INSERT INTO raw (key, url, color, level3, level1, level2, extra) VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+            rows = []
+    if rows:
+        conn.executemany('INSERT INTO raw (key, url, color, level3, level1, level2, extra) VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+    conn.commit()
+
 
-        color = item.get('color')
-        level1 = item.get('level1_category')
-        level2 = item.get('level2_category')
-        level3 = item.get('level3_category')
-
-        if url not in grouped:
-            grouped[url] = {
-                'url': url,
-                'color': color,
-                'level3_category': level3,
-                'level1_category': set([level1]) if level1 else set(),
-                'level2_category': set([level2]) if level2 else set(),
-            }
+def _note_conflict(stats, field, key, first, other):
+    stats[f'{field}_conflicts'] += 1
+    examples = stats['examples']
+    if len(examples) < CONFLICT_EXAMPLES:
+        examples.append(f"{field} 不一致：{key} -> '{first}' vs '{other}'")
+
+
+def iter_merged(conn, stats):
+    """
+    按每个键首次出现的顺序输出合并后的记录，每次只在内存中保留一个分组。
+    """
+    conn.execute('CREATE TABLE groups AS SELECT key, MIN(seq) AS first_seq FROM raw GROUP BY key')
+    conn.execute('CREATE INDEX idx_groups_key ON groups(key)')
+    cursor = conn.execute(
+        'SELECT r.key, r.url, r.color, r.level3, r.level1, r.level2, r.extra FROM raw r '
+        'JOIN groups g ON g.key = r.key ORDER BY g.first_seq, r.seq'
+    )
+
+    group = None
+    for key, url, color, level3, level1, level2, extra in cursor:
+        if group is None or group['key'] != key:
+            if group is not None:
+                yield _finish(group)
+            group = {'key': key, 'url': url, 'urls': {url}, 'color': color, 'level3': level3,
+                     'level1': set(), 'level2': set(), 'extra': extra}
         else:
-            g = grouped[url]
-            # 校验color与level3一致性
-            if g.get('color') is None and color is not None:
-                g['color'] = color
-            elif color is not None and g.get('color') is not None and g['color'] != color:
-                print(f"警告：url相同但color不一致：{url} -> '{g['color']}' vs '{color}'，保留首次值")
-
-            if g.get('level3_category') is None and level3 is not None:
-                g['level3_category'] = level3
-            elif level3 is not None and g.get('level3_category') is not None and g['level3_category'] != level3:
-                print(f"警告：url相同但level3_category不一致：{url} -> '{g['level3_category']}' vs '{level3}'，保留首次值")
-
-            # 合并level1/level2分类
-            if level1:
-                g['level1_category'].add(level1)
-            if level2:
-                g['level2_category'].add(level2)
-
-    # 输出结果列表
-    output_list = []
-    for url, obj in grouped.items():
-        output_list.append({
-            'url': obj['url'],
-            'color': obj.get('color'),
-            'level3_category': obj.get('level3_category'),
-            # 将集合转为去重后的列表
-            'level1_category': sorted(list(obj['level1_category'])),
-            'level2_category': sorted(list(obj['level2_category'])),
-        })
-
-    try:
-        with open(OUTPUT_FILE, 'w', encoding='utf-8') as f:
-            json.dump(output_list, f, ensure_ascii=False, indent=4)
-        print(f"完成：共输入 {len(data)} 条，去重后 {len(output_list)} 条，已写入 {OUTPUT_FILE}")
-    except Exception as e:
-        print(f"错误：写出结果文件失败：{e}")
+            if url not in group['urls']:
+                group['urls'].add(url)
+                stats['merged_url_variants'] += 1
+            # color/level3 保留首个非空值，不一致只计数
+            if group['color'] is None:
+                group['color'] = color
+            elif color is not None and color != group['color']:
+                _note_conflict(stats, 'color', key, group['color'], color)
+            if group['level3'] is None:
+                group['level3'] = level3
+            elif level3 is not None and level3 != group['level3']:
+                _note_conflict(stats, 'level3_category', key, group['level3'], level3)
+            if group['extra'] is None:
+                group['extra'] = extra
+        if level1:
+            group['level1'].add(level1)
+        if level2:
+            group['level2'].add(level2)
+    if group is not None:
+        yield _finish(group)
+
+
+def _finish(group):
+    record = {
+        'url': group['url'],
+        'color': group['color'],
+        'level3_category': group['level3'],
+        # 将集合转为去重后的列表
+        'level1_category': sorted(group['level1']),
+        'level2_category': sorted(group['level2']),
+    }
+    if group['extra'] is not None:
+        record.update(json.loads(group['extra']))
+    return record
+
+
+def main():
+    paths = [path for path in INPUT_FILES if os.path.exists(path)]
+    for path in INPUT_FILES:
+        if path not in paths:
+            print(f"提示：未找到输入文件 {path}，跳过")
+    if not paths:
+        print(f"错误：未找到任何输入文件（{', '.join(INPUT_FILES)}）")
+        return
+
+    stats = {
+        'input': 0, 'skipped_not_object': 0, 'skipped_no_url': 0, 'merged_url_variants': 0,
+        'color_conflicts': 0, 'level3_category_conflicts': 0, 'examples': [],
+    }
+    start = time.time()
+    with tempfile.TemporaryDirectory(dir=os.getenv('DEDUP_TMP_DIR')) as tmp_dir:
+        conn = sqlite3.connect(os.path.join(tmp_dir, 'dedup.db'))
+        conn.execute('PRAGMA journal_mode=OFF')
+        conn.execute('PRAGMA synchronous=OFF')
+        try:
+            try:
+                load_input(conn, stats, paths)
+            except ValueError as e:
+                print(f"错误：无法解析输入文件（{', '.join(paths)}）的JSON：{e}")
+                return
+            try:
+                output_count = json_stream.write_json_array(OUTPUT_FILE, iter_merged(conn, stats))
+            except OSError as e:
+                print(f"错误：写出结果文件失败：{e}")
+                return
+        finally:
+            conn.close()
+
+    elapsed = time.time() - start
+    print(f"完成：{len(paths)} 个输入文件共 {stats['input']} 条，去重后 {output_count} 条，已写入 {OUTPUT_FILE}（耗时 {elapsed:.1f} 秒）")
+    if stats['skipped_not_object'] or stats['skipped_no_url']:
+        print(f"跳过：非对象 {stats['skipped_not_object']} 条，缺少url {stats['skipped_no_url']} 条")
+    print(f"合并：同一颜色（WIDTH_MATRIX=0 时同一变体）的不同宽度/URL写法 {stats['merged_url_variants']} 个，"
+          f"color 不一致 {stats['color_conflicts']} 处，level3_category 不一致 {stats['level3_category_conflicts']} 处（均保留首次值）")
+    for example in stats['examples']:
+        print(f"  例：{example}")
 
 
 if __name__ == '__main__':
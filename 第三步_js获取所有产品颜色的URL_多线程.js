@@ -53,7 +53,8 @@ class ProxyManager {
 async function main() {
     console.log("脚本开始运行...");
 
-    const initialUrlsFile = path.join(__dirname, '第二步_产品链接.json'); // 确保文件名正确
+    // 可通过 STEP3_INPUT 改为 第二步_需展开颜色的产品链接.json，只访问 tile 上色块不完整的产品
+    const initialUrlsFile = path.join(__dirname, process.env.STEP3_INPUT || '第二步_产品链接.json'); // 确保文件名正确
     const outputJsonFile = path.join(__dirname, '第三步_所有颜色变体.json');
     const processedUrlsFile = path.join(__dirname, '第三步已采集包含失败.json'); // 新增：记录已处理的URL
     const noColorsFoundFile = path.join(__dirname, '第三步失败无法采集.json'); // 新增：记录没找到颜色变体的URL
@@ -2,23 +2,44 @@
 import asyncio
 from playwright.async_api import async_playwright
 import json
+import time
 
-async def scrape_product_urls_from_category(browser, category_data):
+import asset_cache
+import category_fingerprint
+import metrics
+import nav_tree
+import sfcc_url
+import storage_state
+
+async def scrape_product_urls_from_category(browser, category_data, on_loaded=None, previous=None):
     """
     从单个分类页面上采集所有产品的URL。
+    on_loaded(page, category_data) 在所有产品加载完毕后调用，其他模式（例如 grid_price_refresh.py）借此复用同一套翻页流程读取网格。
+    previous 为上次输出中的同一分类，网格指纹未变时直接沿用其 product_urls（见 category_fingerprint.py）。
     """
     url = category_data['level3_url']
     all_product_urls = []
     context = None
     page = None
     try:
-        context = await browser.new_context()
+        context = await storage_state.new_context(browser, storage_state.locale_root(url))
+        await asset_cache.attach_if_enabled(context)
         page = await context.new_page()
+        metrics.attach_page(page, 'grid')
         print(f"正在导航到URL: {url}")
-        await page.goto(url, timeout=60000)
-        await page.wait_for_load_state('domcontentloaded')
+        with metrics.timer('grid', 'navigation'):
+            await page.goto(url, timeout=60000)
+            await page.wait_for_load_state('domcontentloaded')
+
+        # 结果数和首屏产品与上次相同：沿用上次的产品链接，不再点击“加载更多”
+        fingerprint = await category_fingerprint.page_fingerprint(page)
+        if category_fingerprint.is_unchanged(previous, fingerprint):
+            category_fingerprint.record(category_data, fingerprint, previous, skipped=True)
+            print(f"分类网格未变化，沿用上次的 {len(previous['product_urls'])} 个产品链接。")
+            return list(previous['product_urls']), category_data
 
         # 循环点击“加载更多”按钮，直到所有产品都加载完毕
+        exhausted = False
         while True:
             # 尝试查找“加载更多”按钮
             load_more_button_locator = page.locator('button.button-custom-black.outline')
@@ -29,28 +50,35 @@ async def scrape_product_urls_from_category(browser, category_data):
                 try:
                     await load_more_button_locator.click(timeout=5000) # 增加点击超时时间
                     # 等待一段时间，让新产品加载出来
-                    await page.wait_for_timeout(2000)
+                    await metrics.wait(page, 'grid', 2000)
                 except Exception as click_e:
                     print(f"点击 '加载更多' 按钮时发生错误: {click_e}")
                     break # 如果点击失败，则退出循环
             else:
                 print("未找到 '加载更多' 按钮，或所有产品已加载完毕。")
+                exhausted = True
                 break
 
-        # 提取所有产品链接
-        product_tile_elements = await page.query_selector_all('a.product-tile')
-        if not product_tile_elements:
-            print("在此页面上第二步_未找到任何产品接。")
+        # 只有完整翻完的网格才写入新指纹；中途失败时保留上次的指纹，下次不会沿用这次不完整的结果
+        if exhausted:
+            category_fingerprint.record(category_data, fingerprint)
         else:
-            for element in product_tile_elements:
-                href = await element.get_attribute('href')
-                if href:
-                    # 确保URL是完整的
-                    if href.startswith('/'):
-                        full_url = f'https://www.birkenstock.com{href}'
-                    else:
-                        full_url = href
-                    all_product_urls.append(full_url)
+            category_fingerprint.keep_previous(category_data, previous)
+
+        if on_loaded is not None:
+            await on_loaded(page, category_data)
+
+        # 提取所有产品链接
+        with metrics.timer('grid', 'extraction'):
+            product_tile_elements = await page.query_selector_all('a.product-tile')
+            if not product_tile_elements:
+                print("在此页面上第二步_未找到任何产品接。")
+            else:
+                for element in product_tile_elements:
+                    href = await element.get_attribute('href')
+                    if href:
+                        # 确保URL是完整的
+                        all_product_urls.append(sfcc_url.absolute_url(href))
     except Exception as e:
         print(f"采集 {url} 时发生错误: {e}")
     finally:
@@ -61,30 +89,18 @@ async def scrape_product_urls_from_category(browser, category_data):
     
     return all_product_urls, category_data
 
-async def main():
+def third_level_categories(categories_data):
     """
-    主函数，用于组织整个采集流程。
+    从导航目录中展开所有三级分类（包括名称和URL），兼容 children 和 sub_categories 两种结构。
     """
-    # 步骤 1: 从JSON文件中读取分类信息
-    try:
-        with open('第一步_导航目录.json', 'r', encoding='utf-8') as f:
-            categories_data = json.load(f)
-    except FileNotFoundError:
-        print("错误: 未找到 第一步_导航目录.json 文件。")
-        return
-    except json.JSONDecodeError:
-        print("错误: 解析 第一步_导航目录.json 文件失败。")
-        return
-
-    # 步骤 2: 查找所有三级分类信息（包括名称和URL）
     third_level_categories_to_scrape = []
     for level1_cat in categories_data:
         level1_category = level1_cat.get('level1_category')
         level1_url = level1_cat.get('level1_url')
-        for level2_cat in level1_cat.get('children', []):
+        for level2_cat in nav_tree.children(level1_cat):
             level2_category = level2_cat.get('level2_category')
             level2_url = level2_cat.get('level2_url')
-            for level3_cat in level2_cat.get('children', []):
+            for level3_cat in nav_tree.children(level2_cat):
                 if 'level3_url' in level3_cat and 'level3_category' in level3_cat:
                     third_level_categories_to_scrape.append({
                         "level1_category": level1_category,
@@ -95,6 +111,25 @@ async def main():
                         "level3_url": level3_cat['level3_url'],
                         "product_urls": [] # 初始化一个空列表来存储产品URL
                     })
+    return third_level_categories_to_scrape
+
+async def main():
+    """
+    主函数，用于组织整个采集流程。
+    """
+    # 步骤 1: 从JSON文件中读取分类信息
+    try:
+        with open('第一步_导航目录.json', 'r', encoding='utf-8') as f:
+            categories_data = json.load(f)
+    except FileNotFoundError:
+        print("错误: 未找到 第一步_导航目录.json 文件。")
+        return
+    except json.JSONDecodeError:
+        print("错误: 解析 第一步_导航目录.json 文件失败。")
+        return
+
+    # 步骤 2: 查找所有三级分类信息（包括名称和URL）
+    third_level_categories_to_scrape = third_level_categories(categories_data)
     if not third_level_categories_to_scrape:
         print("未找到任何三级分类。")
         return
@@ -102,6 +137,15 @@ async def main():
     final_third_level_categories = third_level_categories_to_scrape
     
     print(f"找到 {len(final_third_level_categories)} 个三级分类进行采集。")
+    # 上次的结果：网格指纹未变的分类沿用其中的产品链接
+    previous_categories = category_fingerprint.load_previous()
+    # 本次使用的导航版本，保存结果后确认，第一步之后的差异从这个版本算起
+    nav_version = nav_tree.diff_version()
+    start_time = time.time()
+    # NAV_CHANGED_ONLY=1：只采集导航结构有变化的分类，其余直接沿用上次的记录
+    categories_to_scrape, kept_categories = nav_tree.split_by_changes(final_third_level_categories, previous_categories)
+    if kept_categories:
+        print(f"导航结构未变化的 {len(kept_categories)} 个分类沿用上次的记录，本次采集 {len(categories_to_scrape)} 个。")
 
     # 步骤 3: 采集所有找到的三级分类下的产品URL
     total_product_urls_count = 0
@@ -115,11 +159,12 @@ async def main():
 
         async def bounded_scrape(browser, category_data, semaphore):
             async with semaphore:
-                return await scrape_product_urls_from_category(browser, category_data)
+                return await scrape_product_urls_from_category(
+                    browser, category_data, previous=previous_categories.get(category_data['level3_url']))
 
         # 创建一个列表来存储所有的异步任务
         tasks = []
-        for category_data in final_third_level_categories:
+        for category_data in categories_to_scrape:
             tasks.append(bounded_scrape(browser, category_data, semaphore))
         
         # 并发运行所有任务
@@ -139,13 +184,22 @@ async def main():
 
         await browser.close()
 
+    # 沿用的记录按导航顺序放回原位置
+    kept_by_url = {c['level3_url']: c for c in kept_categories}
+    final_third_level_categories = [kept_by_url.get(c['level3_url'], c) for c in final_third_level_categories]
+
     # 步骤 4: 将包含三级分类和产品URL的结果保存到文件
     print(f"总共找到 {total_product_urls_count} 个产品URL。")
+    skipped_count = sum(1 for c in final_third_level_categories
+                        if c.get('fingerprint', {}).get('traversed_at', start_time) < start_time
+                        and not c['fingerprint'].get('incomplete'))
+    print(f"其中 {skipped_count} 个分类未重新翻页，沿用了上次的产品链接。")
 
-    with open('第二步_产品链接.json', 'w', encoding='utf-8') as f:
+    with metrics.timer('grid', 'write'), open('第二步_产品链接.json', 'w', encoding='utf-8') as f:
         json.dump(final_third_level_categories, f, ensure_ascii=False, indent=4)
     
     print("所有三级分类及其下的产品URL已成功保存到 第二步_产品链接.json 文件。")
+    nav_tree.acknowledge(nav_version)
 
     # 步骤 5: 将未找到产品链接的URL保存到单独的文件
     if urls_without_products:
@@ -154,6 +208,7 @@ async def main():
         print(f"已将 {len(urls_without_products)} 个未找到产品链接的URL保存到 第二步_未找到任何产品接.json 文件。")
     else:
         print("所有分类页面都找到了产品链接，未生成 第二步_未找到任何产品接.json 文件。")
+    metrics.finish('grid')
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -11,6 +11,13 @@ import os
 sys.path.append(os.path.join(os.path.dirname(__file__), 'proxy'))
 from proxy import ProxyManager
 
+import asset_cache
+import category_fingerprint
+import metrics
+import nav_tree
+import storage_state
+import xhr_capture
+
 class ProxyRotator:
     """
     代理轮换器，为每个任务分配代理
@@ -110,9 +117,19 @@ class ProxyRotator:
         """获取可用代理数量"""
         return len(self.working_proxies)
 
-async def scrape_product_urls_from_category(browser, category_data, semaphore, proxy_info=None):
+def reuse_color_fields(category_data, previous):
+    """
+    沿用上次记录中的 tile 颜色变体和仍需访问详情页的产品（上次的记录没有这两个字段时不复制，全部产品交给第三步）。
+    """
+    for field in ('color_variants', 'urls_needing_color_visit'):
+        if field in previous:
+            category_data[field] = list(previous[field])
+
+
+async def scrape_product_urls_from_category(browser, category_data, semaphore, proxy_info=None, previous=None):
     """
     从单个分类页面上采集所有产品的URL。
+    previous 为上次输出中的同一分类，网格指纹未变时直接沿用其 product_urls（见 category_fingerprint.py）。
     """
     async with semaphore:  # 使用信号量控制并发
         url = category_data['level3_url']
@@ -126,19 +143,37 @@ async def scrape_product_urls_from_category(browser, category_data, semaphore, p
                 # Playwright不支持带认证的SOCKS5代理，所以使用直连模式
                 # 但我们可以记录代理信息用于其他用途
                 print(f"  [{category_data['level3_category']}] 代理信息: {proxy_info['ip']}:{proxy_info['port']} (Playwright不支持带认证的SOCKS5代理，使用直连模式)")
-                context = await browser.new_context()
+                context = await storage_state.new_context(browser, storage_state.locale_root(url))
             else:
-                context = await browser.new_context()
+                context = await storage_state.new_context(browser, storage_state.locale_root(url))
                 print(f"  [{category_data['level3_category']}] 使用直连模式")
             
+            await asset_cache.attach_if_enabled(context)
             page = await context.new_page()
+            metrics.attach_page(page, 'grid')
             print(f"正在处理: {category_data['level3_category']} - {url}")
             
-            await page.goto(url, timeout=60000)
-            await page.wait_for_load_state('domcontentloaded')
+            # XHR_CAPTURE=1：直接解析首屏文档和“加载更多”的响应，不再在最后遍历整个网格 DOM
+            capture = None
+            if os.getenv('XHR_CAPTURE', '0') == '1':
+                capture = xhr_capture.ResponseCapture(page, os.getenv('XHR_CAPTURE_FILE')).attach()
+
+            with metrics.timer('grid', 'navigation'):
+                await page.goto(url, timeout=60000)
+                await page.wait_for_load_state('domcontentloaded')
+
+            # 结果数和首屏产品与上次相同：沿用上次的产品链接，不再点击"加载更多"
+            fingerprint = await category_fingerprint.page_fingerprint(page)
+            if category_fingerprint.is_unchanged(previous, fingerprint):
+                category_fingerprint.record(category_data, fingerprint, previous, skipped=True)
+                # tile 颜色变体和仍需访问详情页的产品同样沿用上次的结果
+                reuse_color_fields(category_data, previous)
+                print(f"  [{category_data['level3_category']}] 分类网格未变化，沿用上次的 {len(previous['product_urls'])} 个产品URL")
+                return list(previous['product_urls']), category_data
 
             # 循环点击"加载更多"按钮，直到所有产品都加载完毕
             load_more_count = 0
+            exhausted = False
             while True:
                 # 尝试查找"加载更多"按钮
                 load_more_button_locator = page.locator('button.button-custom-black.outline')
@@ -148,33 +183,55 @@ async def scrape_product_urls_from_category(browser, category_data, semaphore, p
                     load_more_count += 1
                     print(f"  [{category_data['level3_category']}] 第{load_more_count}次点击 '加载更多' 按钮...")
                     try:
-                        await load_more_button_locator.click(timeout=5000)
-                        # 等待新产品加载
-                        await page.wait_for_timeout(2000)
+                        if capture:
+                            # 等到网格响应返回即可，不必固定等待
+                            async with page.expect_response(capture.is_grid_response, timeout=10000):
+                                await load_more_button_locator.click(timeout=5000)
+                            await metrics.wait(page, 'grid', 300)
+                        else:
+                            await load_more_button_locator.click(timeout=5000)
+                            # 等待新产品加载
+                            await metrics.wait(page, 'grid', 2000)
                     except Exception as click_e:
                         print(f"  [{category_data['level3_category']}] 点击 '加载更多' 按钮失败: {click_e}")
                         break
                 else:
                     if load_more_count > 0:
                         print(f"  [{category_data['level3_category']}] 已加载完毕，共点击了 {load_more_count} 次")
+                    exhausted = True
                     break
 
-            # 提取所有产品链接
-            product_tile_elements = await page.query_selector_all('a.product-tile')
-            if not product_tile_elements:
+            # 只有完整翻完的网格才写入新指纹；中途失败时保留上次的指纹，下次不会沿用这次不完整的结果
+            if exhausted:
+                category_fingerprint.record(category_data, fingerprint)
+            else:
+                category_fingerprint.keep_previous(category_data, previous)
+
+            # 提取所有产品 tile（链接和 tile 上的颜色色块）
+            extraction_started = time.perf_counter()
+            tiles = []
+            if capture:
+                await capture.drain()
+                tiles = capture.tiles()
+                if tiles:
+                    print(f"  [{category_data['level3_category']}] 从响应中解析到 {len(tiles)} 个产品 tile")
+                else:
+                    print(f"  [{category_data['level3_category']}] 响应中未解析到产品，改为读取 DOM")
+            if not tiles:
+                # 一次取回页面 HTML 再解析，不再对每个元素逐个 get_attribute
+                tiles = xhr_capture.parse_grid_html(await page.content())
+            metrics.observe('grid', 'extraction_seconds', time.perf_counter() - extraction_started)
+
+            if not tiles:
                 print(f"  [{category_data['level3_category']}] 未找到任何产品链接")
             else:
-                for element in product_tile_elements:
-                    href = await element.get_attribute('href')
-                    if href:
-                        # 确保URL是完整的
-                        if href.startswith('/'):
-                            full_url = f'https://www.birkenstock.com{href}'
-                        else:
-                            full_url = href
-                        all_product_urls.append(full_url)
-                
-                print(f"  [{category_data['level3_category']}] 成功采集到 {len(all_product_urls)} 个产品URL")
+                all_product_urls = [tile['url'] for tile in tiles]
+                # tile 上已有完整色块的产品直接得到颜色变体，第三步只需访问其余产品
+                color_variants, urls_needing_visit = xhr_capture.harvest_tile_colors(tiles)
+                category_data['color_variants'] = color_variants
+                category_data['urls_needing_color_visit'] = urls_needing_visit
+                print(f"  [{category_data['level3_category']}] 成功采集到 {len(all_product_urls)} 个产品URL，"
+                      f"tile 上得到 {len(color_variants)} 个颜色变体，{len(urls_needing_visit)} 个产品仍需访问详情页")
                 
         except Exception as e:
             print(f"  [{category_data['level3_category']}] 采集时发生错误: {e}")
@@ -212,10 +269,10 @@ async def main():
     for level1_cat in categories_data:
         level1_category = level1_cat.get('level1_category')
         level1_url = level1_cat.get('level1_url')
-        for level2_cat in level1_cat.get('children', []):
+        for level2_cat in nav_tree.children(level1_cat):
             level2_category = level2_cat.get('level2_category')
             level2_url = level2_cat.get('level2_url')
-            for level3_cat in level2_cat.get('children', []):
+            for level3_cat in nav_tree.children(level2_cat):
                 if 'level3_url' in level3_cat and 'level3_category' in level3_cat:
                     third_level_categories_to_scrape.append({
                         "level1_category": level1_category,
@@ -232,12 +289,48 @@ async def main():
         return
 
     print(f"找到 {len(third_level_categories_to_scrape)} 个三级分类进行采集。")
+    # 上次的结果：网格指纹未变的分类沿用其中的产品链接
+    previous_categories = category_fingerprint.load_previous()
+    # 本次使用的导航版本，保存结果后确认，第一步之后的差异从这个版本算起
+    nav_version = nav_tree.diff_version()
+    # NAV_CHANGED_ONLY=1：只采集导航结构有变化的分类，其余直接沿用上次的记录（颜色仍交给第三步展开）
+    third_level_categories_to_scrape, kept_categories = nav_tree.split_by_changes(
+        third_level_categories_to_scrape, previous_categories)
+    if kept_categories:
+        print(f"导航结构未变化的 {len(kept_categories)} 个分类沿用上次的记录，本次采集 {len(third_level_categories_to_scrape)} 个。")
     print("开始异步5线程处理...")
 
     # 步骤 3: 使用异步5线程采集产品URL
     total_product_urls_count = 0
     urls_without_products = []
     processed_categories = []
+    tile_color_variants = []
+    color_visit_categories = []
+
+    def collect(category_data):
+        """
+        把一个分类的结果加入输出：tile 颜色变体进入网格颜色变体文件，其余产品交给第三步展开颜色。
+        color_variants / urls_needing_color_visit 保留在分类记录中，下次沿用该分类时不必重新判断。
+        """
+        for variant in category_data.get('color_variants', []):
+            tile_color_variants.append({
+                'url': variant['url'],
+                'color': variant['color'],
+                'level1_category': category_data['level1_category'],
+                'level2_category': category_data['level2_category'],
+                'level3_category': category_data['level3_category'],
+            })
+        urls_needing_visit = category_data.get('urls_needing_color_visit', category_data['product_urls'])
+        if urls_needing_visit:
+            visit_category = {key: value for key, value in category_data.items()
+                              if key not in ('color_variants', 'urls_needing_color_visit')}
+            visit_category['product_urls'] = urls_needing_visit
+            color_visit_categories.append(visit_category)
+        processed_categories.append(category_data)
+
+    for category_data in kept_categories:
+        collect(category_data)
+        total_product_urls_count += len(category_data['product_urls'])
     
     async with async_playwright() as p:
         browser = await p.chromium.launch(headless=False)
@@ -262,7 +355,8 @@ async def main():
             # 创建当前批次的异步任务
             batch_tasks = []
             for category_data in batch:
-                task = scrape_product_urls_from_category(browser, category_data, semaphore, proxy_rotator.get_next_proxy())
+                task = scrape_product_urls_from_category(browser, category_data, semaphore, proxy_rotator.get_next_proxy(),
+                                                         previous_categories.get(category_data['level3_url']))
                 batch_tasks.append(task)
             
             # 等待当前批次完成
@@ -276,7 +370,7 @@ async def main():
                     
                 scraped_urls, original_category_data = result
                 original_category_data['product_urls'] = scraped_urls
-                processed_categories.append(original_category_data)
+                collect(original_category_data)
                 total_product_urls_count += len(scraped_urls)
                 
                 if not scraped_urls:
@@ -297,18 +391,35 @@ async def main():
     print(f"总共采集到 {total_product_urls_count} 个产品URL")
     print(f"成功处理 {len(processed_categories)} 个分类")
     print(f"未找到产品的分类: {len(urls_without_products)} 个")
+    skipped_count = sum(1 for c in processed_categories
+                        if c.get('fingerprint', {}).get('traversed_at', start_time) < start_time
+                        and not c['fingerprint'].get('incomplete'))
+    print(f"未重新翻页、沿用上次产品链接的分类: {skipped_count} 个")
     print(f"使用的代理数量: {proxy_rotator.get_proxy_count()}")
 
     # 保存包含产品URL的分类数据
-    with open('第二步_产品链接.json', 'w', encoding='utf-8') as f:
+    with metrics.timer('grid', 'write'), open('第二步_产品链接.json', 'w', encoding='utf-8') as f:
         json.dump(processed_categories, f, ensure_ascii=False, indent=4)
     print("产品链接数据已保存到 第二步_产品链接.json")
+    nav_tree.acknowledge(nav_version)
+
+    # 保存 tile 上直接得到的颜色变体（与第三步输出结构相同），以及仍需第三步逐个访问的产品
+    with open('第二步_网格颜色变体.json', 'w', encoding='utf-8') as f:
+        json.dump(tile_color_variants, f, ensure_ascii=False, indent=4)
+    with open('第二步_需展开颜色的产品链接.json', 'w', encoding='utf-8') as f:
+        json.dump(color_visit_categories, f, ensure_ascii=False, indent=4)
+    visit_count = sum(len(c['product_urls']) for c in color_visit_categories)
+    print(f"tile 上直接得到 {len(tile_color_variants)} 个颜色变体，已保存到 第二步_网格颜色变体.json")
+    print(f"仍需访问详情页展开颜色的产品 {visit_count} 个，已保存到 第二步_需展开颜色的产品链接.json")
+    print("下一步：STEP3_INPUT=第二步_需展开颜色的产品链接.json 运行第三步，结果另存为 所有颜色变体URL_Cursor.json 后，"
+          "运行 去重_所有颜色变体URL_Cursor_copy.py 与 第二步_网格颜色变体.json 合并去重")
 
     # 保存未找到产品的URL
     if urls_without_products:
         with open('第二步_未找到任何产品.json', 'w', encoding='utf-8') as f:
             json.dump(urls_without_products, f, ensure_ascii=False, indent=4)
         print("未找到产品的URL已保存到 第二步_未找到任何产品.json")
+    metrics.finish('grid')
 
 if __name__ == "__main__":
     asyncio.run(main())